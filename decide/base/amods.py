@@ -0,0 +1,169 @@
+"""
+Asynchronous version of base.mods, to run independent queries to other
+modules at the same time.
+
+>>> voting, census = amods.sync_gather(
+...     amods.get("voting", params={"id": 1}),
+...     amods.get("census", params={"voting_id": 1}),
+... )
+
+The queries to other servers are sent with httpx when it's installed and
+run by base.mods in worker threads when it isn't. The queries to the
+modules dispatched inside this process (settings.MODS_LOCAL_DISPATCH) run
+in worker threads too, with database connections of their own, unless the
+caller is inside a transaction: the other connections wouldn't see its
+changes, so then they run one after another in its thread.
+"""
+
+import asyncio
+import contextvars
+import json
+import urllib
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import connection, connections
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import mods, wire
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# httpx client shared by the queries of a gather
+_client = contextvars.ContextVar("amods_client", default=None)
+# True when the local dispatches can use connections of other threads
+_local_threads = contextvars.ContextVar("amods_local_threads", default=False)
+
+
+def in_thread(modname, baseurl=None):
+    """
+    True if the query must run in the thread of the caller
+    """
+
+    mocked = getattr(mods.query, "mocked", False)
+    local = mods.dispatches_locally(modname, baseurl)
+    return mocked or (local and not _local_threads.get())
+
+
+def local_query(*args, **kwargs):
+    """
+    base.mods.query in a worker thread, closing the connections it opened
+    """
+
+    try:
+        return mods.query(*args, **kwargs)
+    finally:
+        connections.close_all()
+
+
+def new_client():
+    timeout = httpx.Timeout(
+        settings.MODS_READ_TIMEOUT, connect=settings.MODS_CONNECT_TIMEOUT
+    )
+    limits = httpx.Limits(max_connections=settings.MODS_HOST_CONCURRENCY)
+    transport = httpx.AsyncHTTPTransport(retries=settings.MODS_RETRIES)
+    return httpx.AsyncClient(timeout=timeout, limits=limits, transport=transport)
+
+
+async def send(client, modname, entry_point, method, baseurl, **kwargs):
+    mod = baseurl or settings.APIS.get(modname, settings.BASEURL)
+    url = "{}/{}{}".format(mod, modname, entry_point)
+    params = kwargs.get("params", None)
+    if params:
+        url += "?{}".format(urllib.parse.urlencode(params))
+
+    headers = {}
+    if "HTTP_AUTHORIZATION" in kwargs:
+        headers["Authorization"] = kwargs["HTTP_AUTHORIZATION"]
+    binary = kwargs.get("wire", "json") == "binary"
+    if binary:
+        headers["Accept"] = wire.CONTENT_TYPE
+
+    data = None
+    if method != "get":
+        json_data = kwargs.get("json", {})
+        if binary:
+            headers["Content-Type"] = wire.CONTENT_TYPE
+            data = wire.dumps(*wire.split(json_data))
+        else:
+            headers["Content-Type"] = "application/json"
+            data = json.dumps(json_data, cls=JSONEncoder)
+
+    timeout = kwargs.get("timeout", None)
+    if timeout is not None:
+        timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+    else:
+        timeout = httpx.USE_CLIENT_DEFAULT
+    return await client.request(
+        method, url, content=data, headers=headers, timeout=timeout
+    )
+
+
+async def query(modname, entry_point="/", method="get", baseurl=None, **kwargs):
+    """
+    Like base.mods.query, awaiting the response
+    """
+
+    if in_thread(modname, baseurl):
+        q = sync_to_async(mods.query, thread_sensitive=True)
+    elif mods.dispatches_locally(modname, baseurl):
+        q = sync_to_async(local_query, thread_sensitive=False)
+    elif httpx is None:
+        q = sync_to_async(mods.query, thread_sensitive=False)
+    else:
+        q = None
+
+    if q:
+        return await q(modname, entry_point, method, baseurl, **kwargs)
+
+    client = _client.get()
+    if client is None:
+        # a single query, with a client of its own
+        (result,) = await gather(query(modname, entry_point, method, baseurl, **kwargs))
+        return result
+
+    response = await send(client, modname, entry_point, method, baseurl, **kwargs)
+    if kwargs.get("response", False):
+        return response
+    return mods.decode(response)
+
+
+async def get(*args, **kwargs):
+    return await query(*args, method="get", **kwargs)
+
+
+async def post(*args, **kwargs):
+    return await query(*args, method="post", **kwargs)
+
+
+async def gather(*queries):
+    """
+    Runs the queries (the coroutines of query, get or post) at the same
+    time and returns their results in the same order. The first error is
+    raised.
+    """
+
+    if httpx is None:
+        return list(await asyncio.gather(*queries))
+
+    async with new_client() as client:
+        token = _client.set(client)
+        try:
+            return list(await asyncio.gather(*queries))
+        finally:
+            _client.reset(token)
+
+
+def sync_gather(*queries):
+    """
+    gather for the synchronous code, like the views
+    """
+
+    token = _local_threads.set(not connection.in_atomic_block)
+    try:
+        return async_to_sync(gather)(*queries)
+    finally:
+        _local_threads.reset(token)
@@ -0,0 +1,100 @@
+"""
+Requests to the modules served by this same server, run through the
+middleware and the views of Django inside the process instead of going
+back to the server through HTTP.
+
+Used by base.mods for the local modules in settings.MODS_LOCAL_DISPATCH.
+The response has the part of the requests.Response API used by the
+callers of base.mods: status_code, headers, content, text and json().
+"""
+
+import io
+import json
+import threading
+import urllib
+
+from django.core.handlers.base import BaseHandler
+from django.core.handlers.wsgi import WSGIRequest
+
+_handler = None
+_handler_lock = threading.Lock()
+
+
+class LocalHandler(BaseHandler):
+    """
+    Handler with the middleware of the project, like the WSGI one but
+    without the request_started/request_finished signals, that would
+    close the database connection of the request that's running
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.load_middleware()
+
+
+class LocalResponse:
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        if response.streaming:
+            self.content = b"".join(response.streaming_content)
+        else:
+            self.content = response.content
+        self.charset = response.charset
+
+    @property
+    def text(self):
+        return self.content.decode(self.charset or "utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def get_handler():
+    global _handler
+
+    with _handler_lock:
+        if _handler is None:
+            _handler = LocalHandler()
+        return _handler
+
+
+def environ(method, url, data=None, headers=None):
+    parts = urllib.parse.urlsplit(url)
+    data = data or b""
+    if isinstance(data, str):
+        data = data.encode()
+    headers = dict(headers or {})
+
+    env = {
+        "REQUEST_METHOD": method.upper(),
+        "SCRIPT_NAME": "",
+        "PATH_INFO": urllib.parse.unquote(parts.path),
+        "QUERY_STRING": parts.query,
+        "SERVER_NAME": parts.hostname or "localhost",
+        "SERVER_PORT": str(parts.port or (443 if parts.scheme == "https" else 80)),
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "REMOTE_ADDR": "127.0.0.1",
+        "CONTENT_TYPE": headers.pop("Content-Type", ""),
+        "CONTENT_LENGTH": str(len(data)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": parts.scheme or "http",
+        "wsgi.input": io.BytesIO(data),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in headers.items():
+        env["HTTP_" + name.upper().replace("-", "_")] = value
+    return env
+
+
+def request(method, url, data=None, headers=None):
+    """
+    Runs the request to url, a full url of this server, and returns the
+    LocalResponse
+    """
+
+    req = WSGIRequest(environ(method, url, data, headers))
+    return LocalResponse(get_handler().get_response(req))
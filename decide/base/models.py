@@ -29,11 +29,17 @@ class Auth(models.Model):
         return self.url
 
 
+# "" is ElGamal over the multiplicative group mod p, the rest are the
+# elliptic curves of mixnet.eccrypt
+CURVES = [("", "ElGamal"), ("p256", "EC ElGamal P-256")]
+
+
 class Key(models.Model):
     p = BigBigField()
     g = BigBigField()
     y = BigBigField()
     x = BigBigField(blank=True, null=True)
+    curve = models.CharField(max_length=16, blank=True, default="", choices=CURVES)
 
     def __str__(self):
         if self.x:
@@ -1,6 +1,10 @@
+import functools
+import json
 import urllib
-import requests
 from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import dispatch, pool, wire
 
 
 def query(modname, entry_point="/", method="get", baseurl=None, **kwargs):
@@ -21,6 +25,15 @@ def query(modname, entry_point="/", method="get", baseurl=None, **kwargs):
     you can complete the query with GET params using the **params** keyword
     and with json data, using the **json** keyword.
 
+    Ciphertext batches can be sent and received in the binary format of
+    base.wire with **wire="binary"**, the data is given and returned like
+    in the json format.
+
+    The modules served by this server are queried inside the process,
+    through the views of Django, see settings.MODS_LOCAL_DISPATCH. The
+    rest are queried through the connection pools of base.pool, with the
+    timeouts of the settings or the (connect, read) **timeout** given.
+
     Examples
 
     >>> r = query('voting', params={'id': 1})
@@ -35,27 +48,75 @@ def query(modname, entry_point="/", method="get", baseurl=None, **kwargs):
     else:
         mod = baseurl
 
-    q = getattr(requests, method)
+    if dispatches_locally(modname, baseurl):
+        q = functools.partial(dispatch.request, method)
+    else:
+        timeout = kwargs.get("timeout", None)
+        q = functools.partial(pool.request, method, timeout=timeout)
     url = "{}/{}{}".format(mod, modname, entry_point)
 
     headers = {}
     if "HTTP_AUTHORIZATION" in kwargs:
         headers["Authorization"] = kwargs["HTTP_AUTHORIZATION"]
 
+    binary = kwargs.get("wire", "json") == "binary"
+    if binary:
+        headers["Accept"] = wire.CONTENT_TYPE
+
     params = kwargs.get("params", None)
     if params:
         url += "?{}".format(urllib.parse.urlencode(params))
 
     if method == "get":
         response = q(url, headers=headers)
+    elif binary:
+        json_data = kwargs.get("json", {})
+        headers["Content-Type"] = wire.CONTENT_TYPE
+        response = q(url, data=wire.dumps(*wire.split(json_data)), headers=headers)
     else:
         json_data = kwargs.get("json", {})
-        response = q(url, json=json_data, headers=headers)
+        headers["Content-Type"] = "application/json"
+        # the DRF encoder also takes the ciphertext batches of the mixnet
+        data = json.dumps(json_data, cls=JSONEncoder)
+        response = q(url, data=data, headers=headers)
 
     if kwargs.get("response", False):
         return response
     else:
-        return response.json()
+        return decode(response)
+
+
+def is_local(modname, baseurl=None):
+    """
+    True if the module modname is installed and served by this server
+    """
+
+    base = modname.split("/")[0]
+    url = baseurl or settings.APIS.get(base, settings.BASEURL)
+    return base in settings.MODULES and url.rstrip("/") == settings.BASEURL.rstrip("/")
+
+
+def dispatches_locally(modname, baseurl=None):
+    """
+    True if the queries to modname are run inside this process
+    """
+
+    enabled = settings.MODS_LOCAL_DISPATCH
+    if isinstance(enabled, (list, tuple, set)):
+        enabled = modname.split("/")[0] in enabled
+    return bool(enabled) and is_local(modname, baseurl)
+
+
+def decode(response):
+    """
+    Data of a response, in json or in the binary format of base.wire
+    """
+
+    content_type = response.headers.get("Content-Type", "")
+    if content_type.startswith(wire.CONTENT_TYPE):
+        data = wire.loads(response.content)
+        return data if len(data) > 1 else data["msgs"]
+    return response.json()
 
 
 def get(*args, **kwargs):
@@ -81,8 +142,17 @@ def mock_query(client):
 
         q = getattr(client, method)
 
+        headers = {}
+        binary = kwargs.get("wire", "json") == "binary"
+        if binary:
+            headers["HTTP_ACCEPT"] = wire.CONTENT_TYPE
+
         if method == "get":
-            response = q(url, format="json")
+            response = q(url, format="json", **headers)
+        elif binary:
+            json_data = kwargs.get("json", {})
+            data = wire.dumps(*wire.split(json_data))
+            response = q(url, data=data, content_type=wire.CONTENT_TYPE, **headers)
         else:
             json_data = kwargs.get("json", {})
             response = q(url, data=json_data, format="json")
@@ -90,7 +160,10 @@ def mock_query(client):
         if kwargs.get("response", False):
             return response
         else:
-            return response.json()
+            return decode(response)
+
+    # base.amods runs the mocked queries in the thread of the client
+    test_query.mocked = True
 
     global query
     query = test_query
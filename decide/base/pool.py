@@ -0,0 +1,106 @@
+"""
+Pooled HTTP sessions to the other servers, used by base.mods for the
+modules that aren't served by this one.
+
+There's a requests.Session per host (scheme://host:port) that keeps the
+connections open between queries. Every request has the connect and read
+timeouts of the settings, GET requests are retried with backoff when the
+connection fails or the server is unavailable, and the number of requests
+running at once to the same host is limited.
+"""
+
+import threading
+import urllib
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# responses retried for the idempotent methods
+RETRY_STATUS = (502, 503, 504)
+RETRY_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class IdempotentRetry(Retry):
+    """
+    Retry that gives up at once for the methods not in allowed_methods,
+    also on connection errors, so a POST is never sent twice
+    """
+
+    def increment(self, method=None, *args, **kwargs):
+        if method and method.upper() not in self.allowed_methods:
+            return Retry(0, read=False).increment(method, *args, **kwargs)
+        return super().increment(method, *args, **kwargs)
+
+
+class HostPool:
+    def __init__(self, host):
+        self.host = host
+        self.limit = threading.BoundedSemaphore(settings.MODS_HOST_CONCURRENCY)
+
+        retry = IdempotentRetry(
+            total=settings.MODS_RETRIES,
+            backoff_factor=settings.MODS_RETRY_BACKOFF,
+            allowed_methods=RETRY_METHODS,
+            status_forcelist=RETRY_STATUS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.MODS_HOST_CONCURRENCY,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = (settings.MODS_CONNECT_TIMEOUT, settings.MODS_READ_TIMEOUT)
+        with self.limit:
+            return self.session.request(method, url, timeout=timeout, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def host(url):
+    parts = urllib.parse.urlsplit(url)
+    return "{}://{}".format(parts.scheme, parts.netloc)
+
+
+def get_pool(url):
+    key = host(url)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = HostPool(key)
+        return _pools[key]
+
+
+def request(method, url, **kwargs):
+    """
+    Runs the request in the pool of the host of url, the params are the
+    ones of requests.request
+    """
+
+    return get_pool(url).request(method.upper(), url, **kwargs)
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+@receiver(setting_changed)
+def pool_settings_changed(setting, **kwargs):
+    if setting.startswith("MODS_"):
+        close_all()
@@ -1,8 +1,26 @@
+import http.server
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import requests
+import urllib3
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 
-from base import mods
+from census.models import Census
+from base import amods, dispatch, mods, pool
+
+# base.mods.query before BaseTestCase mocks it
+QUERY = mods.query
 
 
 class BaseTestCase(APITestCase):
@@ -33,3 +51,180 @@ class BaseTestCase(APITestCase):
 
     def logout(self):
         self.client.credentials()
+
+
+class DispatchTestCase(BaseTestCase):
+    def url(self, path):
+        return settings.BASEURL + path
+
+    def test_local_request(self):
+        self.login()
+        data = json.dumps({"voting_id": 1, "voters": [10, 11]})
+        headers = {"Content-Type": "application/json"}
+        url = self.url("/census/")
+
+        response = dispatch.request("post", url, data=data, headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+        headers["Authorization"] = "Token " + self.token
+        response = dispatch.request("post", url, data=data, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), "Census created")
+
+        response = dispatch.request("get", self.url("/census/role/1/?voter_id=10"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), "0")
+        self.assertEqual(response.headers["Content-Type"], "application/json")
+
+        response = dispatch.request("get", self.url("/census/role/1/?voter_id=12"))
+        self.assertEqual(response.status_code, 401)
+
+    def test_dispatches_locally(self):
+        self.assertTrue(mods.dispatches_locally("census/role/1"))
+        self.assertFalse(mods.dispatches_locally("mixnet", "http://auth.example.com"))
+        self.assertFalse(mods.dispatches_locally("gateway"))
+
+        with self.settings(MODS_LOCAL_DISPATCH=["voting"]):
+            self.assertTrue(mods.dispatches_locally("voting"))
+            self.assertFalse(mods.dispatches_locally("census"))
+
+        with self.settings(MODS_LOCAL_DISPATCH=False):
+            self.assertFalse(mods.dispatches_locally("voting"))
+
+        apis = dict(settings.APIS, census="http://census.example.com")
+        with self.settings(APIS=apis):
+            self.assertFalse(mods.dispatches_locally("census"))
+
+    def test_gather(self):
+        self.login()
+        Census.objects.create(voting_id=1, voter_id=10, role="2")
+        role, voters = amods.sync_gather(
+            amods.get("census/role/1", params={"voter_id": 10}),
+            amods.get("census", params={"voting_id": 1}),
+        )
+        self.assertEqual(role, "2")
+        self.assertEqual(voters, {"voters": [10]})
+
+        response = async_to_sync(amods.get)(
+            "census/role/1", params={"voter_id": 11}, response=True
+        )
+        self.assertEqual(response.status_code, 401)
+
+        with self.assertRaises(ValueError):
+            amods.sync_gather(amods.get("census"), amods.get("nomodule"))
+
+    def test_gather_local_threads(self):
+        def query(*args, **kwargs):
+            time.sleep(0.5)
+            return threading.get_ident()
+
+        queries = [amods.get("census") for i in range(3)]
+        start = time.monotonic()
+        # the local dispatches of a caller outside a transaction overlap
+        with mock.patch.object(mods, "query", query), mock.patch.object(
+            connection, "in_atomic_block", False
+        ):
+            idents = amods.sync_gather(*queries)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(set(idents)), 3)
+        self.assertNotIn(threading.get_ident(), idents)
+
+        queries = [amods.get("census") for i in range(2)]
+        with mock.patch.object(mods, "query", query):
+            idents = amods.sync_gather(*queries)
+        self.assertEqual(idents, [threading.get_ident()] * 2)
+
+
+class PoolHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def reply(self):
+        self.server.requests.append((self.command, self.path, self.client_address))
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        status = 200
+        if self.path.startswith("/fail/") and len(self.server.requests) < 3:
+            status = 503
+        if self.path.startswith("/slow/"):
+            time.sleep(0.5)
+        body = json.dumps({"path": self.path}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = reply
+    do_POST = reply
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(MODS_RETRY_BACKOFF=0)
+class PoolTestCase(SimpleTestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), PoolHandler)
+        self.server.requests = []
+        # the client closes the connection in test_timeout
+        self.server.handle_error = lambda *args: None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def tearDown(self):
+        pool.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        for path in ("/voting/", "/census/"):
+            response = pool.request("get", self.url + path)
+            self.assertEqual(response.json(), {"path": path})
+        response = pool.request("post", self.url + "/store/", json={"votes": []})
+        self.assertEqual(response.status_code, 200)
+
+        clients = {client for _, _, client in self.server.requests}
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(clients), 1)
+        self.assertIs(pool.get_pool(self.url + "/other/"), pool.get_pool(self.url))
+
+    def test_retries(self):
+        response = pool.request("get", self.url + "/fail/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_no_post_retries(self):
+        response = pool.request("post", self.url + "/fail/", json={})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_retry_idempotent_only(self):
+        retry = pool.IdempotentRetry(total=3, allowed_methods=pool.RETRY_METHODS)
+        error = urllib3.exceptions.NewConnectionError(None, "refused")
+        self.assertEqual(retry.increment("GET", "/", error=error).total, 2)
+        with self.assertRaises(urllib3.exceptions.MaxRetryError):
+            retry.increment("POST", "/", error=error)
+
+    @override_settings(MODS_READ_TIMEOUT=0.1)
+    def test_timeout(self):
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            pool.request("post", self.url + "/slow/", json={})
+        response = pool.request("post", self.url + "/slow/", json={}, timeout=5)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(MODS_HOST_CONCURRENCY=1)
+    def test_concurrency(self):
+        url = self.url + "/slow/"
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(lambda _: pool.request("get", url), range(2)))
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+
+    def test_amods_overlap(self):
+        apis = dict(settings.APIS, slow=self.url)
+        queries = [amods.get("slow", entry_point="/{}/".format(i)) for i in range(3)]
+        start = time.monotonic()
+        with self.settings(APIS=apis), mock.patch.object(mods, "query", QUERY):
+            results = amods.sync_gather(*queries)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(results, [{"path": "/slow/{}/".format(i)} for i in range(3)])
@@ -0,0 +1,114 @@
+"""
+Binary format for the ciphertext batches sent between authorities.
+
+A batch is a fixed header, the rest of the request data as json and the
+msgs as fixed width big-endian records:
+
+    arity (1 byte) | width (2 bytes) | count (4 bytes) | meta length (4 bytes)
+    meta (json)
+    a || b, a || b, ...
+
+arity is 2 for ciphertexts [a, b] and 1 for decrypted ints, width is the
+byte length of p (or of the biggest int if p isn't known).
+
+>>> data = dumps([[1, 2], [3, 258]], meta={"voting": 1})
+>>> len(data) == HEADER.size + len(b'{"voting": 1}') + 2 * 2 * 2
+True
+>>> loads(data)
+{'voting': 1, 'msgs': [[1, 2], [3, 258]]}
+>>> loads(dumps([5, 6, 7]))["msgs"]
+[5, 6, 7]
+"""
+
+import json
+import struct
+
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+
+CONTENT_TYPE = "application/x-decide-ciphertexts"
+HEADER = struct.Struct(">BHII")
+
+
+def width(msgs, p=None):
+    if p:
+        return (int(p).bit_length() + 7) // 8
+    top = max((max(m) if isinstance(m, (list, tuple)) else m for m in msgs), default=0)
+    return max(1, (int(top).bit_length() + 7) // 8)
+
+
+def dumps(msgs, meta=None, p=None):
+    if hasattr(msgs, "to_wire"):
+        # mixnet.batch.CiphertextBatch, already fixed width
+        return msgs.to_wire(meta)
+    msgs = list(msgs)
+    arity = 2 if msgs and isinstance(msgs[0], (list, tuple)) else 1
+    if not msgs:
+        arity = 2
+    meta = json.dumps(meta or {}).encode()
+
+    if arity == 2:
+        values = [int(v) for m in msgs for v in m]
+    else:
+        values = [int(m) for m in msgs]
+
+    w = width(msgs, p)
+    try:
+        body = b"".join(v.to_bytes(w, "big") for v in values)
+    except OverflowError:
+        # encoded EC points are one bit longer than p
+        w = width(msgs)
+        body = b"".join(v.to_bytes(w, "big") for v in values)
+    return HEADER.pack(arity, w, len(msgs), len(meta)) + meta + body
+
+
+def loads(data):
+    """
+    Returns the meta dict with the decoded msgs in "msgs"
+    """
+
+    data = memoryview(data)
+    arity, w, count, metalen = HEADER.unpack_from(data)
+    start = HEADER.size + metalen
+    meta = json.loads(bytes(data[HEADER.size : start]) or b"{}")
+
+    values = [
+        int.from_bytes(data[i : i + w], "big")
+        for i in range(start, start + arity * w * count, w)
+    ]
+    if arity == 2:
+        msgs = [list(values[i : i + 2]) for i in range(0, len(values), 2)]
+    else:
+        msgs = values
+    meta["msgs"] = msgs
+    return meta
+
+
+def split(data):
+    """
+    Splits the request or response data into the msgs and the meta dict
+    """
+
+    if isinstance(data, dict):
+        meta = dict(data)
+        return meta.pop("msgs", []), meta
+    return data, {}
+
+
+class CiphertextParser(BaseParser):
+    media_type = CONTENT_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return loads(stream.read())
+
+
+class CiphertextRenderer(BaseRenderer):
+    media_type = CONTENT_TYPE
+    format = "ctx"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        msgs, meta = split(data)
+        pk = meta.get("pk") or {}
+        return dumps(msgs, meta, p=pk.get("p"))
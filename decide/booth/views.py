@@ -3,7 +3,7 @@ from django.views.generic import TemplateView
 from django.conf import settings
 from django.http import Http404
 
-from base import mods
+from voting import cache
 from voting.models import QuestionOption, Voting
 
 
@@ -16,7 +16,7 @@ class BoothView(TemplateView):
         vid = kwargs.get("voting_id", 0)
 
         try:
-            r = mods.get("voting", params={"id": vid})
+            r = cache.get_votings(vid)
             # Casting numbers to string to manage in javascript with BigInt
             # and avoid problems with js and big number conversion
             for k, v in r[0]["pub_key"].items():
@@ -41,6 +41,10 @@ class BoothView(TemplateView):
             print(e)
             raise Http404
 
+        # the booth can't make the proofs of the homomorphic ballots
+        if context["voting_obj"].tally_mode == "homomorphic":
+            raise Http404
+
         context["KEYBITS"] = settings.KEYBITS
 
         return context
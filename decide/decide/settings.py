@@ -170,6 +170,86 @@ STATIC_URL = "/static/"
 # number of bits for the key, all auths should use the same number of bits
 KEYBITS = 256
 
+# number of processes used by each auth to reencrypt the votes in the shuffle
+MIXNET_SHUFFLE_WORKERS = 1
+
+# fixed base exponentiation tables for the voting public keys, window size in
+# bits and max memory used by the cached tables
+MIXNET_TABLES_WINDOW = 6
+MIXNET_TABLES_CACHE = 64 * 1024 * 1024
+
+# max number of mixnets whose parsed keys are kept in memory by each process
+MIXNET_CONTEXT_CACHE = 128
+
+# number of reencryption factors precomputed for each mixnet, filled when the
+# voting key is set and topped up by the fillpool command, 0 to disable the pool
+MIXNET_POOL_SIZE = 1000
+
+# number of threads filling the pools in the background, 0 to fill them inside
+# the request that sets the voting key
+MIXNET_POOL_WORKERS = 1
+
+# max number of ciphertexts per page in the chunked mixnet sessions, votings
+# with more votes than this are tallied with sessions
+MIXNET_PAGE_SIZE = 1000
+
+# directory of the batch files of the mixnet sessions, None for the system
+# temporary directory
+MIXNET_BATCH_DIR = None
+
+# format of the ciphertext batches sent between authorities, "json" or
+# "binary" (fixed width records, see base.wire)
+MIXNET_WIRE_FORMAT = "json"
+
+# "chain": each auth decrypts and sends the batch to the next one
+# "parallel": the first auth asks every auth for its shares at the same time
+MIXNET_DECRYPT_MODE = "chain"
+
+# queries of base.mods to the modules served by this server (settings.APIS)
+# run inside the process instead of through HTTP: True for every module,
+# False for none or a list of module names
+MODS_LOCAL_DISPATCH = True
+
+# queries of base.mods to other servers (base.pool): connect and read timeouts
+# in seconds, retries of the GET requests, backoff factor in seconds between
+# the retries and max number of requests at once to each host
+MODS_CONNECT_TIMEOUT = 5
+MODS_READ_TIMEOUT = 300
+MODS_RETRIES = 3
+MODS_RETRY_BACKOFF = 0.5
+MODS_HOST_CONCURRENCY = 10
+
+# read timeout in seconds of the mixnet calls that wait for a whole shuffle or
+# decrypt of the ballot box (chained calls, tally steps, session close), None
+# to wait as long as the auth needs
+MIXNET_READ_TIMEOUT = None
+
+# votings cached by voting.cache: seconds kept in the Django cache, seconds
+# and max number of votings kept in the memory of each process
+VOTING_CACHE_TIMEOUT = 300
+VOTING_CACHE_LOCAL_TTL = 5
+VOTING_CACHE_LOCAL_SIZE = 1024
+
+# number of threads running the tallies in the background (voting.jobs), 0 to
+# tally inside the request
+TALLY_WORKERS = 2
+
+# True leaves the tallies queued for the tallyworker command, that runs them
+# out of the server processes, instead of the TALLY_WORKERS threads
+TALLY_IN_WORKER = False
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "mixnet": {"handlers": ["console"], "level": "INFO"},
+        "voting": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
 # Versioning
 ALLOWED_VERSIONS = ["v1", "v2"]
 DEFAULT_VERSION = "v1"
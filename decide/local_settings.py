@@ -0,0 +1,43 @@
+ALLOWED_HOSTS = ["*"]
+
+# Modules in use, commented modules that you won't use
+MODULES = [
+    "authentication",
+    "base",
+    "booth",
+    "census",
+    "mixnet",
+    "postproc",
+    "store",
+    "visualizer",
+    "voting",
+]
+
+BASEURL = "http://localhost:8000"
+APIS = {
+    "authentication": BASEURL,
+    "base": BASEURL,
+    "booth": BASEURL,
+    "census": BASEURL,
+    "mixnet": BASEURL,
+    "postproc": BASEURL,
+    "store": BASEURL,
+    "visualizer": BASEURL,
+    "voting": BASEURL,
+}
+
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": "/tmp/decide.sqlite3",
+        "USER": "decide",
+        "PASSWORD": "decide",
+        "HOST": "localhost",
+        "PORT": "5432",
+    }
+}
+
+# number of bits for the key, all auths should use the same number of bits
+KEYBITS = 256
+TEST_RUNNER = "django.test.runner.DiscoverRunner"
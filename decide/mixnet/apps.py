@@ -1,6 +1,16 @@
+import logging
+
 from django.apps import AppConfig
 
 
+logger = logging.getLogger(__name__)
+
+
 class MixnetConfig(AppConfig):
     default_auto_field = "django.db.models.AutoField"
     name = "mixnet"
+
+    def ready(self):
+        from .mixcrypt import BACKEND
+
+        logger.debug("mixnet big integer backend: %s", BACKEND)
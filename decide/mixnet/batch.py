@@ -0,0 +1,370 @@
+"""
+Ciphertext batches in memory mapped files, so ballot boxes bigger than
+the RAM can be shuffled and decrypted a page at a time.
+
+A batch file is a sequence of fixed width big-endian records, a || b for
+the ciphertexts or a single int for the decrypted votes, like the body of
+base.wire. Records are appended at the end and read at any position.
+
+>>> with FileBatch.create(width=2) as batch:
+...     batch.extend([(1, 2), (3, 4), (5, 6)])
+...     batch[1], batch[-1], len(batch)
+((3, 4), (5, 6), 3)
+>>> with FileBatch.create(width=2, arity=1) as batch:
+...     batch.extend([7, 8, 9])
+...     batch.read(1, 3), batch.take([2, 0])
+([8, 9], [9, 7])
+"""
+
+import json
+import mmap
+import os
+import tempfile
+
+from base import wire
+
+from .mixcrypt import gen_perm
+
+# bytes written at once while extending a batch
+WRITE_BUFFER = 1 << 20
+
+
+def record_width(p):
+    """
+    Bytes of each int for the key p, one bit more than p for the encoded
+    EC points
+    """
+
+    return (int(p).bit_length() + 8) // 8
+
+
+class FileBatch:
+    def __init__(self, path, width, arity=2, temporary=False):
+        self.path = path
+        self.width = width
+        self.arity = arity
+        self.size = width * arity
+        self.temporary = temporary
+        self.file = open(path, "a+b")
+        self.map = None
+        self.count = os.path.getsize(path) // self.size
+
+    @classmethod
+    def create(cls, width, arity=2, dir=None):
+        """
+        New empty batch in a temporary file, removed when it's closed
+        """
+
+        fd, path = tempfile.mkstemp(prefix="batch-", suffix=".bin", dir=dir)
+        os.close(fd)
+        return cls(path, width, arity, temporary=True)
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def pack(self, m):
+        if self.arity == 1:
+            return int(m).to_bytes(self.width, "big")
+        return b"".join(int(v).to_bytes(self.width, "big") for v in m)
+
+    def unpack(self, data, offset):
+        w = self.width
+        if self.arity == 1:
+            return int.from_bytes(data[offset : offset + w], "big")
+        return tuple(
+            int.from_bytes(data[i : i + w], "big")
+            for i in range(offset, offset + self.size, w)
+        )
+
+    def extend(self, msgs):
+        buf = bytearray()
+        for m in msgs:
+            buf += self.pack(m)
+            self.count += 1
+            if len(buf) >= WRITE_BUFFER:
+                self.file.write(buf)
+                buf = bytearray()
+        self.file.write(buf)
+        self.unmap()
+
+    def append(self, m):
+        self.extend([m])
+
+    def mapped(self):
+        if not self.count:
+            return b""
+        if self.map is None:
+            self.file.flush()
+            self.map = mmap.mmap(
+                self.file.fileno(), self.count * self.size, access=mmap.ACCESS_READ
+            )
+        return self.map
+
+    def unmap(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("batch index out of range")
+        return self.unpack(self.mapped(), i * self.size)
+
+    def read(self, start, stop):
+        """
+        Records from start to stop, read sequentially
+        """
+
+        stop = min(stop, self.count)
+        if start >= stop:
+            return []
+        data = self.mapped()
+        return [self.unpack(data, i * self.size) for i in range(start, stop)]
+
+    def take(self, idxs):
+        """
+        Records at the positions idxs, in that order
+        """
+
+        data = self.mapped()
+        return [self.unpack(data, i * self.size) for i in idxs]
+
+    def pages(self, size):
+        for start in range(0, self.count, size):
+            yield self.read(start, start + size)
+
+    def __iter__(self):
+        for page in self.pages(1000):
+            yield from page
+
+    def close(self):
+        self.unmap()
+        self.file.close()
+        if self.temporary:
+            remove(self.path)
+
+
+class CiphertextBatch:
+    """
+    Ciphertexts in memory with the a and b of all of them in two
+    contiguous buffers of fixed width big-endian ints. Slices share the
+    buffers, and permutations and the binary wire format move bytes
+    without building ints.
+
+    >>> batch = CiphertextBatch.from_msgs([[1, 2], [3, 4], [5, 600]])
+    >>> batch.width, len(batch), batch[2]
+    (2, 3, (5, 600))
+    >>> batch[1:].tolist()
+    [[3, 4], [5, 600]]
+    >>> batch.permute([2, 0, 1]).tolist()
+    [[5, 600], [1, 2], [3, 4]]
+    >>> CiphertextBatch.from_wire(batch.to_wire({"voting": 1})).tolist()
+    [[1, 2], [3, 4], [5, 600]]
+    >>> wire.loads(wire.dumps(batch))["msgs"]
+    [[1, 2], [3, 4], [5, 600]]
+    >>> CiphertextBatch.concat([batch[:1], CiphertextBatch.from_msgs([[7, 8]])]).tolist()
+    [[1, 2], [7, 8]]
+    """
+
+    def __init__(self, a=b"", b=b"", width=1):
+        self.a = memoryview(a)
+        self.b = memoryview(b)
+        self.width = width
+        self.count = len(self.a) // width
+
+    @classmethod
+    def from_msgs(cls, msgs, width=None):
+        """
+        Batch of a list of [a, b], with the width of the ints given or of
+        the biggest one
+        """
+
+        if isinstance(msgs, cls):
+            return msgs
+        msgs = msgs if isinstance(msgs, (list, tuple)) else list(msgs)
+        if width is None:
+            width = wire.width(msgs)
+        a = b"".join(int(m[0]).to_bytes(width, "big") for m in msgs)
+        b = b"".join(int(m[1]).to_bytes(width, "big") for m in msgs)
+        return cls(a, b, width)
+
+    @classmethod
+    def concat(cls, batches, width=None):
+        """
+        Batch with the records of all the batches, in order, with the given
+        width or the biggest one of them
+        """
+
+        batches = list(batches)
+        if width is None:
+            width = max((b.width for b in batches), default=1)
+        batches = [
+            b if b.width == width else cls.from_msgs(list(b), width) for b in batches
+        ]
+        a = b"".join(b.a for b in batches)
+        b = b"".join(b.b for b in batches)
+        return cls(a, b, width)
+
+    @classmethod
+    def from_wire(cls, data):
+        """
+        Batch of the msgs of a base.wire message of ciphertexts
+        """
+
+        data = memoryview(data)
+        arity, w, count, metalen = wire.HEADER.unpack_from(data)
+        start = wire.HEADER.size + metalen
+        body = data[start : start + 2 * w * count]
+        a = b"".join(body[i : i + w] for i in range(0, len(body), 2 * w))
+        b = b"".join(body[i + w : i + 2 * w] for i in range(0, len(body), 2 * w))
+        return cls(a, b, max(w, 1))
+
+    def to_wire(self, meta=None):
+        w = self.width
+        meta = json.dumps(meta or {}).encode()
+        body = b"".join(
+            self.a[i : i + w].tobytes() + self.b[i : i + w].tobytes()
+            for i in range(0, len(self.a), w)
+        )
+        return wire.HEADER.pack(2, w, self.count, len(meta)) + meta + body
+
+    def __len__(self):
+        return self.count
+
+    def int(self, buf, i):
+        return int.from_bytes(buf[i * self.width : (i + 1) * self.width], "big")
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.count)
+            if step != 1:
+                return self.permute(range(start, stop, step))
+            w = self.width
+            return CiphertextBatch(
+                self.a[start * w : stop * w], self.b[start * w : stop * w], w
+            )
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("batch index out of range")
+        return (self.int(self.a, i), self.int(self.b, i))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield (self.int(self.a, i), self.int(self.b, i))
+
+    def permute(self, perm):
+        """
+        New batch with the ciphertext perm[i] in the position i
+        """
+
+        w = self.width
+        a = b"".join(self.a[i * w : (i + 1) * w] for i in perm)
+        b = b"".join(self.b[i * w : (i + 1) * w] for i in perm)
+        return CiphertextBatch(a, b, w)
+
+    def tolist(self):
+        return [list(m) for m in self]
+
+    def __reduce__(self):
+        return (CiphertextBatch, (self.a.tobytes(), self.b.tobytes(), self.width))
+
+
+def decode(data):
+    """
+    Msgs of a base.wire message, a CiphertextBatch when they're ciphertexts
+    and a list of ints when they're decrypted
+
+    >>> decode(wire.dumps([[1, 2], [3, 4]])).tolist()
+    [[1, 2], [3, 4]]
+    >>> decode(wire.dumps([5, 6]))
+    [5, 6]
+    """
+
+    if wire.HEADER.unpack_from(data)[0] == 2:
+        return CiphertextBatch.from_wire(data)
+    return wire.loads(data)["msgs"]
+
+
+def from_json(msgs, width=None):
+    """
+    Msgs decoded from json, in a CiphertextBatch when they're [a, b]
+    """
+
+    if msgs and isinstance(msgs[0], (list, tuple)):
+        return CiphertextBatch.from_msgs(msgs, width)
+    return msgs
+
+
+def join(parts, width=None):
+    """
+    Concatenation of pages of msgs, a CiphertextBatch when all of them are
+
+    >>> join([CiphertextBatch.from_msgs([[1, 2]]), CiphertextBatch()]).tolist()
+    [[1, 2]]
+    >>> join([[5, 6], [7]])
+    [5, 6, 7]
+    """
+
+    parts = list(parts)
+    if parts and all(isinstance(part, CiphertextBatch) for part in parts):
+        return CiphertextBatch.concat(parts, width)
+    return [m for part in parts for m in part]
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def shuffle(crypt, src, dst, pubkey=None, page=1000, workers=1, factors=None):
+    """
+    Reencrypts the batch src into dst in a random order, reading one page
+    of src at a time. factors(n) returns up to n precomputed reencryption
+    factors for each page.
+
+    Returns the permutation, the record i of dst is a reencryption of the
+    record perm[i] of src. With workers > 1 the same pool of processes
+    reencrypts all the pages.
+    """
+
+    perm = gen_perm(len(src), crypt.rng, typecode="q")
+    pool = crypt.worker_pool(pubkey, workers) if workers > 1 and len(src) > 1 else None
+    try:
+        for start in range(0, len(src), page):
+            msgs = src.take(perm[start : start + page])
+            fs = factors(len(msgs)) if factors else None
+            dst.extend(crypt.reencrypt_all(msgs, pubkey, workers, fs, pool))
+    finally:
+        if pool:
+            pool.shutdown()
+    return perm
+
+
+def decrypt(crypt, src, dst, last=True, page=1000):
+    """
+    Decrypts the batch src into dst in a random order, one page at a time.
+    dst has arity 1 when it's the last decryption.
+    """
+
+    perm = gen_perm(len(src), crypt.rng, typecode="q")
+    for start in range(0, len(src), page):
+        msgs = src.take(perm[start : start + page])
+        dst.extend(crypt.multiple_decrypt(msgs, last))
+    return perm
+
+
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod()
@@ -0,0 +1,111 @@
+"""
+Client of the chunked mixnet sessions (/mixnet/session/)
+"""
+
+from django.conf import settings
+
+from base import mods
+from base.wire import CONTENT_TYPE
+
+from . import batch
+
+
+def timeout():
+    """
+    (connect, read) timeouts of the calls that wait for a whole shuffle or
+    decrypt, see settings.MIXNET_READ_TIMEOUT
+    """
+
+    return (settings.MODS_CONNECT_TIMEOUT, settings.MIXNET_READ_TIMEOUT)
+
+
+def stream(op, voting, msgs, baseurl=None, position=0, pk=None, **extra):
+    """
+    Opens a shuffle/decrypt session in the mixnet of baseurl, uploads msgs
+    (any iterable) in pages and closes it.
+
+    Returns (session id, number of msgs), the output is read with pages()
+    """
+
+    data = {"voting": voting, "op": op, "position": position}
+    if pk:
+        data["pk"] = {"p": pk[0], "g": pk[1], "y": pk[2]}
+    data.update(extra)
+    r = mods.post("mixnet", entry_point="/session/", baseurl=baseurl, json=data)
+    session = r["session"]
+
+    url = "/session/{}/".format(session)
+    page = []
+    for m in msgs:
+        page.append(m)
+        if len(page) == settings.MIXNET_PAGE_SIZE:
+            append(url, page, baseurl)
+            page = []
+    if page:
+        append(url, page, baseurl)
+
+    r = mods.post(
+        "mixnet",
+        entry_point=url + "close/",
+        baseurl=baseurl,
+        json={},
+        timeout=timeout(),
+    )
+    return session, r["count"]
+
+
+def append(url, msgs, baseurl=None):
+    wire = settings.MIXNET_WIRE_FORMAT
+    data = {"msgs": msgs}
+    mods.post("mixnet", entry_point=url, baseurl=baseurl, json=data, wire=wire)
+
+
+def page(session, n, baseurl=None, size=None, **kwargs):
+    params = {"page": n, "size": size or settings.MIXNET_PAGE_SIZE}
+    url = "/session/{}/".format(session)
+    wire = settings.MIXNET_WIRE_FORMAT
+    return mods.get(
+        "mixnet", entry_point=url, baseurl=baseurl, params=params, wire=wire, **kwargs
+    )
+
+
+def pages(session, count, baseurl=None):
+    """
+    Iterates over the output of a closed session, one page per request
+    """
+
+    size = settings.MIXNET_PAGE_SIZE
+    for n in range(-(-count // size)):
+        yield from page(session, n, baseurl=baseurl, size=size)
+
+
+def output(session, count, baseurl=None, width=None):
+    """
+    Whole output of a closed session, a CiphertextBatch when it's
+    ciphertexts
+    """
+
+    size = settings.MIXNET_PAGE_SIZE
+    parts = [
+        decode(page(session, n, baseurl=baseurl, size=size, response=True), width)
+        for n in range(-(-count // size))
+    ]
+    return batch.join(parts, width)
+
+
+def decode(response, width=None):
+    """
+    Msgs of a shuffle or decrypt response, a CiphertextBatch when they're
+    ciphertexts
+    """
+
+    if response.headers.get("Content-Type", "").startswith(CONTENT_TYPE):
+        return batch.decode(response.content)
+    return batch.from_json(response.json(), width)
+
+
+def delete(session, baseurl=None):
+    url = "/session/{}/".format(session)
+    mods.query(
+        "mixnet", entry_point=url, method="delete", baseurl=baseurl, response=True
+    )
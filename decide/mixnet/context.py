@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .eccrypt import ECMixCrypt
+from .mixcrypt import ElGamal, MixCrypt
+from .tables import get_tables
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+
+class Context:
+    """
+    Parsed keys of a mixnet, ready to build a MixCrypt for each request:
+    the private ElGamal key of this auth and the public keys as int
+    tuples. The fixed base tables are looked up in mixnet.tables every
+    time, so they count against settings.MIXNET_TABLES_CACHE.
+    """
+
+    def __init__(self, mixnet):
+        key = mixnet.key
+        self.key_id = key.id
+        self.curve = key.curve
+        self.keys = {}
+
+        if self.curve:
+            crypt = ECMixCrypt(curve=self.curve)
+            self.privkey = crypt.setk(key.p, key.g, key.y, key.x)
+        else:
+            self.privkey = ElGamal.construct(
+                (int(key.p), int(key.g), int(key.y), int(key.x))
+            )
+        for k in (mixnet.pubkey, key):
+            if k:
+                pk = (int(k.p), int(k.g), int(k.y))
+                self.keys.setdefault(pk, k)
+
+    def crypt(self, pk=None):
+        """
+        New MixCrypt (or ECMixCrypt) with these keys, one per request
+        """
+
+        if self.curve:
+            return ECMixCrypt(privkey=self.privkey, curve=self.curve)
+        return MixCrypt(
+            bits=settings.KEYBITS, privkey=self.privkey, tables=self.get_tables(pk)
+        )
+
+    def get_tables(self, pk):
+        """
+        Fixed base tables if pk is the pubkey or the key of the mixnet
+        """
+
+        if not pk or self.curve:
+            return None
+        pk = tuple(map(int, pk))
+        if pk not in self.keys:
+            return None
+        return get_tables(self.keys[pk])
+
+
+def get_context(mixnet):
+    """
+    Cached Context of a mixnet, by (voting_id, auth_position, key id,
+    pubkey id).
+
+    Least recently used contexts are dropped when there are more than
+    settings.MIXNET_CONTEXT_CACHE, and the contexts of a Key are dropped
+    when the Key is saved or deleted.
+    """
+
+    cache_key = (
+        mixnet.voting_id,
+        mixnet.auth_position,
+        mixnet.key_id,
+        mixnet.pubkey_id,
+    )
+    with _lock:
+        ctx = _cache.get(cache_key)
+        if ctx:
+            _cache.move_to_end(cache_key)
+            return ctx
+
+    ctx = Context(mixnet)
+    with _lock:
+        _cache[cache_key] = ctx
+        while len(_cache) > settings.MIXNET_CONTEXT_CACHE:
+            _cache.popitem(last=False)
+    return ctx
+
+
+def forget_key(key_id):
+    with _lock:
+        for cache_key in list(_cache):
+            if key_id in cache_key[2:]:
+                del _cache[cache_key]
+
+
+def clear_contexts():
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,271 @@
+"""
+Elliptic curve ElGamal for the mixnet, with the same interface as
+mixcrypt.MixCrypt so Mixnet can use both.
+
+Points travel and are stored as ints, the x coordinate shifted one bit
+with the parity of y in the lowest bit (0 is the point at infinity). The
+keys use the Key fields like the multiplicative group ones: p is the
+field prime of the curve, g the generator, y the public point and x the
+private scalar.
+
+Votes are encoded as points with Koblitz's method, the x coordinate of
+the vote m is the first m * K + j that is on the curve.
+
+>>> k1 = ECMixCrypt()
+>>> k2 = ECMixCrypt()
+>>> k3 = gen_multiple_key(k1, k2)
+>>> clears = [2, 3, 4, 5, 6, 7]
+>>> cipher = [k3.encrypt(i) for i in clears]
+>>> pk = (k3.k.p, k3.k.g, k3.k.y)
+>>> b = k2.shuffle(k1.shuffle(cipher, pk), pk)
+>>> d = k2.multiple_decrypt(k1.multiple_decrypt(b, last=False))
+>>> sorted(d) == clears
+True
+"""
+
+from Crypto.PublicKey import ECC
+from Crypto.PublicKey.ECC import EccPoint
+
+from .mixcrypt import RandomSource, gen_perm, mpz, powmod
+
+CURVES = ("p256",)
+
+# tries per vote in the Koblitz encoding, a point is found with
+# probability 1 - 2^-K
+K = 64
+
+
+def curve_params(curve):
+    return ECC._curves[curve]
+
+
+def encode_point(P):
+    """
+    >>> G = curve_params("p256").G
+    >>> decode_point("p256", encode_point(G * 3)) == G * 3
+    True
+    >>> encode_point(G + (-G))
+    0
+    """
+
+    if P.is_point_at_infinity():
+        return 0
+    x, y = (int(i) for i in P.xy)
+    return (x << 1) | (y & 1)
+
+
+def decode_point(curve, v):
+    """
+    ValueError if v isn't a point of the curve
+
+    >>> decode_point("p256", 1 << 1)
+    Traceback (most recent call last):
+    ...
+    ValueError: point not on curve
+    """
+
+    v = int(v)
+    if not v:
+        return EccPoint(0, 0, curve)
+
+    c = curve_params(curve)
+    p = int(c.p)
+    x, parity = v >> 1, v & 1
+    y = sqrt(curve, x) if x < p else None
+    if y is None:
+        raise ValueError("point not on curve")
+    y = int(y)
+    if y & 1 != parity:
+        y = p - y
+    return EccPoint(x, y, curve)
+
+
+def sqrt(curve, x):
+    """
+    y with y^2 = x^3 - 3x + b, None if x isn't on the curve. The NIST
+    primes are 3 mod 4, so the root is a single exponentiation
+    """
+
+    c = curve_params(curve)
+    p = mpz(int(c.p))
+    x = mpz(x)
+    rhs = (x * x * x - 3 * x + int(c.b)) % p
+    y = powmod(rhs, (p + 1) // 4, p)
+    if (y * y) % p != rhs:
+        return None
+    return y
+
+
+def encode(curve, m):
+    """
+    Point for the vote m
+
+    >>> decode(encode("p256", 42))
+    42
+    """
+
+    for j in range(K):
+        x = int(m) * K + j
+        y = sqrt(curve, x)
+        if y is not None:
+            return EccPoint(x, int(y), curve)
+    raise ValueError("{} can't be encoded as a point".format(m))
+
+
+def decode(P):
+    return int(P.x) // K
+
+
+class ECKey:
+    """
+    EC ElGamal key, the point y = x * G with the private scalar x
+    """
+
+    def __init__(self, curve, Q, d=None):
+        self.curve = curve
+        self.Q = Q
+        self.d = d
+        c = curve_params(curve)
+        self.p = int(c.p)
+        self.g = encode_point(c.G)
+        self.y = encode_point(Q)
+        self.x = d
+
+
+def add_keys(curve, *ys):
+    """
+    Encoded sum of the encoded public points of several auths
+    """
+
+    Q = EccPoint(0, 0, curve)
+    for y in ys:
+        Q = Q + decode_point(curve, y)
+    return encode_point(Q)
+
+
+class ECMixCrypt:
+    def __init__(
+        self,
+        k=None,
+        bits=256,
+        tables=None,
+        rng=None,
+        group=None,
+        privkey=None,
+        curve="p256",
+    ):
+        self.curve = curve
+        self.c = curve_params(curve)
+        self.bits = int(self.c.modulus_bits)
+        self.rng = rng or RandomSource()
+        # unused, there are no fixed base tables for the curves
+        self.tables = None
+        if privkey:
+            self.k = privkey
+        else:
+            self.k = self.genk()
+
+    def randk(self):
+        return self.rng.randint(1, int(self.c.order) - 1)
+
+    def genk(self):
+        d = self.randk()
+        self.k = ECKey(self.curve, self.c.G * d, d)
+        return self.k
+
+    def getk(self, p=None, g=None):
+        return self.genk()
+
+    def setk(self, p, g, y, x):
+        self.k = ECKey(self.curve, decode_point(self.curve, y), int(x))
+        return self.k
+
+    def point(self, v):
+        return decode_point(self.curve, v)
+
+    def pubpoint(self, pubkey=None):
+        if pubkey:
+            return self.point(pubkey[2])
+        return self.k.Q
+
+    def encrypt(self, m, k=None):
+        Q = self.point(k.y) if k else self.k.Q
+        r = self.randk()
+        a = self.c.G * r
+        b = encode(self.curve, m) + Q * r
+        return (encode_point(a), encode_point(b))
+
+    def decrypt(self, c):
+        a, b = (self.point(i) for i in c)
+        return decode(b + (-(a * self.k.d)))
+
+    def partial_decrypt(self, msgs):
+        return [encode_point(self.point(a) * self.k.d) for a, b in msgs]
+
+    def combine(self, msgs, shares):
+        out = []
+        for (a, b), column in zip(msgs, zip(*shares)):
+            M = self.point(b)
+            for s in column:
+                M = M + (-self.point(s))
+            out.append(decode(M))
+        return out
+
+    def multiple_decrypt(self, msgs, last=True):
+        out = []
+        for a, b in msgs:
+            A = self.point(a)
+            B = self.point(b) + (-(A * self.k.d))
+            out.append(decode(B) if last else (a, encode_point(B)))
+        return out
+
+    def shuffle_decrypt(self, msgs, last=True, audit=False):
+        perm = self.gen_perm(len(msgs))
+        msgs2 = self.multiple_decrypt([msgs[p] for p in perm], last)
+        return (msgs2, perm) if audit else msgs2
+
+    def reencrypt(self, cipher, pubkey=None, factor=None):
+        a, b = (self.point(i) for i in cipher)
+        if factor:
+            a1, b1 = (self.point(i) for i in factor)
+        else:
+            r = self.randk()
+            a1, b1 = self.c.G * r, self.pubpoint(pubkey) * r
+        return (encode_point(a + a1), encode_point(b + b1))
+
+    def gen_perm(self, l):
+        return gen_perm(l, self.rng)
+
+    def shuffle(self, msgs, pubkey=None, workers=1, factors=None, audit=False):
+        perm = self.gen_perm(len(msgs))
+        msgs2 = self.reencrypt_all([msgs[p] for p in perm], pubkey, workers, factors)
+        return (msgs2, perm) if audit else msgs2
+
+    def reencrypt_all(self, msgs, pubkey=None, workers=1, factors=None, pool=None):
+        """
+        Reencrypts an already permuted batch, always in this process
+        """
+
+        factors = list(factors or [])
+        factors += [None] * (len(msgs) - len(factors))
+        return [self.reencrypt(m, pubkey, f) for m, f in zip(msgs, factors)]
+
+    def worker_pool(self, pubkey, workers):
+        return None
+
+    def combine_y(self, *ys):
+        return add_keys(self.curve, *ys)
+
+
+def gen_multiple_key(*crypts):
+    k1 = crypts[0]
+    k = ECMixCrypt(curve=k1.curve)
+    y = add_keys(k1.curve, *(c.k.y for c in crypts))
+    k.k = ECKey(k1.curve, decode_point(k1.curve, y))
+    return k
+
+
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod()
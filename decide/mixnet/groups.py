@@ -0,0 +1,122 @@
+"""
+Registry of the group parameters (p, g) used for the mixnet keys.
+
+Generating a safe prime takes seconds at 1024 bits and minutes over that,
+so the keys are built from already known groups: the standard MODP groups
+of RFC 2409/3526 and the groups pregenerated in this server with the
+gengroups command.
+"""
+
+import itertools
+import multiprocessing
+import os
+
+from .mixcrypt import gen_group
+
+
+MODP = {
+    # RFC 2409 group 2
+    1024: (
+        int(
+            "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+            "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+            "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+            "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE65381FFFFFFFFFFFFFFFF",
+            16,
+        ),
+        2,
+    ),
+    # RFC 3526 group 14
+    2048: (
+        int(
+            "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+            "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+            "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+            "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05"
+            "98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB"
+            "9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+            "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718"
+            "3995497CEA956AE515D2261898FA051015728E5A8AACAA68FFFFFFFFFFFFFFFF",
+            16,
+        ),
+        2,
+    ),
+    # RFC 3526 group 15
+    3072: (
+        int(
+            "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+            "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+            "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+            "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05"
+            "98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB"
+            "9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+            "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718"
+            "3995497CEA956AE515D2261898FA051015728E5A8AAAC42DAD33170D04507A33"
+            "A85521ABDF1CBA64ECFB850458DBEF0A8AEA71575D060C7DB3970F85A6E1E4C7"
+            "ABF5AE8CDB0933D71E8C94E04A25619DCEE3D2261AD2EE6BF12FFA06D98A0864"
+            "D87602733EC86A64521F2B18177B200CBBE117577A615D6C770988C0BAD946E2"
+            "08E24FA074E5AB3143DB5BFCE0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF",
+            16,
+        ),
+        2,
+    ),
+    # RFC 3526 group 16
+    4096: (
+        int(
+            "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+            "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+            "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+            "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05"
+            "98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB"
+            "9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+            "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718"
+            "3995497CEA956AE515D2261898FA051015728E5A8AAAC42DAD33170D04507A33"
+            "A85521ABDF1CBA64ECFB850458DBEF0A8AEA71575D060C7DB3970F85A6E1E4C7"
+            "ABF5AE8CDB0933D71E8C94E04A25619DCEE3D2261AD2EE6BF12FFA06D98A0864"
+            "D87602733EC86A64521F2B18177B200CBBE117577A615D6C770988C0BAD946E2"
+            "08E24FA074E5AB3143DB5BFCE0FD108E4B82D120A92108011A723C12A787E6D7"
+            "88719A10BDBA5B2699C327186AF4E23C1A946834B6150BDA2583E9CA2AD44CE8"
+            "DBBBC2DB04DE8EF92E8EFC141FBECAA6287C59474E6BC05D99B2964FA090C3A2"
+            "233BA186515BE7ED1F612970CEE2D7AFB81BDD762170481CD0069127D5B05AA9"
+            "93B4EA988D8FDDC186FFB7DC90A6C08F4DF435C934063199FFFFFFFFFFFFFFFF",
+            16,
+        ),
+        2,
+    ),
+}
+
+
+def get_group(bits):
+    """
+    (p, g) for a key of `bits` bits, a standard group if there's one with
+    that size, if not a random pregenerated one, None if there's none
+    """
+
+    from .models import Group
+
+    if bits in MODP:
+        return MODP[bits]
+
+    group = Group.objects.filter(bits=bits).order_by("?").first()
+    if group:
+        return group.p, group.g
+    return None
+
+
+def gen_groups(bits, count=1, workers=None):
+    """
+    Generates `count` groups, all the workers look for the next safe prime
+    at the same time and the first one found is taken
+    """
+
+    workers = workers or os.cpu_count() or 1
+    # one search per worker in flight until `count` groups are found
+    searches = itertools.repeat(bits, count + workers - 1)
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        found = pool.imap_unordered(gen_group, searches)
+        return list(itertools.islice(found, count))
+    finally:
+        pool.terminate()
+        pool.join()
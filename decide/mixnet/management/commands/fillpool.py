@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mixnet.models import Mixnet
+
+
+class Command(BaseCommand):
+    help = "Precompute the reencryption factors pool of the mixnets"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=settings.MIXNET_POOL_SIZE,
+            help="Target number of factors per mixnet",
+        )
+        parser.add_argument(
+            "--voting", type=int, nargs="*", help="Only fill these votings"
+        )
+        parser.add_argument(
+            "--loop",
+            type=int,
+            default=0,
+            help="Keep filling every LOOP seconds, useful while votings are open",
+        )
+
+    def fill(self, size, votings):
+        mixnets = Mixnet.objects.filter(pubkey__isnull=False)
+        if votings:
+            mixnets = mixnets.filter(voting_id__in=votings)
+
+        for mn in mixnets:
+            added = mn.fill_pool(size)
+            if added:
+                self.stdout.write(
+                    "Voting {}, position {}: {} factors added".format(
+                        mn.voting_id, mn.auth_position, added
+                    )
+                )
+
+    def handle(self, *args, **options):
+        while True:
+            self.fill(options["size"], options["voting"])
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
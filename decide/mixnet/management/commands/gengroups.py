@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mixnet.groups import gen_groups
+from mixnet.models import Group
+
+
+class Command(BaseCommand):
+    help = "Pregenerate safe prime groups for the mixnet keys"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--bits",
+            type=int,
+            default=settings.KEYBITS,
+            help="Size of p in bits",
+        )
+        parser.add_argument(
+            "--count", type=int, default=1, help="Number of groups to generate"
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of processes looking for primes, all cores by default",
+        )
+
+    def handle(self, *args, **options):
+        bits, count = options["bits"], options["count"]
+
+        start = time.perf_counter()
+        groups = gen_groups(bits, count, options["workers"])
+        Group.objects.bulk_create(Group(bits=bits, p=p, g=g) for p, g in groups)
+
+        self.stdout.write(
+            "{} groups of {} bits generated in {:.1f}s, {} in the registry".format(
+                len(groups),
+                bits,
+                time.perf_counter() - start,
+                Group.objects.filter(bits=bits).count(),
+            )
+        )
@@ -0,0 +1,189 @@
+import json
+import platform
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mixnet import mixcrypt
+from mixnet.groups import get_group
+from mixnet.mixcrypt import (
+    MixCrypt,
+    RandomSource,
+    gen_group,
+    gen_multiple_key,
+    gen_perm,
+    multiple_decrypt_shuffle2,
+)
+
+
+def bench_perm(crypts, k, msgs, ciphers):
+    gen_perm(len(msgs), RandomSource())
+
+
+def bench_encrypt(crypts, k, msgs, ciphers):
+    [k.encrypt(m) for m in msgs]
+
+
+def bench_reencrypt(crypts, k, msgs, ciphers):
+    pk = (int(k.k.p), int(k.k.g), int(k.k.y))
+    [k.reencrypt(c, pk) for c in ciphers]
+
+
+def bench_shuffle(crypts, k, msgs, ciphers):
+    pk = (int(k.k.p), int(k.k.g), int(k.k.y))
+    for crypt in crypts:
+        ciphers = crypt.shuffle(ciphers, pk)
+
+
+def bench_shuffle_decrypt(crypts, k, msgs, ciphers):
+    for i, crypt in enumerate(crypts):
+        ciphers = crypt.shuffle_decrypt(ciphers, last=i == len(crypts) - 1)
+
+
+def bench_multiple_decrypt_shuffle2(crypts, k, msgs, ciphers):
+    pk = (int(k.k.p), int(k.k.g), int(k.k.y))
+    multiple_decrypt_shuffle2(ciphers, *crypts, pubkey=pk)
+
+
+def bench_gen_multiple_key(crypts, k, msgs, ciphers):
+    gen_multiple_key(*crypts)
+
+
+BENCHMARKS = {
+    "perm": bench_perm,
+    "encrypt": bench_encrypt,
+    "reencrypt": bench_reencrypt,
+    "shuffle": bench_shuffle,
+    "shuffle_decrypt": bench_shuffle_decrypt,
+    "multiple_decrypt_shuffle2": bench_multiple_decrypt_shuffle2,
+    "gen_multiple_key": bench_gen_multiple_key,
+}
+
+# benchmarks that don't depend on the batch size, run once per key
+UNSIZED = ("gen_multiple_key",)
+
+
+class Command(BaseCommand):
+    help = "Benchmark of the mixnet crypto, without network or database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--bench",
+            nargs="+",
+            choices=list(BENCHMARKS),
+            default=list(BENCHMARKS),
+            help="Benchmarks to run",
+        )
+        parser.add_argument(
+            "--bits",
+            type=int,
+            nargs="+",
+            default=[256, 1024],
+            help="Key sizes, 1024/2048/3072 use the standard MODP groups",
+        )
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[1000],
+            help="Number of ciphertexts per batch",
+        )
+        parser.add_argument(
+            "--auths",
+            type=int,
+            nargs="+",
+            default=[1, 2],
+            help="Number of auths simulated in this process",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=1, help="Runs of each case, the best is kept"
+        )
+        parser.add_argument("--output", help="Write the results to this json file")
+        parser.add_argument(
+            "--compare", help="Json file of a previous run to compare with"
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Fail if a case is this fraction slower than in --compare",
+        )
+
+    def crypts(self, bits, n):
+        group = get_group(bits) or gen_group(bits)
+        return [MixCrypt(bits=bits, group=group) for i in range(n)]
+
+    def run(self, name, crypts, size, repeat):
+        k = gen_multiple_key(*crypts)
+        msgs = [i % 1000 + 2 for i in range(size)]
+        ciphers = [k.encrypt(m) for m in msgs] if name != "encrypt" else []
+
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            BENCHMARKS[name](crypts, k, msgs, ciphers)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **options):
+        results = []
+        for bits in options["bits"]:
+            for nauths in options["auths"]:
+                crypts = self.crypts(bits, nauths)
+                for name in options["bench"]:
+                    sizes = [0] if name in UNSIZED else options["sizes"]
+                    for size in sizes:
+                        seconds = self.run(name, crypts, size, options["repeat"])
+                        results.append(
+                            {
+                                "bench": name,
+                                "bits": bits,
+                                "size": size,
+                                "auths": nauths,
+                                "seconds": seconds,
+                            }
+                        )
+                        self.stdout.write(
+                            "{:<26} {:>5} bits {:>8} msgs {} auths: {:.3f}s".format(
+                                name, bits, size, nauths, seconds
+                            )
+                        )
+
+        report = {
+            "backend": mixcrypt.BACKEND,
+            "python": platform.python_version(),
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+
+        if options["compare"]:
+            self.compare(results, options["compare"], options["threshold"])
+
+    def compare(self, results, path, threshold):
+        with open(path) as f:
+            baseline = json.load(f)["results"]
+
+        def case(r):
+            return (r["bench"], r["bits"], r["size"], r["auths"])
+
+        before = {case(r): r["seconds"] for r in baseline}
+        slower = []
+        for r in results:
+            old = before.get(case(r))
+            if old and r["seconds"] > old * (1 + threshold):
+                slower.append("{} {} bits {} msgs {} auths".format(*case(r)))
+                self.stdout.write(
+                    "REGRESSION {}: {:.3f}s -> {:.3f}s".format(
+                        slower[-1], old, r["seconds"]
+                    )
+                )
+
+        if slower:
+            raise CommandError(
+                "{} cases slower than {} by more than {:.0%}".format(
+                    len(slower), path, threshold
+                )
+            )
@@ -0,0 +1,38 @@
+# Generated by Django 4.1 on 2026-10-18 09:47
+
+import base.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("mixnet", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Randomness",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("a", base.models.BigBigField()),
+                ("b", base.models.BigBigField()),
+                (
+                    "mixnet",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="pool",
+                        to="mixnet.mixnet",
+                    ),
+                ),
+            ],
+        ),
+    ]
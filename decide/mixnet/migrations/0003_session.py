@@ -0,0 +1,51 @@
+# Generated by Django 4.1 on 2026-10-18 10:10
+
+import base.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("mixnet", "0002_randomness"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Session",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "op",
+                    models.CharField(
+                        choices=[("shuffle", "Shuffle"), ("decrypt", "Decrypt")],
+                        max_length=7,
+                    ),
+                ),
+                ("p", base.models.BigBigField()),
+                ("g", base.models.BigBigField()),
+                ("y", base.models.BigBigField()),
+                ("last", models.BooleanField(default=False)),
+                ("closed", models.BooleanField(default=False)),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("remote_url", models.URLField(blank=True, default="")),
+                ("remote_id", models.PositiveIntegerField(blank=True, null=True)),
+                (
+                    "mixnet",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sessions",
+                        to="mixnet.mixnet",
+                    ),
+                ),
+            ],
+        ),
+    ]
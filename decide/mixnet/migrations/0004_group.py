@@ -0,0 +1,30 @@
+# Generated by Django 4.1 on 2026-10-18 11:09
+
+import base.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("mixnet", "0003_session"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Group",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bits", models.PositiveIntegerField(db_index=True)),
+                ("p", base.models.BigBigField()),
+                ("g", base.models.BigBigField()),
+            ],
+        ),
+    ]
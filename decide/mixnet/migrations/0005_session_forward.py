@@ -0,0 +1,17 @@
+# Generated by Django 4.1 on 2026-10-18 12:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("mixnet", "0004_group"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="session",
+            name="forward",
+            field=models.BooleanField(default=True),
+        ),
+    ]
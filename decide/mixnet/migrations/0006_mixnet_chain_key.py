@@ -0,0 +1,17 @@
+# Generated by Django 4.1 on 2026-10-18 15:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("mixnet", "0005_session_forward"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mixnet",
+            name="chain_key",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
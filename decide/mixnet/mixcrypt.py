@@ -33,28 +33,131 @@ False
 True
 """
 
+import array
+import functools
+import itertools
+import math
+from concurrent.futures import ProcessPoolExecutor
 
 from Crypto.PublicKey import ElGamal
 from Crypto.Random import random
 from Crypto import Random
 from Crypto.Util.number import GCD
 
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
 
-def rand(p):
+
+# big integer arithmetic backend, gmpy2 if it's installed, python ints if not
+if gmpy2:
+    BACKEND = "gmpy2"
+    mpz = gmpy2.mpz
+    powmod = gmpy2.powmod
+    invert = gmpy2.invert
+else:
+    BACKEND = "python"
+    mpz = int
+    powmod = pow
+
+    def invert(a, p):
+        return pow(a, -1, p)
+
+
+class RandomSource:
+    """
+    Buffered CSPRNG, reads the OS random source in blocks of `block` bytes
+    and returns unbiased integers in a range.
+
+    A RandomSource must not be shared between processes, each worker of a
+    pool has to create its own one.
+
+    >>> rng = RandomSource()
+    >>> all(3 <= rng.randint(3, 9) <= 9 for i in range(1000))
+    True
+    >>> sorted(set(rng.randint(3, 9) for i in range(1000)))
+    [3, 4, 5, 6, 7, 8, 9]
+    """
+
+    def __init__(self, block=1 << 16):
+        self.block = block
+        self.buf = b""
+        self.pos = 0
+
+    def read(self, n):
+        if self.pos + n > len(self.buf):
+            rest = self.buf[self.pos :]
+            self.buf = rest + Random.get_random_bytes(max(self.block, n - len(rest)))
+            self.pos = 0
+        data = self.buf[self.pos : self.pos + n]
+        self.pos += n
+        return data
+
+    def randbelow(self, n):
+        """
+        Uniform integer in [0, n), rejecting the values over n of a random
+        number with the bit length of n - 1 (less than 2 tries on average)
+        """
+
+        if n <= 1:
+            return 0
+        bits = (n - 1).bit_length()
+        nbytes = (bits + 7) // 8
+        mask = (1 << bits) - 1
+        while True:
+            v = int.from_bytes(self.read(nbytes), "big") & mask
+            if v < n:
+                return v
+
+    def randint(self, a, b):
+        return a + self.randbelow(b - a + 1)
+
+
+def rand(p, rng=None):
+    """
+    Random k in [1, p - 1] with GCD(k, p - 1) == 1
+
+    For a safe prime p = 2q + 1 the valid values are the odd numbers except
+    q, so k is built directly from a random index into them. Only if p is
+    not a safe prime the GCD check may need to retry.
+
+    >>> ks = [rand(167) for i in range(3000)]
+    >>> all(1 <= k < 167 and GCD(k, 166) == 1 for k in ks)
+    True
+    >>> len(set(ks))
+    82
+    """
+
+    rng = rng or RandomSource(block=0)
+    p = int(p)
+    q = (p - 1) // 2
     while True:
-        k = random.StrongRandom().randint(1, int(p) - 1)
-        if GCD(k, int(p) - 1) == 1:
-            break
-    return k
+        k = 2 * rng.randbelow(q - 1) + 1
+        if k >= q:
+            k += 2
+        if k < p and GCD(k, p - 1) == 1:
+            return k
+
+
+def gen_group(bits):
+    """
+    New safe prime group (p, g) of `bits` bits, it takes a long time for
+    big keys, see mixnet.groups
+    """
+
+    k = ElGamal.generate(bits, Random.new().read)
+    return int(k.p), int(k.g)
 
 
 def gen_multiple_key(*crypts):
     k1 = crypts[0]
     k = MixCrypt(k=k1.k, bits=k1.bits)
-    k.k.y = 1
+    p, g = int(k.k.p), int(k.k.g)
+    y = 1
     for kx in crypts:
-        k.k.y *= kx.k.y
-    k.k.y = k.k.y % k.k.p
+        y = (y * int(kx.k.y)) % p
+    k.k = ElGamal.construct((p, g, y))
     return k
 
 
@@ -65,6 +168,27 @@ def multiple_decrypt(c, *crypts):
     return b
 
 
+def gen_perm(n, rng=None, typecode=None):
+    """
+    Random permutation of range(n) with Fisher-Yates, O(n). With a
+    typecode it's an array.array, 8 bytes per index with "q"
+
+    >>> sorted(gen_perm(1000)) == list(range(1000))
+    True
+    >>> gen_perm(0), gen_perm(1)
+    ([], [0])
+    >>> sorted(gen_perm(10, typecode="q")) == list(range(10))
+    True
+    """
+
+    rng = rng or RandomSource()
+    perm = array.array(typecode, range(n)) if typecode else list(range(n))
+    for i in range(n - 1, 0, -1):
+        j = rng.randbelow(i + 1)
+        perm[i], perm[j] = perm[j], perm[i]
+    return perm
+
+
 def multiple_decrypt_shuffle(ciphers, *crypts):
     b = ciphers
     for i, k in enumerate(crypts):
@@ -103,11 +227,268 @@ def multiple_decrypt_shuffle2(ciphers, *crypts, pubkey=None):
     return b
 
 
+class FixedBase:
+    """
+    Precomputed table to compute base^e mod p for a fixed base.
+
+    The exponent is split in windows of `window` bits and the table stores
+    base^(d * 2^(window * i)) for every digit d of every window i, so each
+    pow is just one multiplication per window.
+
+    >>> fb = FixedBase(156, 167)
+    >>> all(fb.pow(e) == pow(156, e, 167) for e in range(1000))
+    True
+    """
+
+    def __init__(self, base, p, bits=None, window=6):
+        self.base = int(base)
+        self.p = int(p)
+        self.window = window
+        self.bits = bits or self.p.bit_length()
+        self.mask = (1 << window) - 1
+
+        p = mpz(self.p)
+        self.rows = []
+        b = mpz(self.base) % p
+        for i in range(-(-self.bits // window)):
+            row = [mpz(1)]
+            for d in range(self.mask):
+                row.append((row[-1] * b) % p)
+            self.rows.append(row)
+            b = (row[-1] * b) % p
+        self.nbytes = len(self.rows) * (self.mask + 1) * (self.p.bit_length() // 8 + 1)
+
+    def pow(self, e):
+        e = int(e)
+        if e < 0 or e.bit_length() > self.bits:
+            return int(powmod(self.base, e, self.p))
+
+        p = mpz(self.p)
+        r = mpz(1)
+        for row in self.rows:
+            if not e:
+                break
+            d = e & self.mask
+            if d:
+                r = (r * row[d]) % p
+            e >>= self.window
+        return int(r)
+
+
+class KeyTables:
+    """
+    Fixed base tables for g and y of an ElGamal public key (p, g, y)
+
+    >>> B = 256
+    >>> k = MixCrypt(bits=B)
+    >>> pk = (int(k.k.p), int(k.k.g), int(k.k.y))
+    >>> t = KeyTables(*pk)
+    >>> t.encrypt(42, 1234) == tuple(k.k._encrypt(42, 1234))
+    True
+    """
+
+    def __init__(self, p, g, y, window=6):
+        self.p, self.g, self.y = int(p), int(g), int(y)
+        self.gtable = FixedBase(g, p, window=window)
+        self.ytable = FixedBase(y, p, window=window)
+        self.nbytes = self.gtable.nbytes + self.ytable.nbytes
+
+    @property
+    def pubkey(self):
+        return (self.p, self.g, self.y)
+
+    def match(self, k):
+        return self.pubkey == (int(k.p), int(k.g), int(k.y))
+
+    def encrypt(self, m, r):
+        return self.gtable.pow(r), (self.ytable.pow(r) * int(m)) % self.p
+
+
+@functools.lru_cache(maxsize=64)
+def public_key(p, g, y):
+    """
+    ElGamal public key, constructed once for all the ciphertexts of a batch
+    """
+
+    return ElGamal.construct((int(p), int(g), int(y)))
+
+
+def encrypt(pubkey, m, r):
+    """
+    ElGamal encryption of m with the nonce r, returns (g^r, m * y^r)
+    """
+
+    p, g, y = (mpz(int(i)) for i in pubkey)
+    a = powmod(g, r, p)
+    b = (powmod(y, r, p) * int(m)) % p
+    return int(a), int(b)
+
+
+def batch_invert(values, p):
+    """
+    Montgomery's trick, inverts every value mod p with a single inversion
+    and 3 * (n - 1) multiplications
+
+    >>> batch_invert([2, 3, 5, 6], 7) == [invert(v, 7) for v in (2, 3, 5, 6)]
+    True
+    """
+
+    p = mpz(int(p))
+    values = [mpz(int(v)) for v in values]
+    if not values:
+        return []
+
+    prefix = [values[0]]
+    for v in values[1:]:
+        prefix.append((prefix[-1] * v) % p)
+
+    inv = invert(prefix[-1], p)
+    invs = [None] * len(values)
+    for i in range(len(values) - 1, 0, -1):
+        invs[i] = (inv * prefix[i - 1]) % p
+        inv = (inv * values[i]) % p
+    invs[0] = inv
+    return invs
+
+
+def partial_decrypt(privkey, ciphers):
+    """
+    Decryption shares a^x of a batch with the key (p, x) of one auth
+
+    >>> partial_decrypt((167, 130), [(4, 1), (9, 1)]) == [pow(4, 130, 167), pow(9, 130, 167)]
+    True
+    """
+
+    p, x = (mpz(int(i)) for i in privkey)
+    return [powmod(mpz(int(a)), x, p) for a, b in ciphers]
+
+
+def combine(p, ciphers, shares):
+    """
+    Decrypts a batch with the shares of every auth, b / (a^x1 * a^x2 ...),
+    inverting the products together with batch_invert
+
+    >>> k1, k2 = (167, 130), (167, 45)
+    >>> y = pow(156, 130 + 45, 167)
+    >>> c = [encrypt((167, 156, y), m, r) for m, r in ((2, 5), (3, 7), (6, 9))]
+    >>> combine(167, c, [partial_decrypt(k1, c), partial_decrypt(k2, c)])
+    [2, 3, 6]
+    """
+
+    p = mpz(int(p))
+    products = []
+    for column in zip(*shares):
+        prod = mpz(1)
+        for s in column:
+            prod = (prod * mpz(int(s))) % p
+        products.append(prod)
+    invs = batch_invert(products, p)
+    return [int((inv * int(b)) % p) for inv, (a, b) in zip(invs, ciphers)]
+
+
+def batch_decrypt(privkey, ciphers):
+    """
+    Decrypts a batch of ciphertexts with the key (p, x), computing all the
+    a^x first and inverting them together with batch_invert
+
+    >>> c = [encrypt((167, 156, 89), m, r) for m, r in ((2, 5), (3, 7), (6, 9))]
+    >>> batch_decrypt((167, 130), c)
+    [2, 3, 6]
+    """
+
+    if not ciphers:
+        return []
+    return combine(privkey[0], ciphers, [partial_decrypt(privkey, ciphers)])
+
+
+@functools.lru_cache(maxsize=16)
+def baby_steps(g, p, m):
+    """
+    {g^j: j} for j in [0, m), cached for the next tallies with the same key
+    """
+
+    g, p = mpz(g), mpz(p)
+    table = {}
+    e = mpz(1)
+    for j in range(m):
+        table.setdefault(int(e), j)
+        e = (e * g) % p
+    return table
+
+
+def dlog(g, h, p, bound):
+    """
+    x in [0, bound] with g^x = h mod p, with baby-step giant-step in
+    O(sqrt(bound)). Used to get the counts of the homomorphic tally.
+
+    >>> dlog(156, pow(156, 57, 167), 167, 80)
+    57
+    >>> dlog(156, 1, 167, 10)
+    0
+    >>> dlog(156, pow(156, 57, 167), 167, 10) is None
+    True
+    """
+
+    g, h, p = int(g), int(h), int(p)
+    # power of two steps, so close bounds share the cached table
+    m = 1 << math.isqrt(bound).bit_length()
+    table = baby_steps(g, p, m)
+    giant = powmod(invert(mpz(g), p), m, p)
+
+    gamma = mpz(h)
+    for i in range(m + 1):
+        j = table.get(int(gamma))
+        if j is not None and i * m + j <= bound:
+            return i * m + j
+        gamma = (gamma * giant) % p
+    return None
+
+
+def decrypt(privkey, c):
+    """
+    ElGamal decryption with the key (p, x), returns b / a^x
+
+    >>> decrypt((167, 130), encrypt((167, 156, 89), 42, 5))
+    42
+    """
+
+    p, x = (mpz(int(i)) for i in privkey)
+    a, b = (mpz(int(i)) for i in c)
+    return int((invert(powmod(a, x, p), p) * b) % p)
+
+
+_worker = None
+
+
+def _init_worker(pubkey, tables):
+    global _worker
+    _worker = MixCrypt(k=ElGamal.construct(pubkey))
+    _worker.tables = tables
+
+
+def _reencrypt_batch(msgs, factors, pubkey):
+    """
+    Process pool worker, reencrypts a slice of an already permuted batch
+    """
+
+    return [_worker.reencrypt(m, pubkey, f) for m, f in zip(msgs, factors)]
+
+
 class MixCrypt:
-    def __init__(self, k=None, bits=256):
+    def __init__(
+        self, k=None, bits=256, tables=None, rng=None, group=None, privkey=None
+    ):
         self.bits = bits
-        if k:
+        # one buffered random source for all the nonces and permutations
+        self.rng = rng or RandomSource()
+        # optional KeyTables for the public key used to encrypt/reencrypt
+        self.tables = tables
+        if privkey:
+            self.k = privkey
+        elif k:
             self.k = self.getk(k.p, k.g)
+        elif group:
+            self.k = self.getk(*group)
         else:
             self.k = self.genk()
 
@@ -116,8 +497,8 @@ class MixCrypt:
         return self.k
 
     def getk(self, p, g):
-        x = rand(p)
-        y = pow(g, x, p)
+        x = rand(p, self.rng)
+        y = int(powmod(int(g), x, int(p)))
         self.k = ElGamal.construct((p, g, y, x))
         return self.k
 
@@ -126,43 +507,75 @@ class MixCrypt:
         return self.k
 
     def encrypt(self, m, k=None):
-        r = rand(self.k.p)
+        r = rand(self.k.p, self.rng)
         if not k:
             k = self.k
-        a, b = k._encrypt(m, r)
-        return a, b
+        if self.tables and self.tables.match(k):
+            return self.tables.encrypt(m, r)
+        return encrypt((k.p, k.g, k.y), m, r)
 
     def decrypt(self, c):
-        m = self.k._decrypt(c)
-        return m
+        return decrypt((self.k.p, self.k.x), c)
 
     def multiple_decrypt(self, msgs, last=True):
-        msgs2 = []
-        for a, b in msgs:
-            clear = self.decrypt((a, b))
-            if last:
-                msg = clear
-            else:
-                msg = (a, clear)
-            msgs2.append(msg)
-        return msgs2
-
-    def shuffle_decrypt(self, msgs, last=True):
-        msgs2 = msgs.copy()
-        msgs3 = []
-        while msgs2:
-            n = random.StrongRandom().randint(0, len(msgs2) - 1)
-            a, b = msgs2.pop(n)
-            clear = self.decrypt((a, b))
-            if last:
-                msg = clear
-            else:
-                msg = (a, clear)
-            msgs3.append(msg)
-
-        return msgs3
-
-    def reencrypt(self, cipher, pubkey=None):
+        """
+        Decrypts the whole batch with a single modular inversion
+
+        >>> B = 256
+        >>> k = MixCrypt(bits=B)
+        >>> clears = [random.StrongRandom().randint(1, B) for i in range(5)]
+        >>> cipher = [k.encrypt(i) for i in clears]
+        >>> k.multiple_decrypt(cipher) == [k.decrypt(c) for c in cipher] == clears
+        True
+        >>> [a for a, b in k.multiple_decrypt(cipher, last=False)] == [a for a, b in cipher]
+        True
+        """
+
+        clears = batch_decrypt((self.k.p, self.k.x), msgs)
+        if last:
+            return clears
+        return [(a, clear) for (a, b), clear in zip(msgs, clears)]
+
+    def partial_decrypt(self, msgs):
+        """
+        Decryption shares of this auth, to be combined with the shares of
+        the other auths with combine()
+        """
+
+        return [int(s) for s in partial_decrypt((self.k.p, self.k.x), msgs)]
+
+    def combine(self, msgs, shares):
+        return combine(self.k.p, msgs, shares)
+
+    def combine_y(self, *ys):
+        """
+        Public key y of several auths with the same group
+        """
+
+        y = 1
+        for i in ys:
+            y = (y * int(i)) % int(self.k.p)
+        return y
+
+    def shuffle_decrypt(self, msgs, last=True, audit=False):
+        """
+        Shuffle and decrypt. With audit=True returns (msgs, perm), where
+        the output i is the decryption of msgs[perm[i]]
+
+        >>> B = 256
+        >>> k = MixCrypt(bits=B)
+        >>> clears = list(range(2, 12))
+        >>> cipher = [k.encrypt(i) for i in clears]
+        >>> d, perm = k.shuffle_decrypt(cipher, audit=True)
+        >>> d == [clears[p] for p in perm]
+        True
+        """
+
+        perm = self.gen_perm(len(msgs))
+        msgs2 = self.multiple_decrypt([msgs[p] for p in perm], last)
+        return (msgs2, perm) if audit else msgs2
+
+    def reencrypt(self, cipher, pubkey=None, factor=None):
         """
         >>> B = 256
         >>> k = MixCrypt(bits=B)
@@ -175,42 +588,113 @@ class MixCrypt:
         True
         >>> cipher != cipher2
         True
+
+        A precomputed factor (g^r, y^r) can be given to avoid the pows
+
+        >>> factor = k.encrypt(1)
+        >>> k.decrypt(k.reencrypt(cipher[0], factor=factor)) == clears[0]
+        True
         """
 
-        if pubkey:
-            p, g, y = pubkey
-            k = ElGamal.construct((p, g, y))
+        if factor:
+            a, b = (mpz(int(i)) for i in cipher)
+            a1, b1 = factor
+            p = mpz(int(pubkey[0] if pubkey else self.k.p))
+            return (int((a * int(a1)) % p), int((b * int(b1)) % p))
+
+        if pubkey and self.tables and self.tables.pubkey == tuple(map(int, pubkey)):
+            k = self.tables
+        elif pubkey:
+            k = public_key(*map(int, pubkey))
         else:
             k = self.k
 
-        a, b = map(int, cipher)
-        a1, b1 = map(int, self.encrypt(1, k=k))
-        p = int(k.p)
+        a, b = (mpz(int(i)) for i in cipher)
+        a1, b1 = self.encrypt(1, k=k)
+        p = mpz(int(k.p))
 
-        return ((a * a1) % p, (b * b1) % p)
+        return (int((a * a1) % p), int((b * b1) % p))
 
     def gen_perm(self, l):
-        x = list(range(l))
-        for i in range(l):
-            d = random.StrongRandom().randint(0, i)
-            if i != d:
-                x[i] = x[d]
-                x[d] = i
-        return x
+        return gen_perm(l, self.rng)
 
-    def shuffle(self, msgs, pubkey=None):
+    def shuffle(self, msgs, pubkey=None, workers=1, factors=None, audit=False):
         """
         Reencrypt and shuffle
+
+        If workers > 1, the permuted batch is split in slices that are
+        reencrypted in a pool of processes.
+
+        factors is an optional list of precomputed (g^r, y^r) for pubkey,
+        if there are less factors than msgs the rest are computed here.
+
+        With audit=True returns (msgs, perm), where the output i is the
+        reencryption of msgs[perm[i]].
+
+        >>> B = 256
+        >>> k = MixCrypt(bits=B)
+        >>> clears = [random.StrongRandom().randint(1, B) for i in range(16)]
+        >>> cipher = [k.encrypt(i) for i in clears]
+        >>> pk = (int(k.k.p), int(k.k.g), int(k.k.y))
+        >>> cipher2 = k.shuffle(cipher, pk, workers=4)
+        >>> len(cipher2) == len(cipher) and cipher2 != cipher
+        True
+        >>> all(isinstance(c, tuple) for c in cipher2)
+        True
+        >>> sorted(k.decrypt(c) for c in cipher2) == sorted(clears)
+        True
         """
 
-        msgs2 = msgs.copy()
         perm = self.gen_perm(len(msgs))
-        for i, p in enumerate(perm):
-            m = msgs[p]
-            nm = self.reencrypt(m, pubkey)
-            msgs2[i] = nm
+        msgs2 = [msgs[p] for p in perm]
+        msgs2 = self.reencrypt_all(msgs2, pubkey, workers, factors)
+        return (msgs2, perm) if audit else msgs2
+
+    def reencrypt_all(self, msgs, pubkey=None, workers=1, factors=None, pool=None):
+        """
+        Reencrypts a batch keeping its order, in a pool of processes if
+        workers > 1. pool is an executor of worker_pool, to reuse it for
+        several batches.
+        """
+
+        factors = list(factors or [])[: len(msgs)]
+        factors += [None] * (len(msgs) - len(factors))
+
+        if workers <= 1 or len(msgs) < 2:
+            return [self.reencrypt(m, pubkey, f) for m, f in zip(msgs, factors)]
+        return self.pool_reencrypt(msgs, pubkey, workers, factors, pool)
+
+    def worker_pool(self, pubkey, workers):
+        """
+        Pool of processes to reencrypt with pubkey, the workers get the
+        key and the tables once
+        """
+
+        if not pubkey:
+            pubkey = (int(self.k.p), int(self.k.g), int(self.k.y))
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(tuple(map(int, pubkey)), self.tables),
+        )
+
+    def pool_reencrypt(self, msgs, pubkey, workers, factors, pool=None):
+        """
+        Reencrypts an already permuted batch in a pool of processes
+        """
+
+        if pool is None:
+            with self.worker_pool(pubkey, workers) as pool:
+                return self.pool_reencrypt(msgs, pubkey, workers, factors, pool)
+
+        if not pubkey:
+            pubkey = (int(self.k.p), int(self.k.g), int(self.k.y))
 
-        return msgs2
+        size = -(-len(msgs) // workers)
+        slices = [msgs[i : i + size] for i in range(0, len(msgs), size)]
+        fslices = [factors[i : i + size] for i in range(0, len(factors), size)]
+        done = pool.map(_reencrypt_batch, slices, fslices, itertools.repeat(pubkey))
+        return [c for batch in done for c in batch]
 
 
 if __name__ == "__main__":
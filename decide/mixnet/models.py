@@ -1,13 +1,30 @@
-from django.db import models
+import hmac
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from .mixcrypt import MixCrypt
+from django.db import connection, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .eccrypt import ECMixCrypt
+from .mixcrypt import MixCrypt, RandomSource, rand
+from .groups import get_group
+from .context import forget_key, get_context
+from .tables import get_tables
+from . import batch, client
+from .batch import CiphertextBatch
 
 from base import mods
-from base.models import Auth, Key
+from base.models import Auth, BigBigField, Key
 from base.serializers import AuthSerializer
 from django.conf import settings
 
 
+logger = logging.getLogger(__name__)
+
 # number of bits for the key, all auths should use the same number of bits
 B = settings.KEYBITS
 
@@ -26,6 +43,9 @@ class Mixnet(models.Model):
         related_name="mixnets_pub",
         on_delete=models.SET_NULL,
     )
+    # secret shared by the auths of the chain, for the calls that only the
+    # other auths can make (see mixnet.views.ChainView)
+    chain_key = models.CharField(max_length=64, blank=True, default="")
 
     def __str__(self):
         auths = ", ".join(a.name for a in self.auths.all())
@@ -33,35 +53,181 @@ class Mixnet(models.Model):
             self.voting_id, auths, self.pubkey
         )
 
+    def crypt(self, pk=None):
+        """
+        MixCrypt with the private key of this auth and, if pk is the pubkey
+        or the key of the mixnet, with its fixed base tables
+        """
+
+        return get_context(self).crypt(pk)
+
     def shuffle(self, msgs, pk):
-        crypt = MixCrypt(bits=B)
-        crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
+        """
+        Reencrypts and shuffles a CiphertextBatch (or a list of [a, b]),
+        returns a CiphertextBatch
+        """
+
+        crypt = self.crypt(pk)
+        msgs = CiphertextBatch.from_msgs(msgs, batch.record_width(pk[0]))
+        factors = self.take_pool(len(msgs), pk)
+        out = crypt.reencrypt_all(
+            msgs.permute(crypt.gen_perm(len(msgs))),
+            pk,
+            workers=settings.MIXNET_SHUFFLE_WORKERS,
+            factors=factors,
+        )
+        return CiphertextBatch.from_msgs(out, msgs.width)
+
+    def set_pubkey(self, p, g, y, curve=""):
+        """
+        Saves the public key of the whole voting, sent by the first auth once
+        all the keys are generated. Until then the auths after the first one
+        only know the key combined with the next auths.
+        """
+
+        old = self.pubkey
+        if old and (int(old.p), int(old.g), int(old.y)) == (int(p), int(g), int(y)):
+            return
+
+        self.pubkey = Key.objects.create(p=p, g=g, y=y, curve=curve)
+        self.save()
+        # factors for the old key are useless
+        self.pool.all().delete()
+        if old:
+            old.delete()
+        self.fill_pool_later()
+
+    def fill_pool(self, size=None, chunk=500):
+        """
+        Precomputes reencryption factors (g^r, y^r) for the pubkey until the
+        pool has `size` entries. Returns the number of new entries.
+        """
+
+        if size is None:
+            size = settings.MIXNET_POOL_SIZE
+        if not self.pubkey or self.pubkey.curve:
+            return 0
+
+        tables = get_tables(self.pubkey)
+        rng = RandomSource()
+        missing = size - self.pool.count()
+        added = 0
+        while added < missing:
+            n = min(chunk, missing - added)
+            factors = [tables.encrypt(1, rand(tables.p, rng)) for i in range(n)]
+            Randomness.objects.bulk_create(
+                Randomness(mixnet=self, a=a, b=b) for a, b in factors
+            )
+            added += n
+        return added
+
+    def fill_pool_later(self):
+        """
+        Fills the pool once the pubkey is committed, in the background
+        threads of settings.MIXNET_POOL_WORKERS or in this one if it's 0
+        """
+
+        if not settings.MIXNET_POOL_SIZE:
+            return
+        if settings.MIXNET_POOL_WORKERS:
+            mixnet_id = self.id
+            transaction.on_commit(
+                lambda: get_pool_executor().submit(fill_pool_work, mixnet_id)
+            )
+        else:
+            transaction.on_commit(self.fill_pool)
+
+    def take_pool(self, n, pk):
+        """
+        Takes up to n precomputed factors from the pool, only if pk is the
+        mixnet pubkey. Used factors are deleted, they can't be reused.
+        """
+
+        if not self.pubkey:
+            return []
+        if (self.pubkey.p, self.pubkey.g, self.pubkey.y) != tuple(map(int, pk)):
+            return []
+
+        with transaction.atomic():
+            factors = list(
+                self.pool.select_for_update()
+                .order_by("id")
+                .values_list("id", "a", "b")[:n]
+            )
+            Randomness.objects.filter(id__in=[f[0] for f in factors]).delete()
+        return [(a, b) for _, a, b in factors]
 
-        return crypt.shuffle(msgs, pk)
+    def decrypt(self, msgs, pk, last=False, keep_order=False):
+        """
+        Decrypts (and shuffles) a CiphertextBatch (or a list of [a, b]),
+        returns the votes if it's the last auth or a CiphertextBatch
+        """
 
-    def decrypt(self, msgs, pk, last=False):
-        crypt = MixCrypt(bits=B)
-        crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
-        return crypt.shuffle_decrypt(msgs, last)
+        crypt = self.crypt()
+        msgs = CiphertextBatch.from_msgs(msgs, batch.record_width(pk[0]))
+        if not keep_order:
+            msgs = msgs.permute(crypt.gen_perm(len(msgs)))
+        out = crypt.multiple_decrypt(msgs, last)
+        return out if last else CiphertextBatch.from_msgs(out, msgs.width)
 
-    def gen_key(self, p=0, g=0):
-        crypt = MixCrypt(bits=B)
+    def partial(self, msgs):
+        return self.crypt().partial_decrypt(msgs)
+
+    def parallel_decrypt(self, msgs, pk):
+        """
+        Sends the batch to all the next auths at the same time, computes
+        the shares of this auth meanwhile and combines all of them here.
+        The batch isn't permuted again, it should be already shuffled.
+        """
+
+        auths = list(self.next_auths())
+        path = "/partial/{}/".format(self.voting_id)
+
+        def remote(i, auth):
+            data = {
+                "msgs": msgs,
+                "voting": self.voting_id,
+                "position": self.auth_position + 1 + i,
+                "chain_key": self.chain_key,
+            }
+            wire = settings.MIXNET_WIRE_FORMAT
+            return mods.post(
+                "mixnet",
+                entry_point=path,
+                baseurl=auth.url,
+                json=data,
+                wire=wire,
+                timeout=client.timeout(),
+            )
+
+        with ThreadPoolExecutor(max_workers=max(len(auths), 1)) as pool:
+            futures = [pool.submit(remote, i, a) for i, a in enumerate(auths)]
+            shares = [self.partial(msgs)]
+            shares += [f.result() for f in futures]
+
+        return self.crypt().combine(msgs, shares)
+
+    def gen_key(self, p=0, g=0, curve=""):
         if self.key:
-            k = crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
-        elif not g or not p:
-            k = crypt.genk()
-            key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
-            key.save()
-
-            self.key = key
-            self.save()
+            return
+
+        if curve:
+            k = ECMixCrypt(curve=curve).k
         else:
-            k = crypt.getk(p, g)
-            key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
-            key.save()
+            # the first auth takes the group from the registry, the rest use
+            # the group of the first one
+            if not g or not p:
+                p, g = get_group(B) or (0, 0)
 
-            self.key = key
-            self.save()
+            if p and g:
+                k = MixCrypt(bits=B, group=(p, g)).k
+            else:
+                k = MixCrypt(bits=B).k
+        key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x), curve=curve)
+        key.save()
+
+        self.key = key
+        self.save()
 
     def chain_call(self, path, data):
         next_auths = self.next_auths()
@@ -71,20 +237,211 @@ class Mixnet(models.Model):
                 "auths": AuthSerializer(next_auths, many=True).data,
                 "voting": self.voting_id,
                 "position": self.auth_position + 1,
+                "chain_key": self.chain_key,
             }
         )
 
         if next_auths:
             auth = next_auths.first().url
-            r = mods.post("mixnet", entry_point=path, baseurl=auth, json=data)
+            wire = settings.MIXNET_WIRE_FORMAT if "msgs" in data else "json"
+            r = mods.post(
+                "mixnet",
+                entry_point=path,
+                baseurl=auth,
+                json=data,
+                wire=wire,
+                timeout=client.timeout(),
+            )
             return r
 
         return None
 
+    def is_chain(self, key):
+        """
+        True if key is the chain_key of this mixnet
+        """
+
+        if not self.chain_key or not isinstance(key, str):
+            return False
+        return hmac.compare_digest(self.chain_key.encode(), key.encode())
+
     def next_auths(self):
-        next_auths = self.auths.filter(me=False)
+        next_auths = self.auths.filter(me=False).order_by("pk")
 
         if self.auths.count() == next_auths.count():
             next_auths = next_auths[1:]
 
         return next_auths
+
+
+@receiver([post_save, post_delete], sender=Key)
+def key_changed(sender, instance, **kwargs):
+    forget_key(instance.id)
+
+
+class Randomness(models.Model):
+    """
+    Reencryption factor (g^r, y^r) for the pubkey of a mixnet, precomputed
+    while the voting is open. Each one must be used only once.
+    """
+
+    mixnet = models.ForeignKey(Mixnet, related_name="pool", on_delete=models.CASCADE)
+    a = BigBigField()
+    b = BigBigField()
+
+
+_pool_lock = threading.Lock()
+_pool_executor = None
+
+
+def get_pool_executor():
+    global _pool_executor
+    with _pool_lock:
+        if _pool_executor is None:
+            _pool_executor = ThreadPoolExecutor(
+                max_workers=settings.MIXNET_POOL_WORKERS, thread_name_prefix="pool"
+            )
+    return _pool_executor
+
+
+def fill_pool_work(mixnet_id):
+    try:
+        mn = Mixnet.objects.filter(pk=mixnet_id).first()
+        if mn:
+            mn.fill_pool()
+    except Exception:
+        logger.exception("filling the pool of mixnet %s failed", mixnet_id)
+    finally:
+        # each worker thread has its own connection
+        connection.close()
+
+
+class Session(models.Model):
+    """
+    Chunked shuffle or decrypt of a ballot box. The ciphertexts are sent
+    and read in pages, and kept in batch files (see mixnet.batch), so
+    neither the requests nor the process hold the whole box in memory.
+    """
+
+    OPS = [("shuffle", "Shuffle"), ("decrypt", "Decrypt")]
+
+    mixnet = models.ForeignKey(
+        Mixnet, related_name="sessions", on_delete=models.CASCADE
+    )
+    op = models.CharField(max_length=7, choices=OPS)
+    p = BigBigField()
+    g = BigBigField()
+    y = BigBigField()
+    last = models.BooleanField(default=False)
+    # send the output to the next auth when it's closed
+    forward = models.BooleanField(default=True)
+    closed = models.BooleanField(default=False)
+    count = models.PositiveIntegerField(default=0)
+    # session in the next auth of the chain, that has the final output
+    remote_url = models.URLField(blank=True, default="")
+    remote_id = models.PositiveIntegerField(blank=True, null=True)
+
+    @property
+    def pk_tuple(self):
+        return (self.p, self.g, self.y)
+
+    def path(self, name):
+        directory = settings.MIXNET_BATCH_DIR or tempfile.gettempdir()
+        return os.path.join(directory, "session-{}.{}".format(self.id, name))
+
+    def batch(self, name, arity=2):
+        return batch.FileBatch(self.path(name), batch.record_width(self.p), arity)
+
+    def output(self):
+        arity = 1 if self.op == "decrypt" and self.last else 2
+        return self.batch("out", arity)
+
+    def append(self, msgs):
+        with self.batch("in") as b:
+            b.extend(msgs)
+            self.count = len(b)
+        self.save()
+
+    def page(self, page, size=None):
+        """
+        Output page number `page`, proxied to the next auth if this session
+        was chained
+        """
+
+        size = size or settings.MIXNET_PAGE_SIZE
+        if self.remote_id:
+            return client.page(self.remote_id, page, self.remote_url, size)
+
+        with self.output() as b:
+            msgs = b.read(page * size, (page + 1) * size)
+        if b.arity == 1:
+            return msgs
+        return [list(m) for m in msgs]
+
+    def process(self):
+        """
+        Shuffles (or decrypts) the uploaded ciphertexts into the output
+        batch, one page at a time
+        """
+
+        crypt = self.mixnet.crypt(self.pk_tuple)
+        size = settings.MIXNET_PAGE_SIZE
+
+        with self.batch("in") as src, self.output() as dst:
+            if self.op == "shuffle":
+
+                def factors(n):
+                    return self.mixnet.take_pool(n, self.pk_tuple)
+
+                workers = settings.MIXNET_SHUFFLE_WORKERS
+                batch.shuffle(crypt, src, dst, self.pk_tuple, size, workers, factors)
+            else:
+                batch.decrypt(crypt, src, dst, self.last, size)
+
+        batch.remove(self.path("in"))
+        self.closed = True
+        self.save()
+
+    def chain(self):
+        """
+        Sends the output to a new session in the next auth, that will chain
+        it again until the last auth
+        """
+
+        next_auths = self.mixnet.next_auths()
+        if not next_auths:
+            return
+
+        url = next_auths.first().url
+        with self.output() as b:
+            self.remote_id, _ = client.stream(
+                self.op,
+                self.mixnet.voting_id,
+                (list(m) for m in b),
+                baseurl=url,
+                position=self.mixnet.auth_position + 1,
+                pk=self.pk_tuple,
+            )
+        self.remote_url = url
+        self.save()
+        batch.remove(self.path("out"))
+
+    def delete(self, *args, **kwargs):
+        if self.remote_id:
+            client.delete(self.remote_id, baseurl=self.remote_url)
+        batch.remove(self.path("in"))
+        batch.remove(self.path("out"))
+        return super().delete(*args, **kwargs)
+
+
+class Group(models.Model):
+    """
+    Safe prime group pregenerated with the gengroups command
+    """
+
+    bits = models.PositiveIntegerField(db_index=True)
+    p = BigBigField()
+    g = BigBigField()
+
+    def __str__(self):
+        return "{} bits, {}".format(self.bits, str(self.p)[:16])
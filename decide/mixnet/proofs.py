@@ -0,0 +1,187 @@
+"""
+Zero knowledge proofs of the homomorphic ballots, made non-interactive
+with the Fiat-Shamir heuristic (sha256).
+
+A homomorphic ballot has an ElGamal ciphertext (a, b) = (g^r, g^m y^r) per
+option. Each one comes with a disjunctive Chaum-Pedersen proof that m is
+0 or 1, and the whole ballot with a Chaum-Pedersen proof that the product
+of its ciphertexts encrypts g^1, so exactly one option is chosen.
+
+g and y are in the subgroup of order q = (p - 1) / 2 of the safe prime p,
+like the keys of the mixnet, and the ciphertexts must be in it too. The
+proofs are bound to a context, the voting and the voter, so a ballot
+can't be copied by another voter.
+
+>>> p = 87097010700619948096711819523123557176799520976132200207307054568374541152947
+>>> g = 57844715533034499366023205962279523701191112523212359296073570949045702808176
+>>> pk = (p, g, pow(g, 1234, p))
+>>> ciphers, proofs, proof = encrypt_ballot(pk, [0, 1, 0], "1:2")
+>>> all(verify_bit(pk, c, pr, "1:2") for c, pr in zip(ciphers, proofs))
+True
+>>> verify_sum(pk, ciphers, proof, "1:2")
+True
+>>> verify_sum(pk, ciphers, proof, "1:3")
+False
+
+A vote for g^2 doesn't get through, with the proofs of other ciphertexts
+or with a ballot whose options add up to two
+
+>>> c = encrypt(pk, pow(g, 2, p), 5)
+>>> any(verify_bit(pk, c, pr, "1:2") for pr in proofs)
+False
+>>> ciphers, proofs, proof = encrypt_ballot(pk, [1, 1, 0], "1:2")
+>>> verify_sum(pk, ciphers, proof, "1:2")
+False
+"""
+
+import hashlib
+
+from .mixcrypt import RandomSource, encrypt, invert, mpz, powmod
+
+
+def group_order(p):
+    return (int(p) - 1) // 2
+
+
+def in_group(p, v):
+    """
+    True if v is in the subgroup of order q of the safe prime p
+    """
+
+    p, v = int(p), int(v)
+    return 1 <= v < p and powmod(v, group_order(p), p) == 1
+
+
+def challenge(pk, context, kind, *values):
+    data = [context, kind] + [str(int(v)) for v in list(pk) + list(values)]
+    h = hashlib.sha256("|".join(data).encode()).digest()
+    return int.from_bytes(h, "big") % group_order(pk[0])
+
+
+def commitments(pk, cipher, c, s, m):
+    """
+    (g^s / a^c, y^s / (b / g^m)^c), the commitments that a proof with the
+    challenge c and the response s should have for the plaintext g^m.
+    The ciphertext must be in the group, a^-c is a^(q - c).
+    """
+
+    p, g, y = (mpz(int(i)) for i in pk)
+    q = group_order(p)
+    a, b = (mpz(int(i)) for i in cipher)
+    bm = b * invert(powmod(g, m, p), p) % p
+    ta = powmod(g, s, p) * powmod(a, q - c, p) % p
+    tb = powmod(y, s, p) * powmod(bm, q - c, p) % p
+    return int(ta), int(tb)
+
+
+def prove_bit(pk, cipher, m, r, context, rng=None):
+    """
+    Proof that cipher, encrypted with the nonce r, is g^0 or g^1. The
+    branch of the other plaintext is simulated.
+    """
+
+    if m not in (0, 1):
+        raise ValueError("the plaintext must be g^0 or g^1")
+    p, g, y = (mpz(int(i)) for i in pk)
+    q = group_order(p)
+    rng = rng or RandomSource(block=0)
+
+    cs, ss, ts = [0, 0], [0, 0], [None, None]
+    fake = 1 - m
+    cs[fake], ss[fake] = rng.randbelow(q), rng.randbelow(q)
+    ts[fake] = commitments(pk, cipher, cs[fake], ss[fake], fake)
+    w = rng.randbelow(q)
+    ts[m] = (int(powmod(g, w, p)), int(powmod(y, w, p)))
+
+    c = challenge(pk, context, "bit", *cipher, *ts[0], *ts[1])
+    cs[m] = (c - cs[fake]) % q
+    ss[m] = (w + cs[m] * r) % q
+    return {"c0": cs[0], "c1": cs[1], "s0": int(ss[0]), "s1": int(ss[1])}
+
+
+def verify_bit(pk, cipher, proof, context):
+    try:
+        a, b = (int(i) for i in cipher)
+        c0, c1, s0, s1 = (int(proof[k]) for k in ("c0", "c1", "s0", "s1"))
+    except (KeyError, TypeError, ValueError):
+        return False
+
+    p = int(pk[0])
+    q = group_order(p)
+    if not (in_group(p, a) and in_group(p, b)):
+        return False
+    if not all(0 <= v < q for v in (c0, c1, s0, s1)):
+        return False
+    t0 = commitments(pk, (a, b), c0, s0, 0)
+    t1 = commitments(pk, (a, b), c1, s1, 1)
+    return (c0 + c1) % q == challenge(pk, context, "bit", a, b, *t0, *t1)
+
+
+def product(p, ciphers):
+    a, b = mpz(1), mpz(1)
+    for ca, cb in ciphers:
+        a, b = a * int(ca) % p, b * int(cb) % p
+    return int(a), int(b)
+
+
+def prove_sum(pk, ciphers, r, context, rng=None):
+    """
+    Proof that the product of the ciphers, whose nonces add up to r, is
+    g^1
+    """
+
+    p, g, y = (mpz(int(i)) for i in pk)
+    q = group_order(p)
+    rng = rng or RandomSource(block=0)
+
+    total = product(p, ciphers)
+    w = rng.randbelow(q)
+    t = (int(powmod(g, w, p)), int(powmod(y, w, p)))
+    c = challenge(pk, context, "sum", *total, *t)
+    return {"c": c, "s": int((w + c * r) % q)}
+
+
+def verify_sum(pk, ciphers, proof, context):
+    """
+    The ciphers must be already checked with verify_bit, so they're in
+    the group
+    """
+
+    try:
+        c, s = int(proof["c"]), int(proof["s"])
+    except (KeyError, TypeError, ValueError):
+        return False
+
+    p = int(pk[0])
+    q = group_order(p)
+    if not (0 <= c < q and 0 <= s < q):
+        return False
+    total = product(p, ciphers)
+    t = commitments(pk, total, c, s, 1)
+    return c == challenge(pk, context, "sum", *total, *t)
+
+
+def encrypt_ballot(pk, bits, context, rng=None):
+    """
+    Ciphertexts of g^m for each m in bits, with their proofs and the proof
+    of the sum. Returns (ciphers, bit proofs, sum proof).
+    """
+
+    p, g = int(pk[0]), int(pk[1])
+    q = group_order(p)
+    rng = rng or RandomSource()
+
+    ciphers, proofs, total = [], [], 0
+    for m in bits:
+        r = rng.randint(1, q - 1)
+        cipher = encrypt(pk, powmod(g, m, p), r)
+        ciphers.append(cipher)
+        proofs.append(prove_bit(pk, cipher, m, r, context, rng))
+        total += r
+    return ciphers, proofs, prove_sum(pk, ciphers, total % q, context, rng)
+
+
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod()
@@ -10,4 +10,4 @@ class MixnetSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Mixnet
-        fields = ("voting_id", "auths", "pubkey")
+        fields = ("voting_id", "auth_position", "auths", "pubkey")
@@ -0,0 +1,41 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .mixcrypt import KeyTables
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+
+def get_tables(key):
+    """
+    Returns the fixed base tables for the public part of a Key row.
+
+    Tables are cached by Key id, least recently used tables are dropped
+    when the cache grows over settings.MIXNET_TABLES_CACHE bytes.
+    """
+
+    pubkey = (int(key.p), int(key.g), int(key.y))
+    with _lock:
+        tables = _cache.get(key.id)
+        if tables and tables.pubkey == pubkey:
+            _cache.move_to_end(key.id)
+            return tables
+
+    tables = KeyTables(*pubkey, window=settings.MIXNET_TABLES_WINDOW)
+    if tables.nbytes > settings.MIXNET_TABLES_CACHE:
+        return tables
+
+    with _lock:
+        _cache[key.id] = tables
+        _cache.move_to_end(key.id)
+        while sum(t.nbytes for t in _cache.values()) > settings.MIXNET_TABLES_CACHE:
+            _cache.popitem(last=False)
+    return tables
+
+
+def clear_tables():
+    with _lock:
+        _cache.clear()
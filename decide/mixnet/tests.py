@@ -1,30 +1,60 @@
+import io
+import json
+import os
+import pickle
+import tempfile
+from unittest import mock
+
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
 from mixnet.mixcrypt import MixCrypt
 from mixnet.mixcrypt import ElGamal
+from mixnet.tables import get_tables, clear_tables
+from mixnet import batch, client
+from mixnet.batch import CiphertextBatch
+from mixnet.eccrypt import ECMixCrypt
+from mixnet.context import clear_contexts, get_context
+from mixnet.groups import get_group
+from mixnet.models import Group, Mixnet, Session
+
+from base import mods, wire
+from base.models import Key
+
+
+def encrypt_msgs(msgs, pk, bits=settings.KEYBITS):
+    p, g, y = pk
+    k = MixCrypt(bits=bits)
+    k.k = ElGamal.construct((p, g, y))
 
-from base import mods
+    cipher = [k.encrypt(i) for i in msgs]
+    return cipher
 
 
-class MixnetCase(APITestCase):
+class MixnetMixin:
+    """
+    Mocked queries to the modules and the mixnet of the voting 1 with a
+    single auth
+    """
+
     def setUp(self):
+        super().setUp()
         self.client = APIClient()
         mods.mock_query(self.client)
 
     def tearDown(self):
         self.client = None
+        super().tearDown()
 
     def encrypt_msgs(self, msgs, pk, bits=settings.KEYBITS):
-        p, g, y = pk
-        k = MixCrypt(bits=bits)
-        k.k = ElGamal.construct((p, g, y))
-
-        cipher = [k.encrypt(i) for i in msgs]
-        return cipher
+        return encrypt_msgs(msgs, pk, bits)
 
-    def test_create(self):
+    def create(self):
         data = {
             "voting": 1,
             "auths": [{"name": "auth1", "url": "http://localhost:8000"}],
@@ -33,8 +63,40 @@ class MixnetCase(APITestCase):
         response = self.client.post("/mixnet/", data, format="json")
         self.assertEqual(response.status_code, 200)
 
+        self.key = response.json()
+        return self.key
+
+
+def ec_encrypt_msgs(msgs, key):
+    k = ECMixCrypt(curve=key["curve"])
+    k.setk(key["p"], key["g"], key["y"], 0)
+    return [k.encrypt(i) for i in msgs]
+
+
+class ECMixin(MixnetMixin):
+    """
+    MixnetMixin with the EC mixnet of the voting 1, with two auths
+    """
+
+    def create_ec(self):
+        data = {
+            "voting": 1,
+            "curve": "p256",
+            "auths": [
+                {"name": "auth1", "url": "http://localhost:8000"},
+                {"name": "auth2", "url": "http://127.0.0.1:8000"},
+            ],
+        }
+        response = self.client.post("/mixnet/", data, format="json")
+        self.assertEqual(response.status_code, 200)
         key = response.json()
-        self.key = key
+        self.assertEqual(key["curve"], "p256")
+        return key
+
+
+class MixnetCase(MixnetMixin, APITestCase):
+    def test_create(self):
+        key = self.create()
 
         self.assertEqual(type(key["g"]), int)
         self.assertEqual(type(key["p"]), int)
@@ -70,6 +132,25 @@ class MixnetCase(APITestCase):
 
         self.assertNotEqual(shuffled, encrypt)
 
+    @override_settings(MIXNET_SHUFFLE_WORKERS=2)
+    def test_shuffle_workers(self):
+        self.test_create()
+
+        clear = [2, 3, 4, 5, 6, 7, 8, 9]
+        pk = self.key["p"], self.key["g"], self.key["y"]
+        encrypt = self.encrypt_msgs(clear, pk)
+        data = {"msgs": encrypt, "pk": self.key}
+
+        response = self.client.post("/mixnet/shuffle/1/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        shuffled = response.json()
+        self.assertNotEqual(shuffled, encrypt)
+
+        data = {"msgs": shuffled}
+        response = self.client.post("/mixnet/decrypt/1/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(clear), sorted(response.json()))
+
     def test_decrypt(self):
         self.test_create()
 
@@ -182,3 +263,574 @@ class MixnetCase(APITestCase):
 
         self.assertNotEqual(clear, clear1)
         self.assertEqual(sorted(clear), sorted(clear1))
+
+    @override_settings(MIXNET_WIRE_FORMAT="binary")
+    def test_multiple_auths_binary(self):
+        data = {
+            "voting": 1,
+            "auths": [
+                {"name": "auth1", "url": "http://localhost:8000"},
+                {"name": "auth2", "url": "http://127.0.0.1:8000"},
+            ],
+        }
+        response = self.client.post("/mixnet/", data, format="json")
+        key = response.json()
+        pk = key["p"], key["g"], key["y"]
+
+        clear = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]
+        encrypt = self.encrypt_msgs(clear, pk)
+
+        data = {"msgs": encrypt, "pk": key}
+        shuffled = mods.post("mixnet", "/shuffle/1/", json=data, wire="binary")
+        self.assertEqual(len(shuffled), len(encrypt))
+        self.assertNotEqual(shuffled, encrypt)
+
+        data = {"msgs": shuffled, "pk": key}
+        clear1 = mods.post("mixnet", "/decrypt/1/", json=data, wire="binary")
+        self.assertEqual(sorted(clear), sorted(clear1))
+
+    def test_multiple_auths_tables(self):
+        data = {
+            "voting": 1,
+            "auths": [
+                {"name": "auth1", "url": "http://localhost:8000"},
+                {"name": "auth2", "url": "http://127.0.0.1:8000"},
+            ],
+        }
+        key = self.client.post("/mixnet/", data, format="json").json()
+        pk = key["p"], key["g"], key["y"]
+
+        crypts = {}
+        crypt = Mixnet.crypt
+
+        def spy(mn, pk=None):
+            crypts[mn.auth_position] = crypt(mn, pk)
+            return crypts[mn.auth_position]
+
+        clear = [2, 3, 4, 5, 6, 7, 8, 9]
+        data = {"msgs": self.encrypt_msgs(clear, pk), "pk": key}
+        with mock.patch.object(Mixnet, "crypt", spy):
+            response = self.client.post("/mixnet/shuffle/1/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(crypts), [0, 1])
+        for c in crypts.values():
+            self.assertEqual(c.tables.pubkey, pk)
+
+
+@override_settings(MIXNET_POOL_SIZE=0)
+class ParallelCase(ECMixin, APITransactionTestCase):
+    """
+    Transaction test case, the shares are asked from other threads that
+    should see the mixnets. The pool isn't filled in the background.
+    """
+
+    def test_parallel_decrypt(self):
+        data = {
+            "voting": 1,
+            "auths": [
+                {"name": "auth1", "url": "http://localhost:8000"},
+                {"name": "auth2", "url": "http://127.0.0.1:8000"},
+                {"name": "auth3", "url": "http://0.0.0.0:8000"},
+            ],
+        }
+        response = self.client.post("/mixnet/", data, format="json")
+        key = response.json()
+        pk = key["p"], key["g"], key["y"]
+
+        clear = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]
+        encrypt = encrypt_msgs(clear, pk)
+
+        data = {"msgs": encrypt, "pk": key}
+        response = self.client.post("/mixnet/shuffle/1/", data, format="json")
+        shuffled = response.json()
+
+        data = {"msgs": shuffled, "pk": key, "mode": "parallel"}
+        response = self.client.post("/mixnet/decrypt/1/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        clear2 = response.json()
+        self.assertEqual(sorted(clear), sorted(clear2))
+
+        data = {"msgs": shuffled, "pk": key}
+        response = self.client.post("/mixnet/decrypt/1/", data, format="json")
+        self.assertEqual(sorted(clear2), sorted(response.json()))
+
+    def test_parallel_decrypt_ec(self):
+        key = self.create_ec()
+        clear = [2, 3, 4, 5, 6, 7]
+        encrypt = ec_encrypt_msgs(clear, key)
+
+        data = {"msgs": encrypt, "pk": key, "mode": "parallel"}
+        clear2 = mods.post("mixnet", "/decrypt/1/", json=data, wire="binary")
+        self.assertEqual(clear2, clear)
+
+    def test_partial(self):
+        data = {
+            "voting": 1,
+            "auths": [{"name": "auth1", "url": "http://localhost:8000"}],
+        }
+        response = self.client.post("/mixnet/", data, format="json")
+        key = response.json()
+        pk = key["p"], key["g"], key["y"]
+        encrypt = encrypt_msgs([2, 3], pk)
+
+        # a decryption share of any ciphertext is only for the chain
+        data = {"msgs": encrypt}
+        response = self.client.post("/mixnet/partial/1/", data, format="json")
+        self.assertEqual(response.status_code, 401)
+
+        data["chain_key"] = Mixnet.objects.get(voting_id=1).chain_key
+        response = self.client.post("/mixnet/partial/1/", data, format="json")
+        shares = response.json()
+        self.assertEqual(len(shares), 2)
+        clear = [b * pow(s, -1, pk[0]) % pk[0] for (a, b), s in zip(encrypt, shares)]
+        self.assertEqual(clear, [2, 3])
+
+
+class ECCase(ECMixin, APITestCase):
+    def test_ec_mixnet(self):
+        key = self.create_ec()
+        clear = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]
+        encrypt = ec_encrypt_msgs(clear, key)
+
+        data = {"msgs": encrypt, "pk": key}
+        response = self.client.post("/mixnet/shuffle/1/", data, format="json")
+        shuffled = response.json()
+        self.assertNotEqual(shuffled, encrypt)
+
+        data = {"msgs": shuffled, "pk": key}
+        response = self.client.post("/mixnet/decrypt/1/", data, format="json")
+        self.assertEqual(sorted(response.json()), clear)
+
+        data = {"msgs": shuffled, "pk": key}
+        clear2 = mods.post("mixnet", "/decrypt/1/", json=data, wire="binary")
+        self.assertEqual(sorted(clear2), clear)
+
+    def test_bad_curve(self):
+        data = {"voting": 1, "curve": "p1", "auths": []}
+        response = self.client.post("/mixnet/", data, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_point_not_on_curve(self):
+        key = self.create_ec()
+        encrypt = ec_encrypt_msgs([2, 3], key)
+        # there's no point with x = 1 in p256
+        encrypt[1] = [encrypt[1][0], 1 << 1]
+
+        data = {"msgs": encrypt, "pk": key}
+        for path in ("/mixnet/shuffle/1/", "/mixnet/decrypt/1/"):
+            response = self.client.post(path, data, format="json")
+            self.assertEqual(response.status_code, 400)
+
+
+class WireCase(TestCase):
+    def test_roundtrip(self):
+        p = 2**255 + 95
+        msgs = [[1, 2], [p - 1, p - 2], [0, 256]]
+        data = wire.dumps(msgs, {"voting": 1}, p=p)
+        self.assertEqual(len(data), wire.HEADER.size + 13 + 32 * 2 * 3)
+        self.assertEqual(wire.loads(data), {"voting": 1, "msgs": msgs})
+
+        self.assertEqual(wire.loads(wire.dumps([5, 6, 70000]))["msgs"], [5, 6, 70000])
+        self.assertEqual(wire.loads(wire.dumps([]))["msgs"], [])
+
+
+class GroupCase(APITestCase):
+    P = 87097010700619948096711819523123557176799520976132200207307054568374541152947
+    G = 57844715533034499366023205962279523701191112523212359296073570949045702808176
+
+    def setUp(self):
+        self.client = APIClient()
+        mods.mock_query(self.client)
+
+    def tearDown(self):
+        self.client = None
+
+    def test_standard_group(self):
+        p, g = get_group(2048)
+        self.assertEqual(p.bit_length(), 2048)
+        k = MixCrypt(bits=2048, group=(p, g))
+        self.assertEqual(k.decrypt(k.encrypt(42)), 42)
+
+    def test_registry(self):
+        self.assertIsNone(get_group(256))
+        Group.objects.create(bits=256, p=self.P, g=self.G)
+        self.assertEqual(get_group(256), (self.P, self.G))
+
+    def test_create_from_registry(self):
+        Group.objects.create(bits=256, p=self.P, g=self.G)
+        data = {
+            "voting": 1,
+            "auths": [{"name": "auth1", "url": "http://localhost:8000"}],
+        }
+        response = self.client.post("/mixnet/", data, format="json")
+        key = response.json()
+        self.assertEqual((key["p"], key["g"]), (self.P, self.G))
+
+        k = MixCrypt(bits=256, group=(self.P, self.G))
+        k.k = ElGamal.construct((key["p"], key["g"], key["y"]))
+        data = {"msgs": [k.encrypt(i) for i in (2, 3, 4)]}
+        response = self.client.post("/mixnet/decrypt/1/", data, format="json")
+        self.assertEqual(sorted(response.json()), [2, 3, 4])
+
+
+class TablesCase(TestCase):
+    def setUp(self):
+        clear_tables()
+        k = MixCrypt(bits=settings.KEYBITS)
+        self.key = Key(p=int(k.k.p), g=int(k.k.g), y=int(k.k.y))
+        self.key.save()
+
+    def tearDown(self):
+        clear_tables()
+
+    def test_tables_cached(self):
+        tables = get_tables(self.key)
+        self.assertIs(tables, get_tables(self.key))
+
+        k = ElGamal.construct((self.key.p, self.key.g, self.key.y))
+        self.assertEqual(tables.encrypt(7, 99), tuple(k._encrypt(7, 99)))
+
+    def test_tables_evicted(self):
+        tables = get_tables(self.key)
+        key2 = Key(p=self.key.p, g=self.key.g, y=(self.key.y * self.key.g) % self.key.p)
+        key2.save()
+
+        with self.settings(MIXNET_TABLES_CACHE=tables.nbytes):
+            tables2 = get_tables(key2)
+            self.assertIsNot(tables, get_tables(self.key))
+            self.assertIsNot(tables2, get_tables(key2))
+
+
+class ContextCase(TestCase):
+    def setUp(self):
+        clear_contexts()
+        k = MixCrypt(bits=256, group=(GroupCase.P, GroupCase.G)).k
+        self.key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
+        self.key.save()
+        self.mn = Mixnet(voting_id=1, key=self.key, pubkey=self.key)
+        self.mn.save()
+
+    def tearDown(self):
+        clear_contexts()
+
+    def test_context_cached(self):
+        ctx = get_context(self.mn)
+        self.assertIs(ctx, get_context(Mixnet.objects.get(pk=self.mn.pk)))
+
+        pk = (self.key.p, self.key.g, self.key.y)
+        crypt = self.mn.crypt(pk)
+        self.assertIs(crypt.tables, ctx.get_tables(pk))
+        self.assertEqual(crypt.decrypt(crypt.encrypt(42)), 42)
+        self.assertIsNone(ctx.get_tables((self.key.p, self.key.g, 4)))
+
+    def test_context_tables_not_pinned(self):
+        ctx = get_context(self.mn)
+        pk = (self.key.p, self.key.g, self.key.y)
+        tables = ctx.get_tables(pk)
+        clear_tables()
+        self.assertIsNot(tables, ctx.get_tables(pk))
+
+        with self.settings(MIXNET_TABLES_CACHE=0):
+            clear_tables()
+            self.assertIsNot(ctx.get_tables(pk), ctx.get_tables(pk))
+
+    def test_context_key_changed(self):
+        ctx = get_context(self.mn)
+        self.key.save()
+        self.assertIsNot(ctx, get_context(self.mn))
+
+    @override_settings(MIXNET_CONTEXT_CACHE=1)
+    def test_context_evicted(self):
+        ctx = get_context(self.mn)
+        mn2 = Mixnet(voting_id=2, key=self.key)
+        mn2.save()
+        get_context(mn2)
+        self.assertIsNot(ctx, get_context(self.mn))
+
+
+class PoolCase(MixnetMixin, APITestCase):
+    def test_shuffle_pool(self):
+        self.create()
+        mn = Mixnet.objects.get(voting_id=1, auth_position=0)
+        self.assertEqual(mn.fill_pool(5), 5)
+        self.assertEqual(mn.fill_pool(5), 0)
+
+        clear = [2, 3, 4, 5, 6, 7, 8, 9]
+        pk = self.key["p"], self.key["g"], self.key["y"]
+        encrypt = self.encrypt_msgs(clear, pk)
+        data = {"msgs": encrypt, "pk": self.key}
+
+        response = self.client.post("/mixnet/shuffle/1/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mn.pool.count(), 0)
+
+        data = {"msgs": response.json()}
+        response = self.client.post("/mixnet/decrypt/1/", data, format="json")
+        self.assertEqual(sorted(clear), sorted(response.json()))
+
+    def test_pool_other_key(self):
+        self.create()
+        mn = Mixnet.objects.get(voting_id=1, auth_position=0)
+        mn.fill_pool(3)
+
+        pk = (self.key["p"], self.key["g"], (self.key["y"] * 2) % self.key["p"])
+        self.assertEqual(mn.take_pool(3, pk), [])
+        self.assertEqual(len(mn.take_pool(2, tuple(self.key[i] for i in "pgy"))), 2)
+        self.assertEqual(mn.pool.count(), 1)
+
+    def test_fillpool_command(self):
+        self.create()
+        out = io.StringIO()
+        call_command("fillpool", size=3, voting=[1], stdout=out)
+        self.assertEqual(out.getvalue(), "Voting 1, position 0: 3 factors added\n")
+
+    def test_pool_multiple_auths(self):
+        data = {
+            "voting": 1,
+            "auths": [
+                {"name": "auth1", "url": "http://localhost:8000"},
+                {"name": "auth2", "url": "http://127.0.0.1:8000"},
+            ],
+        }
+        key = self.client.post("/mixnet/", data, format="json").json()
+        pk = key["p"], key["g"], key["y"]
+
+        mixnets = Mixnet.objects.filter(voting_id=1).order_by("auth_position")
+        self.assertEqual(len(mixnets), 2)
+        for mn in mixnets:
+            self.assertEqual((mn.pubkey.p, mn.pubkey.g, mn.pubkey.y), pk)
+            self.assertEqual(mn.fill_pool(3), 3)
+
+        clear = [2, 3, 4, 5, 6, 7, 8, 9]
+        data = {"msgs": self.encrypt_msgs(clear, pk), "pk": key}
+        response = self.client.post("/mixnet/shuffle/1/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        for mn in mixnets:
+            self.assertEqual(mn.pool.count(), 0)
+
+        data = {"msgs": response.json(), "pk": key}
+        response = self.client.post("/mixnet/decrypt/1/", data, format="json")
+        self.assertEqual(sorted(clear), sorted(response.json()))
+
+    @override_settings(MIXNET_POOL_SIZE=4, MIXNET_POOL_WORKERS=0)
+    def test_pool_filled_on_create(self):
+        data = {
+            "voting": 1,
+            "auths": [
+                {"name": "auth1", "url": "http://localhost:8000"},
+                {"name": "auth2", "url": "http://127.0.0.1:8000"},
+            ],
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/mixnet/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        for mn in Mixnet.objects.filter(voting_id=1):
+            self.assertEqual(mn.pool.count(), 4)
+
+    def test_pubkey_chain_only(self):
+        key = self.create()
+        mn = Mixnet.objects.get(voting_id=1, auth_position=0)
+        pk = {"p": key["p"], "g": key["g"], "y": 4}
+
+        for chain_key in (None, "", "x" * 64):
+            data = {"pk": pk, "chain_key": chain_key}
+            response = self.client.post("/mixnet/pubkey/1/", data, format="json")
+            self.assertEqual(response.status_code, 401)
+        mn.refresh_from_db()
+        self.assertEqual(mn.pubkey.y, key["y"])
+
+        data = {"pk": pk, "chain_key": mn.chain_key}
+        response = self.client.post("/mixnet/pubkey/1/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        mn.refresh_from_db()
+        self.assertEqual(mn.pubkey.y, 4)
+
+        staff = User.objects.create(username="staff", is_staff=True)
+        token = Token.objects.create(user=staff)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        data = {"pk": dict(pk, y=key["y"])}
+        response = self.client.post("/mixnet/pubkey/1/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        mn.refresh_from_db()
+        self.assertEqual(mn.pubkey.y, key["y"])
+
+    def test_pubkey_bad_request(self):
+        self.create()
+        chain_key = Mixnet.objects.get(voting_id=1).chain_key
+
+        bad = [None, [1, 2, 3], {"p": 23, "g": 5}, {"p": "x", "g": 5, "y": 4}]
+        bad.append({"p": 23, "g": 5, "y": 4, "curve": "p384"})
+        for pk in bad:
+            data = {"chain_key": chain_key}
+            if pk is not None:
+                data["pk"] = pk
+            response = self.client.post("/mixnet/pubkey/1/", data, format="json")
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(MIXNET_PAGE_SIZE=3)
+class SessionCase(MixnetMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.batch_dir = override_settings(MIXNET_BATCH_DIR=self.tmp.name)
+        self.batch_dir.enable()
+
+    def tearDown(self):
+        self.batch_dir.disable()
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def mix(self, clear, auths):
+        data = {"voting": 1, "auths": auths}
+        response = self.client.post("/mixnet/", data, format="json")
+        key = response.json()
+        pk = key["p"], key["g"], key["y"]
+        encrypt = self.encrypt_msgs(clear, pk)
+
+        shuffled, count = client.stream("shuffle", 1, encrypt, pk=pk)
+        self.assertEqual(count, len(clear))
+        msgs = list(client.pages(shuffled, count))
+        self.assertEqual(len(msgs), len(clear))
+        self.assertNotEqual(msgs, encrypt)
+
+        decrypted, count = client.stream("decrypt", 1, msgs, pk=pk)
+        clear2 = list(client.pages(decrypted, count))
+
+        client.delete(shuffled)
+        client.delete(decrypted)
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+        return clear2
+
+    def test_session(self):
+        clear = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]
+        auths = [{"name": "auth1", "url": "http://localhost:8000"}]
+        clear2 = self.mix(clear, auths)
+        self.assertNotEqual(clear, clear2)
+        self.assertEqual(sorted(clear), sorted(clear2))
+
+    def test_session_multiple_auths(self):
+        clear = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]
+        auths = [
+            {"name": "auth1", "url": "http://localhost:8000"},
+            {"name": "auth2", "url": "http://127.0.0.1:8000"},
+        ]
+        clear2 = self.mix(clear, auths)
+        self.assertEqual(sorted(clear), sorted(clear2))
+
+    def test_session_bad_op(self):
+        self.create()
+        data = {"voting": 1, "op": "tally"}
+        response = self.client.post("/mixnet/session/", data, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+class FileBatchCase(TestCase):
+    def test_shuffle_decrypt(self):
+        k = MixCrypt(bits=256)
+        pk = (int(k.k.p), int(k.k.g), int(k.k.y))
+        width = batch.record_width(k.k.p)
+        clear = list(range(2, 30))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with batch.FileBatch.create(width, dir=tmp) as src:
+                src.extend(k.encrypt(m) for m in clear)
+                with batch.FileBatch.create(width, dir=tmp) as shuffled:
+                    perm = batch.shuffle(k, src, shuffled, pk, page=4)
+                    self.assertEqual(len(shuffled), len(clear))
+                    self.assertEqual(
+                        [k.decrypt(m) for m in shuffled], [clear[i] for i in perm]
+                    )
+
+                    with batch.FileBatch.create(width, 1, dir=tmp) as out:
+                        batch.decrypt(k, shuffled, out, page=5)
+                        self.assertEqual(sorted(out), clear)
+            self.assertEqual(os.listdir(tmp), [])
+
+    def test_shuffle_workers(self):
+        k = MixCrypt(bits=256)
+        pk = (int(k.k.p), int(k.k.g), int(k.k.y))
+        width = batch.record_width(k.k.p)
+        clear = list(range(2, 14))
+
+        with batch.FileBatch.create(width) as src, batch.FileBatch.create(width) as dst:
+            src.extend(k.encrypt(m) for m in clear)
+            with mock.patch.object(k, "worker_pool", wraps=k.worker_pool) as pool:
+                perm = batch.shuffle(k, src, dst, pk, page=4, workers=2)
+            pool.assert_called_once_with(pk, 2)
+            self.assertEqual([k.decrypt(m) for m in dst], [clear[i] for i in perm])
+
+    def test_reopen(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "batch")
+            with batch.FileBatch(path, 2) as b:
+                b.extend([(1, 2), (3, 4)])
+                self.assertEqual(b.read(0, 10), [(1, 2), (3, 4)])
+                b.append((5, 6))
+                self.assertEqual(b[2], (5, 6))
+            with batch.FileBatch(path, 2) as b:
+                self.assertEqual(len(b), 3)
+                self.assertEqual(list(b), [(1, 2), (3, 4), (5, 6)])
+                with self.assertRaises(IndexError):
+                    b[3]
+
+
+class CiphertextBatchCase(TestCase):
+    def test_batch(self):
+        msgs = [[i, i * 1000] for i in range(1, 11)]
+        batch = CiphertextBatch.from_msgs(msgs, width=3)
+        self.assertEqual(batch.tolist(), msgs)
+        self.assertEqual(list(batch), [tuple(m) for m in msgs])
+
+        # slices share the buffers
+        page = batch[2:5]
+        self.assertIs(page.a.obj, batch.a.obj)
+        self.assertEqual(page.tolist(), msgs[2:5])
+        self.assertEqual(page[-1], (5, 5000))
+        self.assertEqual(batch[::3].tolist(), msgs[::3])
+
+        self.assertEqual(page.permute([2, 0, 1]).tolist(), [msgs[4], msgs[2], msgs[3]])
+        self.assertEqual(pickle.loads(pickle.dumps(page)).tolist(), msgs[2:5])
+
+        data = wire.dumps(page, {"voting": 1})
+        self.assertEqual(wire.loads(data), {"voting": 1, "msgs": msgs[2:5]})
+        self.assertEqual(CiphertextBatch.from_wire(data).tolist(), msgs[2:5])
+
+    def test_shuffle_binary(self):
+        self.client = APIClient()
+        mods.mock_query(self.client)
+        data = {"voting": 1, "auths": [{"name": "auth1", "url": settings.BASEURL}]}
+        key = self.client.post("/mixnet/", data, format="json").json()
+        pk = key["p"], key["g"], key["y"]
+
+        clear = list(range(2, 12))
+        msgs = CiphertextBatch.from_msgs(encrypt_msgs(clear, pk))
+        data = {"msgs": msgs, "pk": key}
+        for w in ("json", "binary"):
+            shuffled = mods.post("mixnet", entry_point="/shuffle/1/", json=data, wire=w)
+            self.assertEqual(len(shuffled), len(clear))
+            data2 = {"msgs": shuffled, "pk": key}
+            clear2 = mods.post("mixnet", entry_point="/decrypt/1/", json=data2, wire=w)
+            self.assertEqual(sorted(clear2), clear)
+
+
+class BenchCase(TestCase):
+    def test_bench(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.json")
+            opts = {
+                "bits": [1024],
+                "sizes": [5],
+                "auths": [1, 2],
+                "stdout": io.StringIO(),
+            }
+            call_command("mixnetbench", output=path, **opts)
+            with open(path) as f:
+                results = json.load(f)["results"]
+            self.assertEqual(len(results), 2 * 7)
+
+            call_command("mixnetbench", compare=path, threshold=10, **opts)
+            with self.assertRaises(CommandError):
+                call_command("mixnetbench", compare=path, threshold=-1, **opts)
@@ -6,7 +6,12 @@ router = routers.DefaultRouter()
 router.register(r"", views.MixnetViewSet)
 
 urlpatterns = [
+    path("session/", views.SessionCreate.as_view(), name="session"),
+    path("session/<int:session_id>/", views.SessionView.as_view()),
+    path("session/<int:session_id>/close/", views.SessionClose.as_view()),
     path("", include(router.urls)),
     path("shuffle/<int:voting_id>/", views.Shuffle.as_view(), name="shuffle"),
     path("decrypt/<int:voting_id>/", views.Decrypt.as_view(), name="decrypt"),
+    path("partial/<int:voting_id>/", views.Partial.as_view(), name="partial"),
+    path("pubkey/<int:voting_id>/", views.PubKey.as_view(), name="pubkey"),
 ]
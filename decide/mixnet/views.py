@@ -1,12 +1,24 @@
+import secrets
+
+import django_filters.rest_framework
 from django.conf import settings
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets
+from rest_framework import status, viewsets
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
 from .serializers import MixnetSerializer
-from .models import Auth, Mixnet, Key
+from .eccrypt import CURVES
+from .models import Auth, Mixnet, Key, Session
+from base.perms import UserIsStaff
 from base.serializers import KeySerializer
+from base.wire import CiphertextParser, CiphertextRenderer
+
+
+# views that send or receive ciphertexts also talk the binary base.wire format
+PARSERS = api_settings.DEFAULT_PARSER_CLASSES + [CiphertextParser]
+RENDERERS = api_settings.DEFAULT_RENDERER_CLASSES + [CiphertextRenderer]
 
 
 class MixnetViewSet(viewsets.ModelViewSet):
@@ -16,6 +28,8 @@ class MixnetViewSet(viewsets.ModelViewSet):
 
     queryset = Mixnet.objects.all()
     serializer_class = MixnetSerializer
+    filter_backends = (django_filters.rest_framework.DjangoFilterBackend,)
+    filterset_fields = ("voting_id",)
 
     def create(self, request):
         """
@@ -24,7 +38,9 @@ class MixnetViewSet(viewsets.ModelViewSet):
          * auths: [ {"name": str, "url": str} ]
          * voting: id
          * position: int / nullable
-         * key: { "p": int, "g": int } / nullable
+         * key: { "p": int, "g": int, "curve": str } / nullable
+         * curve: str / nullable, "p256" for EC ElGamal
+         * chain_key: str / nullable, given by the first auth to the rest
         """
 
         auths = request.data.get("auths")
@@ -32,6 +48,12 @@ class MixnetViewSet(viewsets.ModelViewSet):
         key = request.data.get("key", {"p": 0, "g": 0})
         position = request.data.get("position", 0)
         p, g = int(key["p"]), int(key["g"])
+        curve = key.get("curve", request.data.get("curve", ""))
+        if curve and curve not in CURVES:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        chain_key = request.data.get("chain_key") or secrets.token_hex(32)
+        if not isinstance(chain_key, str) or len(chain_key) > 64:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
 
         dbauths = []
         for auth in auths:
@@ -41,37 +63,93 @@ class MixnetViewSet(viewsets.ModelViewSet):
             )
             dbauths.append(a)
 
-        mn = Mixnet(voting_id=voting, auth_position=position)
+        mn = Mixnet(voting_id=voting, auth_position=position, chain_key=chain_key)
         mn.save()
 
         for a in dbauths:
             mn.auths.add(a)
 
-        mn.gen_key(p, g)
+        mn.gen_key(p, g, curve)
 
-        data = {"key": {"p": mn.key.p, "g": mn.key.g}}
+        data = {"key": {"p": mn.key.p, "g": mn.key.g, "curve": curve}}
         # chained call to the next auth to gen the key
         resp = mn.chain_call("/", data)
         if resp:
-            y = (resp["y"] * mn.key.y) % mn.key.p
+            y = mn.crypt().combine_y(resp["y"], mn.key.y)
         else:
             y = mn.key.y
 
-        pubkey = Key(p=mn.key.p, g=mn.key.g, y=y)
+        pubkey = Key(p=mn.key.p, g=mn.key.g, y=y, curve=curve)
         pubkey.save()
         mn.pubkey = pubkey
         mn.save()
 
-        return Response(KeySerializer(pubkey, many=False).data)
+        data = KeySerializer(pubkey, many=False).data
+        if position == 0:
+            mn.fill_pool_later()
+        if resp and position == 0:
+            # the rest of the auths only know the key of the auths after them
+            mn.chain_call("/pubkey/{}/".format(voting), {"pk": dict(data)})
+
+        return Response(data)
+
+
+class ChainView(APIView):
+    """
+    Endpoints that only the other auths of the chain, with the chain_key
+    of the mixnet, or the staff can call
+    """
+
+    def check_chain(self, request, mn):
+        if not mn.is_chain(request.data.get("chain_key")):
+            self.permission_classes = (UserIsStaff,)
+            self.check_permissions(request)
+
+
+class PubKey(ChainView):
+    def post(self, request, voting_id):
+        """
+        Saves the public key of the voting, used for the reencryption pool
+        and the fixed base tables, and sends it to the next auth
+
+        * voting_id: id
+        * pk: { "p": int, "g": int, "y": int, "curve": str }
+        * position: int / nullable
+        * chain_key: str / nullable
+        """
+
+        position = request.data.get("position", 0)
+        mn = get_object_or_404(Mixnet, voting_id=voting_id, auth_position=position)
+        self.check_chain(request, mn)
+
+        pk = request.data.get("pk")
+        try:
+            p, g, y = (int(pk[i]) for i in "pgy")
+            curve = pk.get("curve", "")
+            valid = not curve or curve in CURVES
+        except (AttributeError, KeyError, TypeError, ValueError):
+            valid = False
+        if not valid:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+
+        mn.set_pubkey(p, g, y, curve)
+        pk = {"p": p, "g": g, "y": y, "curve": curve}
+        mn.chain_call("/pubkey/{}/".format(voting_id), {"pk": pk})
+        return Response({})
 
 
 class Shuffle(APIView):
+    parser_classes = PARSERS
+    renderer_classes = RENDERERS
+
     def post(self, request, voting_id):
         """
         * voting_id: id
         * msgs: [ [int, int] ]
         * pk: { "p": int, "g": int, "y": int } / nullable
         * position: int / nullable
+        * chain: bool / nullable, false to return the msgs without sending
+          them to the next auth
         """
 
         position = request.data.get("position", 0)
@@ -84,7 +162,13 @@ class Shuffle(APIView):
         else:
             p, g, y = mn.key.p, mn.key.g, mn.key.y
 
-        msgs = mn.shuffle(msgs, (p, g, y))
+        try:
+            msgs = mn.shuffle(msgs, (p, g, y))
+        except ValueError:
+            # ciphertexts that aren't in the group, like EC points off the curve
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        if not request.data.get("chain", True):
+            return Response(msgs)
 
         data = {
             "msgs": msgs,
@@ -99,12 +183,19 @@ class Shuffle(APIView):
 
 
 class Decrypt(APIView):
+    parser_classes = PARSERS
+    renderer_classes = RENDERERS
+
     def post(self, request, voting_id):
         """
         * voting_id: id
         * msgs: [ [int, int] ]
         * pk: { "p": int, "g": int, "y": int } / nullable
         * position: int / nullable
+        * mode: "chain" | "parallel" / nullable
+        * keep-order: bool / nullable, don't shuffle the msgs while decrypting
+        * chain: bool / nullable, false to return the msgs without sending
+          them to the next auth
         """
 
         position = request.data.get("position", 0)
@@ -117,17 +208,31 @@ class Decrypt(APIView):
         else:
             p, g, y = mn.key.p, mn.key.g, mn.key.y
 
+        mode = request.data.get("mode", settings.MIXNET_DECRYPT_MODE)
+        if mode == "parallel":
+            try:
+                return Response(mn.parallel_decrypt(msgs, (p, g, y)))
+            except ValueError:
+                return Response({}, status=status.HTTP_400_BAD_REQUEST)
+
         next_auths = mn.next_auths()
         last = next_auths.count() == 0
 
         # useful for tests only, to override the last value
         last = request.data.get("force-last", last)
 
-        msgs = mn.decrypt(msgs, (p, g, y), last=last)
+        keep_order = request.data.get("keep-order", False)
+        try:
+            msgs = mn.decrypt(msgs, (p, g, y), last=last, keep_order=keep_order)
+        except ValueError:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        if not request.data.get("chain", True):
+            return Response(msgs)
 
         data = {
             "msgs": msgs,
             "pk": {"p": p, "g": g, "y": y},
+            "keep-order": keep_order,
         }
         # chained call to the next auth to gen the key
         resp = mn.chain_call("/decrypt/{}/".format(voting_id), data)
@@ -135,3 +240,113 @@ class Decrypt(APIView):
             msgs = resp
 
         return Response(msgs)
+
+
+class Partial(ChainView):
+    parser_classes = PARSERS
+    renderer_classes = RENDERERS
+
+    def post(self, request, voting_id):
+        """
+        Decryption shares a^x of this auth, in the same order as the msgs
+
+        * voting_id: id
+        * msgs: [ [int, int] ]
+        * position: int / nullable
+        * chain_key: str / nullable
+        """
+
+        position = request.data.get("position", 0)
+        mn = get_object_or_404(Mixnet, voting_id=voting_id, auth_position=position)
+        self.check_chain(request, mn)
+        try:
+            return Response(mn.partial(request.data.get("msgs", [])))
+        except ValueError:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class SessionCreate(APIView):
+    def post(self, request):
+        """
+        Opens a chunked shuffle or decrypt session, the msgs are uploaded
+        with POST /session/<id>/ and processed with POST /session/<id>/close/
+
+        * voting: id
+        * op: "shuffle" | "decrypt"
+        * pk: { "p": int, "g": int, "y": int } / nullable
+        * position: int / nullable
+        * chain: bool / nullable, false to keep the output in this auth
+        """
+
+        op = request.data.get("op")
+        if op not in ("shuffle", "decrypt"):
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+
+        voting_id = request.data.get("voting")
+        position = request.data.get("position", 0)
+        mn = get_object_or_404(Mixnet, voting_id=voting_id, auth_position=position)
+
+        pk = request.data.get("pk", None)
+        if pk:
+            p, g, y = pk["p"], pk["g"], pk["y"]
+        else:
+            p, g, y = mn.key.p, mn.key.g, mn.key.y
+
+        last = mn.next_auths().count() == 0
+        # useful for tests only, to override the last value
+        last = request.data.get("force-last", last)
+
+        forward = request.data.get("chain", True)
+        session = Session(mixnet=mn, op=op, p=p, g=g, y=y, last=last, forward=forward)
+        session.save()
+        return Response({"session": session.id})
+
+
+class SessionView(APIView):
+    parser_classes = PARSERS
+    renderer_classes = RENDERERS
+
+    def get(self, request, session_id):
+        """
+        Page of the output of a closed session
+
+        * page: int
+        * size: int / nullable
+        """
+
+        session = get_object_or_404(Session, pk=session_id, closed=True)
+        page = int(request.GET.get("page", 0))
+        size = int(request.GET.get("size", settings.MIXNET_PAGE_SIZE))
+        return Response(session.page(page, size))
+
+    def post(self, request, session_id):
+        """
+        Appends a page of msgs to an open session
+
+        * msgs: [ [int, int] ]
+        """
+
+        session = get_object_or_404(Session, pk=session_id, closed=False)
+        session.append(request.data.get("msgs", []))
+        return Response({"count": session.count})
+
+    def delete(self, request, session_id):
+        session = get_object_or_404(Session, pk=session_id)
+        session.delete()
+        return Response({}, status=status.HTTP_204_NO_CONTENT)
+
+
+class SessionClose(APIView):
+    def post(self, request, session_id):
+        """
+        Shuffles/decrypts the session msgs and chains them to the next auth
+        """
+
+        session = get_object_or_404(Session, pk=session_id, closed=False)
+        try:
+            session.process()
+        except ValueError:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        if session.forward:
+            session.chain()
+        return Response({"session": session.id, "count": session.count})
@@ -0,0 +1,159 @@
+"""
+Checks of a vote before it's stored: the voting window, the user of the
+token and the census entry of the voter.
+
+When the voting, census and authentication modules run in this server
+everything is read with a single query (and the options of homomorphic
+votings from voting.cache), otherwise they're asked at the same time
+through base.amods.
+"""
+
+from django.db.models import OuterRef, Subquery
+from django.utils.dateparse import parse_datetime
+
+from base import amods, mods
+
+MODULES = ("voting", "census", "authentication")
+
+
+class Eligibility:
+    """
+    What the store needs to know to accept a vote. voting is None if it
+    doesn't exist and role is None if the voter isn't in the census.
+    """
+
+    def __init__(self, voting=None, user_id=None, role=None):
+        self.voting = voting
+        self.user_id = user_id
+        self.role = role
+
+    @property
+    def pub_key_p(self):
+        return self.voting.get("pub_key_p") if self.voting else None
+
+    @property
+    def pub_key(self):
+        """
+        (p, g, y) of the voting, for the proofs of the homomorphic ballots
+        """
+
+        if not self.voting or not self.voting.get("pub_key_p"):
+            return None
+        return tuple(self.voting["pub_key_" + i] for i in "pgy")
+
+    @property
+    def tally_mode(self):
+        return self.voting.get("tally_mode") if self.voting else None
+
+    @property
+    def options(self):
+        """
+        Option numbers of a homomorphic voting, that get a ballot each
+        """
+
+        return self.voting.get("options") if self.voting else None
+
+
+def option_numbers(voting):
+    """
+    Option numbers of a voting as the voting module returns it, only for
+    the homomorphic votings
+    """
+
+    if voting.get("tally_mode") != "homomorphic":
+        return None
+    return sorted(
+        {
+            option["number"]
+            for question in voting.get("questions") or []
+            for option in question["options"]
+        }
+    )
+
+
+def resolve(voting_id, voter_id, token):
+    if all(mods.is_local(m) for m in MODULES):
+        return resolve_local(voting_id, voter_id, token)
+    return resolve_remote(voting_id, voter_id, token)
+
+
+def resolve_local(voting_id, voter_id, token):
+    from census.models import Census
+    from rest_framework.authtoken.models import Token
+    from voting import cache
+    from voting.models import Voting
+
+    census = Census.objects.filter(voting_id=OuterRef("id"), voter_id=voter_id)
+    tokens = Token.objects.filter(key=token)
+    row = (
+        Voting.objects.filter(id=voting_id)
+        .annotate(
+            role=Subquery(census.values("role")[:1]),
+            user_id=Subquery(tokens.values("user_id")[:1]),
+        )
+        .values(
+            "start_date",
+            "end_date",
+            "voting_type",
+            "tally_mode",
+            "pub_key__p",
+            "pub_key__g",
+            "pub_key__y",
+            "role",
+            "user_id",
+        )
+        .first()
+    )
+    if not row:
+        return Eligibility()
+
+    voting = {
+        "start_date": row["start_date"],
+        "end_date": row["end_date"],
+        "voting_type": row["voting_type"],
+        "tally_mode": row["tally_mode"],
+        "options": None,
+    }
+    for i in "pgy":
+        v = row["pub_key__" + i]
+        voting["pub_key_" + i] = int(v) if v else None
+    if row["tally_mode"] == "homomorphic":
+        voting["options"] = option_numbers(cache.get(voting_id) or {})
+    return Eligibility(voting, row["user_id"], row["role"])
+
+
+def resolve_remote(voting_id, voter_id, token):
+    voting, voter, census = amods.sync_gather(
+        amods.get("voting", params={"id": voting_id}),
+        amods.post("authentication", entry_point="/getuser/", json={"token": token}),
+        amods.get(
+            "census/role/{}".format(voting_id),
+            params={"voter_id": voter_id},
+            response=True,
+        ),
+    )
+    if not voting or not isinstance(voting, list):
+        return Eligibility()
+    voting = voting[0]
+    options = option_numbers(voting)
+    pub_key = voting.get("pub_key") or {}
+    dates = {
+        d: parse_datetime(voting[d]) if voting.get(d) else None
+        for d in ("start_date", "end_date")
+    }
+    voting = dict(
+        dates,
+        voting_type=voting.get("voting_type"),
+        tally_mode=voting.get("tally_mode"),
+        options=options,
+    )
+    for i in "pgy":
+        v = pub_key.get(i)
+        voting["pub_key_" + i] = int(v) if v else None
+
+    user_id = voter.get("id", None)
+
+    role = None
+    if census.status_code == 200:
+        role = census.json()
+    return Eligibility(voting, user_id, role)
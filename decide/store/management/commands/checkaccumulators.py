@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.models import Accumulator, Vote
+from voting.models import Voting
+
+
+class Command(BaseCommand):
+    help = "Check the homomorphic accumulators of the votings against the votes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "voting",
+            type=int,
+            nargs="*",
+            help="Votings to check, all with homomorphic ballots by default",
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Compute again the accumulators that don't match",
+        )
+
+    def handle(self, *args, **options):
+        ids = options["voting"]
+        if not ids:
+            voted = Vote.objects.filter(option__isnull=False).values_list(
+                "voting_id", flat=True
+            )
+            accumulated = Accumulator.objects.values_list("voting_id", flat=True)
+            ids = sorted(set(voted) | set(accumulated))
+
+        wrong = 0
+        for voting_id in ids:
+            voting = Voting.objects.filter(id=voting_id).select_related("pub_key")
+            voting = voting.first()
+            if not voting or not voting.pub_key:
+                raise CommandError("Voting {} has no public key".format(voting_id))
+            p = int(voting.pub_key.p)
+
+            options_wrong = Accumulator.mismatches(voting_id, p)
+            if not options_wrong:
+                self.stdout.write("Voting {}: ok".format(voting_id))
+                continue
+
+            wrong += 1
+            self.stdout.write(
+                "Voting {}: options {} don't match".format(
+                    voting_id, ", ".join(map(str, options_wrong))
+                )
+            )
+            if options["rebuild"]:
+                Accumulator.rebuild(voting_id, p)
+                self.stdout.write("Voting {}: rebuilt".format(voting_id))
+
+        if wrong and not options["rebuild"]:
+            raise CommandError("{} votings with wrong accumulators".format(wrong))
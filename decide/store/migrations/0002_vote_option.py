@@ -0,0 +1,17 @@
+# Generated by Django 4.1 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("store", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="vote",
+            name="option",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.1 on 2026-10-18 11:55
+
+import base.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("store", "0002_vote_option"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Accumulator",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("voting_id", models.PositiveIntegerField()),
+                ("option", models.PositiveIntegerField()),
+                ("a", base.models.BigBigField(default=1)),
+                ("b", base.models.BigBigField(default=1)),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "unique_together": {("voting_id", "option")},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.1 on 2026-10-18 16:02
+
+from django.db import migrations, models
+
+
+def drop_replaced_option_votes(apps, schema_editor):
+    # only the last ballot of each voter and option counted in the tally
+    Vote = apps.get_model("store", "Vote")
+    seen = set()
+    replaced = []
+    votes = Vote.objects.filter(option__isnull=False).order_by("-voted", "-id")
+    for v in votes.only("voting_id", "voter_id", "option"):
+        key = (v.voting_id, v.voter_id, v.option)
+        if key in seen:
+            replaced.append(v.id)
+        seen.add(key)
+    Vote.objects.filter(id__in=replaced).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("store", "0003_accumulator"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_replaced_option_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="vote",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("option__isnull", False)),
+                fields=("voting_id", "voter_id", "option"),
+                name="unique_option_vote",
+            ),
+        ),
+    ]
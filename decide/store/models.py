@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from base.models import BigBigField
 
 
@@ -7,8 +7,110 @@ class Vote(models.Model):
     voter_id = models.PositiveIntegerField()
     a = BigBigField()
     b = BigBigField()
+    # option number of the ciphertext, only in homomorphic tally votings
+    option = models.PositiveIntegerField(blank=True, null=True)
 
     voted = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            # a homomorphic ballot per voter and option, replaced on revotes
+            models.UniqueConstraint(
+                fields=["voting_id", "voter_id", "option"],
+                condition=models.Q(option__isnull=False),
+                name="unique_option_vote",
+            ),
+        ]
+
     def __str__(self):
         return "{}: {}".format(self.voting_id, self.voter_id)
+
+
+class Accumulator(models.Model):
+    """
+    Running product of the homomorphic ballots of an option, updated on
+    every stored vote so the tally only decrypts one ciphertext per option
+    """
+
+    voting_id = models.PositiveIntegerField()
+    option = models.PositiveIntegerField()
+    a = BigBigField(default=1)
+    b = BigBigField(default=1)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (("voting_id", "option"),)
+
+    def __str__(self):
+        return "{}: {} ({})".format(self.voting_id, self.option, self.count)
+
+    @classmethod
+    def add(cls, voting_id, option, p, new, old=None):
+        """
+        Multiplies the ballot new into the accumulator of the option. When
+        it's a revote, old is the replaced ballot and it's divided out.
+        Must be called inside a transaction.
+        """
+
+        acc, _ = cls.objects.select_for_update().get_or_create(
+            voting_id=voting_id, option=option
+        )
+        a, b = int(new[0]), int(new[1])
+        if old:
+            a = a * pow(int(old[0]), -1, p)
+            b = b * pow(int(old[1]), -1, p)
+        else:
+            acc.count += 1
+        acc.a = (int(acc.a) * a) % p
+        acc.b = (int(acc.b) * b) % p
+        acc.save()
+        return acc
+
+    @classmethod
+    def compute(cls, voting_id, p):
+        """
+        Accumulators of a voting computed from the Vote table, with only
+        the last ballot of each voter and option. Not saved.
+        """
+
+        last = {}
+        votes = Vote.objects.filter(voting_id=voting_id, option__isnull=False)
+        for v in votes.order_by("voted", "id").only("voter_id", "option", "a", "b"):
+            last[(v.voter_id, v.option)] = v
+
+        accs = {}
+        for (voter_id, option), v in last.items():
+            acc = accs.setdefault(
+                option, cls(voting_id=voting_id, option=option, a=1, b=1, count=0)
+            )
+            acc.a = (int(acc.a) * int(v.a)) % p
+            acc.b = (int(acc.b) * int(v.b)) % p
+            acc.count += 1
+        return [accs[option] for option in sorted(accs)]
+
+    @classmethod
+    def mismatches(cls, voting_id, p):
+        """
+        Options whose stored accumulator doesn't match the Vote table
+        """
+
+        def values(accs):
+            return {acc.option: (int(acc.a), int(acc.b), acc.count) for acc in accs}
+
+        expected = values(cls.compute(voting_id, p))
+        stored = values(cls.objects.filter(voting_id=voting_id))
+        options = set(expected) | set(stored)
+        return sorted(o for o in options if expected.get(o) != stored.get(o))
+
+    @classmethod
+    def rebuild(cls, voting_id, p):
+        """
+        Replaces the accumulators of a voting with the ones computed from
+        the Vote table
+        """
+
+        accs = cls.compute(voting_id, p)
+        with transaction.atomic():
+            cls.objects.filter(voting_id=voting_id).delete()
+            cls.objects.bulk_create(accs)
+        return accs
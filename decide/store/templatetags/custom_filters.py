@@ -1,10 +1,20 @@
 from django import template
+from django.utils.dateparse import parse_datetime
 
-from voting.models import Voting
+from voting import cache
 
 register = template.Library()
 
 
 @register.filter(name="getVoting")
 def getVoting(vid):
-    return Voting.objects.get(id=vid)
+    """
+    The voting as voting.cache returns it (questions is a list of dicts
+    with desc and options), with the dates parsed
+    """
+
+    voting = cache.get(vid)
+    if voting:
+        for d in ("start_date", "end_date"):
+            voting[d] = parse_datetime(voting[d]) if voting[d] else None
+    return voting
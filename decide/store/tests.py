@@ -1,15 +1,23 @@
 import datetime
+import io
 import random
 import subprocess
 from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.utils import timezone
 from django.test import TestCase
 from django.urls import reverse
 
-from .models import Vote
+from . import eligibility
+from .models import Accumulator, Vote
+from base import mods
+from base.models import Key
 from base.tests import BaseTestCase
 from census.models import Census
-from voting.models import Question
+from mixnet import proofs
+from voting.models import Question, QuestionOption
 from voting.models import Voting
 
 from channels.testing import WebsocketCommunicator
@@ -30,6 +38,13 @@ from django.contrib.staticfiles.testing import StaticLiveServerTestCase
 from selenium.webdriver.support.ui import Select
 
 
+# safe prime group for the homomorphic votings, g is in the subgroup of
+# order (p - 1) / 2
+P = 87097010700619948096711819523123557176799520976132200207307054568374541152947
+G = 57844715533034499366023205962279523701191112523212359296073570949045702808176
+PK = (P, G, pow(G, 1234, P))
+
+
 class StoreTextCase(BaseTestCase):
     def setUp(self):
         super().setUp()
@@ -65,6 +80,31 @@ class StoreTextCase(BaseTestCase):
 
         return voting
 
+    def gen_homomorphic_voting(self, pk, options=2):
+        voting = self.gen_voting(pk, question_desc="homomorphic")
+        question = voting.questions.first()
+        for number in range(1, options + 1):
+            QuestionOption.objects.create(
+                question=question, option="option {}".format(number), number=number
+            )
+        voting.tally_mode = "homomorphic"
+        voting.pub_key = Key.objects.create(p=PK[0], g=PK[1], y=PK[2])
+        voting.save()
+        return voting
+
+    def homomorphic_ballot(self, voting_pk, voter, bits):
+        """
+        Data of a homomorphic vote for the options 1..n, with the proofs
+        """
+
+        context = "{}:{}".format(voting_pk, voter)
+        ciphers, bit_proofs, proof = proofs.encrypt_ballot(PK, bits, context)
+        votes = [
+            {"vote": {"a": a, "b": b}, "option": option, "proof": bit_proof}
+            for option, ((a, b), bit_proof) in enumerate(zip(ciphers, bit_proofs), 1)
+        ]
+        return {"voting": voting_pk, "voter": voter, "votes": votes, "proof": proof}
+
     def get_or_create_user(self, pk):
         user, _ = User.objects.get_or_create(pk=pk)
         user.username = "user{}".format(pk)
@@ -274,6 +314,180 @@ class StoreTextCase(BaseTestCase):
                 vote, Vote.objects.filter(voter_id=user.id).order_by("-voted")[i]
             )
 
+    def test_vote_history_render(self):
+        voting = self.gen_voting(347, question_desc="Favourite colour?")
+        user = self.get_or_create_user(10)
+        Vote.objects.create(voting_id=voting.id, voter_id=user.id, a=1, b=2)
+        self.login(user=user.username)
+
+        response = self.client.get("/store/voteHistory/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "<li>Favourite colour?</li>", html=True)
+        self.assertContains(response, "v1")
+        self.assertContains(response, "The voting has not ended yet", count=0)
+
+    def test_aggregate(self):
+        VOTING_PK = 346
+        p = P
+        self.gen_homomorphic_voting(VOTING_PK)
+
+        ballots = {}
+        for voter, bits in ((10, [1, 0]), (11, [0, 1])):
+            Census.objects.create(voting_id=VOTING_PK, voter_id=voter)
+            user = self.get_or_create_user(voter)
+            self.login(user=user.username)
+            data = self.homomorphic_ballot(VOTING_PK, voter, bits)
+            ballots[voter] = [(v["vote"]["a"], v["vote"]["b"]) for v in data["votes"]]
+            response = self.client.post("/store/", data, format="json")
+            self.assertEqual(response.status_code, 200)
+        (a1, b1), (a2, b2) = ballots[10]
+        (a3, b3), (a4, b4) = ballots[11]
+
+        response = self.client.get("/store/aggregate/{}/".format(VOTING_PK))
+        self.assertEqual(response.status_code, 403)
+
+        self.login()
+        response = self.client.get("/store/aggregate/{}/".format(VOTING_PK))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            [
+                {"option": 1, "a": a1 * a3 % p, "b": b1 * b3 % p, "count": 2},
+                {"option": 2, "a": a2 * a4 % p, "b": b2 * b4 % p, "count": 2},
+            ],
+        )
+
+    def test_eligibility(self):
+        VOTING_PK = 348
+        voting = self.gen_voting(VOTING_PK)
+        voting.pub_key = Key.objects.create(p=167, g=156, y=4)
+        voting.save()
+        Census.objects.create(voting_id=VOTING_PK, voter_id=10, role="2")
+        user = self.get_or_create_user(10)
+        token = Token.objects.create(user=user).key
+
+        with self.assertNumQueries(1):
+            checks = eligibility.resolve_local(VOTING_PK, 10, token)
+        self.assertEqual(checks.user_id, 10)
+        self.assertEqual(checks.role, "2")
+        self.assertEqual(checks.pub_key_p, 167)
+        self.assertEqual(checks.voting["start_date"], voting.start_date)
+
+        remote = eligibility.resolve_remote(VOTING_PK, 10, token)
+        self.assertEqual(remote.voting, checks.voting)
+        self.assertEqual((remote.user_id, remote.role), (10, "2"))
+
+        self.assertIsNone(eligibility.resolve_local(VOTING_PK, 11, token).role)
+        self.assertIsNone(eligibility.resolve_remote(VOTING_PK, 11, token).role)
+        self.assertIsNone(eligibility.resolve_local(VOTING_PK + 1, 10, token).voting)
+        self.assertIsNone(eligibility.resolve_local(VOTING_PK, 10, "bad").user_id)
+
+    def test_eligibility_homomorphic(self):
+        VOTING_PK = 349
+        self.gen_homomorphic_voting(VOTING_PK, options=3)
+        Census.objects.create(voting_id=VOTING_PK, voter_id=10)
+
+        checks = eligibility.resolve_local(VOTING_PK, 10, "")
+        self.assertEqual(checks.tally_mode, "homomorphic")
+        self.assertEqual(checks.options, [1, 2, 3])
+        self.assertEqual(checks.pub_key, PK)
+        remote = eligibility.resolve_remote(VOTING_PK, 10, "")
+        self.assertEqual(remote.voting, checks.voting)
+
+    def test_store_invalid_option_votes(self):
+        VOTING_PK = 350
+        voting = self.gen_homomorphic_voting(VOTING_PK)
+        Census.objects.create(voting_id=VOTING_PK, voter_id=10)
+        user = self.get_or_create_user(10)
+        self.login(user=user.username)
+
+        def store(data):
+            return self.client.post("/store/", data, format="json").status_code
+
+        def ballot(bits=(1, 0), voter=10):
+            data = self.homomorphic_ballot(VOTING_PK, voter, list(bits))
+            data["voter"] = 10
+            return data
+
+        def broken(change):
+            data = ballot()
+            change(data)
+            return data
+
+        g2 = proofs.encrypt(PK, pow(G, 2, P), 5)
+        invalid = [
+            broken(lambda d: d["votes"][0]["vote"].update(a=0)),
+            broken(lambda d: d["votes"][0]["vote"].update(b=P)),
+            broken(lambda d: d["votes"][1]["vote"].update(a="x")),
+            broken(lambda d: d["votes"].pop()),
+            broken(lambda d: d["votes"][1].update(option=1)),
+            broken(lambda d: d["votes"].append(dict(d["votes"][1], option=3))),
+            broken(lambda d: d["votes"][0].update(option=None)),
+            broken(lambda d: d["votes"][0].pop("proof")),
+            broken(lambda d: d.pop("proof")),
+            # g^2 with the proof of g^1
+            broken(lambda d: d["votes"][0]["vote"].update(a=g2[0], b=g2[1])),
+            # every option is g^0 or g^1, but they don't add up to g^1
+            ballot((1, 1)),
+            ballot((0, 0)),
+            # the ballot of another voter
+            ballot(voter=11),
+        ]
+        for data in invalid:
+            self.assertEqual(store(data), 400)
+        self.assertFalse(Vote.objects.filter(voting_id=VOTING_PK).exists())
+        self.assertFalse(Accumulator.objects.filter(voting_id=VOTING_PK).exists())
+
+        self.assertEqual(store(ballot()), 200)
+        self.assertEqual(store(ballot((0, 1))), 200)
+        self.assertEqual(Vote.objects.filter(voting_id=VOTING_PK).count(), 2)
+        self.assertEqual(Accumulator.mismatches(VOTING_PK, P), [])
+
+        voting.tally_mode = "mixnet"
+        voting.save()
+        self.assertEqual(store(ballot()), 400)
+
+    def test_store_vote_remote_census(self):
+        apis = {"census": "http://census.example.com"}
+        with self.settings(APIS=apis):
+            self.assertFalse(mods.is_local("census"))
+            self.assertTrue(mods.is_local("voting"))
+            self.test_store_vote()
+
+    def test_accumulator_revote(self):
+        VOTING_PK = 347
+        p = P
+        self.gen_homomorphic_voting(VOTING_PK, options=1)
+        Census.objects.create(voting_id=VOTING_PK, voter_id=10)
+        Census.objects.create(voting_id=VOTING_PK, voter_id=11)
+
+        def vote(voter):
+            user = self.get_or_create_user(voter)
+            self.login(user=user.username)
+            data = self.homomorphic_ballot(VOTING_PK, voter, [1])
+            response = self.client.post("/store/", data, format="json")
+            self.assertEqual(response.status_code, 200)
+            return data["votes"][0]["vote"]["a"], data["votes"][0]["vote"]["b"]
+
+        vote(10)
+        a2, b2 = vote(11)
+        a3, b3 = vote(10)
+
+        acc = Accumulator.objects.get(voting_id=VOTING_PK, option=1)
+        self.assertEqual((acc.a, acc.b, acc.count), (a3 * a2 % p, b3 * b2 % p, 2))
+        self.assertEqual(Vote.objects.filter(voting_id=VOTING_PK).count(), 2)
+        self.assertEqual(Accumulator.mismatches(VOTING_PK, p), [])
+
+        acc.a = 2
+        acc.save()
+        self.assertEqual(Accumulator.mismatches(VOTING_PK, p), [1])
+        with self.assertRaises(CommandError):
+            call_command("checkaccumulators", VOTING_PK, stdout=io.StringIO())
+
+        call_command("checkaccumulators", VOTING_PK, rebuild=True, stdout=io.StringIO())
+        acc = Accumulator.objects.get(voting_id=VOTING_PK, option=1)
+        self.assertEqual((acc.a, acc.b, acc.count), (a3 * a2 % p, b3 * b2 % p, 2))
+
 
 class RealTimeDataTestCase(TestCase):
     def setUp(self):
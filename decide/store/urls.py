@@ -5,6 +5,7 @@ app_name = "store"
 
 urlpatterns = [
     path("", views.StoreView.as_view(), name="store"),
+    path("aggregate/<int:voting_id>/", views.AggregateView.as_view(), name="aggregate"),
     path("vote/create_backup/", views.create_backup, name="vote_create_backup"),
     path(
         "vote/create_backup/<str:backup_name>/",
@@ -1,13 +1,14 @@
 from django.shortcuts import render
 from django.utils import timezone
-from django.utils.dateparse import parse_datetime
 import django_filters.rest_framework
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework import generics
+from rest_framework.views import APIView
 import os
 from django.shortcuts import render
 from django.conf import settings
+from django.db import transaction
 
 import subprocess
 from django.contrib import messages
@@ -15,10 +16,12 @@ from django.http import HttpResponseBadRequest, HttpResponseRedirect
 from django.urls import reverse
 
 
-from .models import Vote
+from . import eligibility
+from .models import Accumulator, Vote
 from .serializers import VoteSerializer
 from base import mods
 from base.perms import UserIsStaff
+from mixnet import proofs
 from rest_framework.permissions import IsAuthenticated
 
 from channels.layers import get_channel_layer
@@ -40,67 +43,70 @@ class StoreView(generics.ListAPIView):
         """
         * voting: id
         * voter: id
-        * vote: { "a": int, "b": int }
+        * votes: [ { "vote": { "a": int, "b": int }, "option": int / nullable,
+                     "proof": { "c0": int, "c1": int, "s0": int, "s1": int } / nullable } ]
+        * proof: { "c": int, "s": int } / nullable
+
+        In homomorphic votings there's a vote per option, with g^1 or g^0,
+        each with the proof that it's one of them, and the proof that they
+        add up to g^1 (see mixnet.proofs, the context is "<voting>:<voter>").
+        The booth doesn't make these proofs, homomorphic votings are only
+        voted through this API.
         """
         vid = request.data.get("voting")
-        voting = mods.get("voting", params={"id": vid})
+        uid = request.data.get("voter")
+        votes = request.data.get("votes")  # Expect 'votes' to be an array
 
-        vid = request.data.get("voting")
+        # validating voter
+        if request.auth:
+            token = request.auth.key
+        else:
+            token = "NO-AUTH-VOTE"
+        checks = eligibility.resolve(vid, uid, token)
 
-        voting = mods.get("voting", params={"id": vid})
-        if not voting or not isinstance(voting, list):
+        voting = checks.voting
+        if not voting:
             return Response({}, status=status.HTTP_401_UNAUTHORIZED)
-        start_date = voting[0].get("start_date", None)
-        # print ("Start date: "+  start_date)
-        end_date = voting[0].get("end_date", None)
-        # print ("End date: ", end_date)
-        not_started = not start_date or timezone.now() < parse_datetime(start_date)
-        # print (not_started)
-        is_closed = end_date and parse_datetime(end_date) < timezone.now()
+        start_date = voting["start_date"]
+        end_date = voting["end_date"]
+        not_started = not start_date or timezone.now() < start_date
+        is_closed = end_date and end_date < timezone.now()
         if not_started or is_closed:
             return Response({}, status=status.HTTP_401_UNAUTHORIZED)
 
-        uid = request.data.get("voter")
-        votes = request.data.get("votes")  # Expect 'votes' to be an array
-
         if not vid or not uid or not votes:
             return Response({}, status=status.HTTP_400_BAD_REQUEST)
 
-        # validating voter
-        if request.auth:
-            token = request.auth.key
-        else:
-            token = "NO-AUTH-VOTE"
-        voter = mods.post(
-            "authentication", entry_point="/getuser/", json={"token": token}
-        )
-        voter_id = voter.get("id", None)
-        if not voter_id or voter_id != uid:
+        if not checks.user_id or checks.user_id != uid:
             return Response({}, status=status.HTTP_401_UNAUTHORIZED)
 
         # the user is in the census
-        perms = mods.get(
-            "census/{}".format(vid), params={"voter_id": uid}, response=True
-        )
-        if perms.status_code == 401:
+        if checks.role is None:
             return Response({}, status=status.HTTP_401_UNAUTHORIZED)
 
-        for vote in votes:
-            nested_vote = vote.get("vote")
-            if nested_vote:
-                a = nested_vote.get("a")
-                b = nested_vote.get("b")
-                v = Vote(voting_id=vid, voter_id=uid, a=a, b=b)
-                v.save()
+        homomorphic = checks.tally_mode == "homomorphic"
+        if homomorphic or any(vote.get("option") is not None for vote in votes):
+            context = "{}:{}".format(vid, uid)
+            ballots = self.option_ballots(
+                votes, checks, request.data.get("proof"), context
+            )
+            if ballots is None:
+                return Response({}, status=status.HTTP_400_BAD_REQUEST)
+            with transaction.atomic():
+                for option, (a, b) in ballots.items():
+                    self.store_option_vote(vid, uid, option, a, b, checks.pub_key_p)
+        else:
+            for vote in votes:
+                nested_vote = vote.get("vote")
+                if nested_vote:
+                    a = nested_vote.get("a")
+                    b = nested_vote.get("b")
+                    v = Vote(voting_id=vid, voter_id=uid, a=a, b=b)
+                    v.save()
 
         defs = {"a": a, "b": b}
-        if voting[0].get("voting_type", None) == "H":
-            census = mods.get(
-                "census/role/{}".format(vid), params={"voter_id": uid}, response=True
-            )
-            census_content = census.content.decode("utf-8")
-            role = census_content.strip('"')
-            numero = int(role)
+        if voting["voting_type"] == "H":
+            numero = int(checks.role)
             for i in range(1, numero):
                 v, _ = Vote.objects.get_or_create(
                     voting_id=vid, voter_id=uid, value=i, defaults=defs
@@ -121,6 +127,84 @@ class StoreView(generics.ListAPIView):
 
         return Response({})
 
+    def option_ballots(self, votes, checks, proof, context):
+        """
+        The ballots of a homomorphic voting by option, or None if they
+        can't be accumulated: the voting isn't homomorphic, there isn't
+        exactly one ballot per option, a ballot isn't g^0 or g^1 or they
+        don't add up to g^1, according to their proofs
+        """
+
+        pk = checks.pub_key
+        if checks.tally_mode != "homomorphic" or not pk or not checks.options:
+            return None
+
+        ballots = {}
+        for vote in votes:
+            option = vote.get("option")
+            nested_vote = vote.get("vote") or {}
+            try:
+                a, b = int(nested_vote["a"]), int(nested_vote["b"])
+            except (KeyError, TypeError, ValueError):
+                return None
+            if option in ballots:
+                return None
+            if not proofs.verify_bit(pk, (a, b), vote.get("proof"), context):
+                return None
+            ballots[option] = (a, b)
+
+        if set(ballots) != set(checks.options):
+            return None
+        if not proofs.verify_sum(pk, ballots.values(), proof, context):
+            return None
+        return ballots
+
+    def store_option_vote(self, vid, uid, option, a, b, p):
+        """
+        A homomorphic ballot replaces the previous one of the voter for
+        the option, and the accumulator of the option is updated with it
+        """
+
+        with transaction.atomic():
+            v, created = Vote.objects.select_for_update().get_or_create(
+                voting_id=vid, voter_id=uid, option=option, defaults={"a": a, "b": b}
+            )
+            old = None
+            if not created:
+                old = (v.a, v.b)
+                v.a, v.b = a, b
+                v.save()
+            Accumulator.add(vid, option, p, (a, b), old)
+
+
+class AggregateView(APIView):
+    def get(self, request, voting_id):
+        """
+        Product of the ciphertexts of each option, for the homomorphic tally.
+        The accumulators are kept on every vote, with ?rebuild=1 they're
+        computed again from the stored votes first.
+
+        Returns [ { "option": int, "a": int, "b": int, "count": int } ]
+        """
+
+        self.permission_classes = (UserIsStaff,)
+        self.check_permissions(request)
+
+        if request.query_params.get("rebuild"):
+            voting = mods.get("voting", params={"id": voting_id})
+            if not voting or not voting[0].get("pub_key"):
+                return Response({}, status=status.HTTP_404_NOT_FOUND)
+            accs = Accumulator.rebuild(voting_id, int(voting[0]["pub_key"]["p"]))
+        else:
+            accs = Accumulator.objects.filter(voting_id=voting_id).order_by("option")
+
+        return Response(
+            [
+                {"option": acc.option, "a": acc.a, "b": acc.b, "count": acc.count}
+                for acc in accs
+            ]
+        )
+
 
 def create_backup(request, backup_name=None):
     try:
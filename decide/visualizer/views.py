@@ -2,7 +2,7 @@ import json
 from django.views.generic import TemplateView
 from django.http import Http404, HttpResponse
 from io import StringIO
-from base import mods
+from base import amods, mods
 from django.contrib.auth.models import User
 import csv
 import pandas as pd
@@ -30,9 +30,11 @@ def build_census_map(census):
 
 def export_census_xls(request, **kwargs):
     vid = kwargs.get("voting_id", 0)
-    r = mods.get("voting", params={"id": vid})
+    r, c = amods.sync_gather(
+        amods.get("voting", params={"id": vid}),
+        amods.get("census", params={"voting_id": vid}),
+    )
     a = json.loads(json.dumps(r[0]))
-    c = mods.get("census", params={"voting_id": vid})
     file_name = "censo-" + a.get("name") + "-" + str(a.get("end_date"))
     data = build_census_map(c.get("voters"))
 
@@ -49,9 +51,11 @@ def export_census_xls(request, **kwargs):
 
 def download_census_csv(request, **kwargs):
     vid = kwargs.get("voting_id", 0)
-    r = mods.get("voting", params={"id": vid})
+    r, c = amods.sync_gather(
+        amods.get("voting", params={"id": vid}),
+        amods.get("census", params={"voting_id": vid}),
+    )
     a = json.loads(json.dumps(r[0]))
-    c = mods.get("census", params={"voting_id": vid})
     file_name = "censo-" + a.get("name") + "-" + str(a.get("end_date"))
     rows = build_census_map(c.get("voters"))
     csv_data = dict_to_csv(rows, a.get("name"))
@@ -194,8 +198,10 @@ class VisualizerView(TemplateView):
         vid = kwargs.get("voting_id", 0)
 
         try:
-            r = mods.get("voting", params={"id": vid})
-            c = mods.get("census", params={"voting_id": vid})
+            r, c = amods.sync_gather(
+                amods.get("voting", params={"id": vid}),
+                amods.get("census", params={"voting_id": vid}),
+            )
             context["voting"] = json.dumps(r[0])
             context["census"] = json.dumps(c)
         except:
@@ -4,6 +4,8 @@ from django.utils import timezone
 from .models import QuestionOption
 from .models import Question
 from .models import Voting
+from .models import TallyJob
+from . import cache, jobs
 
 from .filters import StartedFilter
 
@@ -23,24 +25,32 @@ def stop(ModelAdmin, request, queryset):
 
 def tally(ModelAdmin, request, queryset):
     for v in queryset.filter(end_date__lt=timezone.now()):
+        if v.tally is not None:
+            continue
         token = request.session.get("auth-token", "")
-        v.tally_votes(token)
+        jobs.submit(v, token)
+
+
+def change_type(queryset, voting_type):
+    # update() doesn't send post_save
+    queryset.update(voting_type=voting_type)
+    cache.forget(*queryset.values_list("id", flat=True))
 
 
 def single_choice(modeladmin, request, queryset):
-    queryset.update(voting_type="S")
+    change_type(queryset, "S")
 
 
 def multiple_choice(modeladmin, request, queryset):
-    queryset.update(voting_type="M")
+    change_type(queryset, "M")
 
 
 def hierarchy(modeladmin, request, queryset):
-    queryset.update(voting_type="H")
+    change_type(queryset, "H")
 
 
 def many_questions(modeladmin, request, queryset):
-    queryset.update(voting_type="Q")
+    change_type(queryset, "Q")
 
 
 class QuestionOptionInline(admin.TabularInline):
@@ -82,3 +92,12 @@ class VotingAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Voting, VotingAdmin)
+
+
+class TallyJobAdmin(admin.ModelAdmin):
+    list_display = ("voting", "status", "phase", "processed", "created", "finished")
+    list_filter = ("status",)
+    readonly_fields = [f.name for f in TallyJob._meta.fields]
+
+
+admin.site.register(TallyJob, TallyJobAdmin)
@@ -0,0 +1,135 @@
+"""
+Read-through cache of the votings as the voting module returns them
+(VotingSerializer), by voting id.
+
+The votings are kept in memory by each process for a few seconds
+(settings.VOTING_CACHE_LOCAL_TTL) and in the Django cache, shared by the
+processes, for settings.VOTING_CACHE_TIMEOUT. Saving a Voting, Question,
+QuestionOption, Key or Auth, or changing the questions or auths of a
+voting, drops the votings it belongs to (see the receivers in
+voting.models).
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache as shared
+from django.db import transaction
+from rest_framework.utils.encoders import JSONEncoder
+
+from base import mods
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+_stats = {"hits": 0, "local_hits": 0, "misses": 0}
+
+
+def cache_key(voting_id):
+    return "voting:{}".format(voting_id)
+
+
+def count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def load(voting_id):
+    from .models import Voting
+    from .serializers import VotingSerializer
+
+    voting = (
+        Voting.objects.filter(id=voting_id)
+        .select_related("pub_key")
+        .prefetch_related("questions__options", "auths")
+        .first()
+    )
+    if not voting:
+        return None
+    return json.dumps(VotingSerializer(voting).data, cls=JSONEncoder)
+
+
+def get(voting_id):
+    """
+    The voting like the voting module returns it, or None if it doesn't
+    exist. Each call returns a new copy.
+    """
+
+    voting_id = int(voting_id)
+    now = time.monotonic()
+    with _lock:
+        item = _cache.get(voting_id)
+        if item and item[0] > now:
+            _cache.move_to_end(voting_id)
+            _stats["hits"] += 1
+            _stats["local_hits"] += 1
+            return json.loads(item[1])
+
+    data = shared.get(cache_key(voting_id))
+    if data is None:
+        count("misses")
+        data = load(voting_id)
+        if data is None:
+            return None
+        shared.set(cache_key(voting_id), data, settings.VOTING_CACHE_TIMEOUT)
+    else:
+        count("hits")
+
+    with _lock:
+        _cache[voting_id] = (now + settings.VOTING_CACHE_LOCAL_TTL, data)
+        _cache.move_to_end(voting_id)
+        while len(_cache) > settings.VOTING_CACHE_LOCAL_SIZE:
+            _cache.popitem(last=False)
+    return json.loads(data)
+
+
+def get_votings(voting_id):
+    """
+    Same result as mods.get("voting", params={"id": voting_id}), read
+    from the cache when the voting module is served by this server
+    """
+
+    if not mods.is_local("voting"):
+        return mods.get("voting", params={"id": voting_id})
+    voting = get(voting_id)
+    return [voting] if voting else []
+
+
+def drop(voting_ids):
+    with _lock:
+        for voting_id in voting_ids:
+            _cache.pop(int(voting_id), None)
+    shared.delete_many([cache_key(voting_id) for voting_id in voting_ids])
+
+
+def forget(*voting_ids):
+    """
+    Drops the votings now and again when the transaction is committed, in
+    case another request cached them meanwhile
+    """
+
+    if not voting_ids:
+        return
+    drop(voting_ids)
+    transaction.on_commit(lambda: drop(voting_ids))
+
+
+def clear():
+    """
+    Empties the memory of this process, the Django cache is kept
+    """
+
+    with _lock:
+        _cache.clear()
+
+
+def stats():
+    """
+    Hits (in this process or in the Django cache) and misses since the
+    process started
+    """
+
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,119 @@
+"""
+Background tallies. The jobs run in a pool of settings.TALLY_WORKERS
+threads of the server process, with the TallyJob rows as the record of
+their state. With TALLY_WORKERS = 0 the tally runs inside the request.
+With TALLY_IN_WORKER they're only queued, and the tallyworker command
+runs them in its own process.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import TallyJob, Voting
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_executor = None
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.TALLY_WORKERS, thread_name_prefix="tally"
+            )
+    return _executor
+
+
+def active(voting):
+    return voting.tally_jobs.filter(
+        status__in=[TallyJob.QUEUED, TallyJob.RUNNING]
+    ).first()
+
+
+def submit(voting, token="", inline=False):
+    """
+    Queues the tally of the voting and returns its TallyJob, or the job
+    already queued or running for it. With inline it runs in this thread.
+    """
+
+    queued = settings.TALLY_IN_WORKER and not inline
+    background = queued or (settings.TALLY_WORKERS and not inline)
+    with transaction.atomic():
+        # the lock on the voting serializes the submits of the same voting
+        Voting.objects.select_for_update().filter(pk=voting.pk).first()
+        job = active(voting)
+        if job:
+            return job
+        job = TallyJob.objects.create(voting=voting)
+        if background and not queued:
+            transaction.on_commit(lambda: get_executor().submit(work, job.id, token))
+
+    if not background:
+        run(job.id, token)
+        job.refresh_from_db()
+    return job
+
+
+def work(job_id, token):
+    try:
+        run(job_id, token)
+    finally:
+        # each worker thread has its own connection
+        connection.close()
+
+
+def run(job_id, token):
+    job = TallyJob.objects.select_related("voting").get(pk=job_id)
+    job.status = TallyJob.RUNNING
+    job.started = timezone.now()
+    job.save(update_fields=["status", "started"])
+
+    try:
+        job.voting.tally_votes(token, job=job)
+    except Exception as e:
+        logger.exception("tally of voting %s failed", job.voting_id)
+        job.status = TallyJob.FAILED
+        job.error = str(e) or e.__class__.__name__
+    else:
+        job.status = TallyJob.DONE
+    job.finished = timezone.now()
+    job.save(update_fields=["status", "error", "finished"])
+
+
+def claim():
+    """
+    Marks the oldest queued job as running and returns its id, or None.
+    The update only matches if the job is still queued, so two workers
+    never take the same job.
+    """
+
+    queue = TallyJob.objects.filter(status=TallyJob.QUEUED)
+    job_id = queue.order_by("id").values_list("id", flat=True).first()
+    if job_id and queue.filter(pk=job_id).update(status=TallyJob.RUNNING):
+        return job_id
+    return None
+
+
+def resume(token="", statuses=(TallyJob.QUEUED, TallyJob.RUNNING)):
+    """
+    Tallies again the votings whose jobs were left queued or running by a
+    stopped server, going on from their checkpoints
+    """
+
+    resumed = []
+    stale = TallyJob.objects.filter(status__in=statuses)
+    for job in stale.select_related("voting"):
+        job.status = TallyJob.FAILED
+        job.error = "Interrupted"
+        job.finished = timezone.now()
+        job.save(update_fields=["status", "error", "finished"])
+        resumed.append(submit(job.voting, token, inline=True))
+    return resumed
@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from voting import jobs
+
+
+def staff_token(username):
+    user = User.objects.filter(username=username, is_staff=True).first()
+    if not user:
+        raise CommandError("{} isn't a staff user".format(username))
+    token, _ = Token.objects.get_or_create(user=user)
+    return token.key
+
+
+class Command(BaseCommand):
+    help = "Resume the tallies interrupted by a stop of the server"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--username",
+            required=True,
+            help="Staff user whose token is used to read the votes from the store",
+        )
+
+    def handle(self, *args, **options):
+        for job in jobs.resume(staff_token(options["username"])):
+            self.stdout.write(
+                "Voting {}: {} {}".format(job.voting_id, job.status, job.error)
+            )
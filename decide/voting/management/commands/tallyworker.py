@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from voting import jobs
+from voting.models import TallyJob
+
+from .resumetallies import staff_token
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the tallies queued with TALLY_IN_WORKER, out of the server. "
+        "The jobs left running by a stopped worker are resumed at start, so "
+        "there should be only one worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--username",
+            required=True,
+            help="Staff user whose token is used to read the votes from the store",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1,
+            help="Seconds between the checks of an empty queue",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when the queue is empty"
+        )
+
+    def report(self, job):
+        self.stdout.write(
+            "Voting {}: {} {}".format(job.voting_id, job.status, job.error)
+        )
+
+    def handle(self, *args, **options):
+        token = staff_token(options["username"])
+        for job in jobs.resume(token, statuses=[TallyJob.RUNNING]):
+            self.report(job)
+
+        while True:
+            close_old_connections()
+            job_id = jobs.claim()
+            if job_id:
+                jobs.run(job_id, token)
+                self.report(TallyJob.objects.get(pk=job_id))
+            elif options["once"]:
+                break
+            else:
+                time.sleep(options["interval"])
@@ -11,6 +11,7 @@ from base.models import Auth
 from census.models import Census
 from mixnet.mixcrypt import MixCrypt
 from mixnet.mixcrypt import ElGamal
+from mixnet.tables import get_tables
 from voting.models import Voting, Question, QuestionOption
 
 
@@ -22,6 +23,7 @@ class Command(BaseCommand):
         p, g, y = (pk.p, pk.g, pk.y)
         k = MixCrypt(bits=bits)
         k.k = ElGamal.construct((p, g, y))
+        k.tables = get_tables(pk)
         return k.encrypt(msg)
 
     def create_voting(self):
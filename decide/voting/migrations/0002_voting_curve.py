@@ -0,0 +1,22 @@
+# Generated by Django 4.1 on 2026-10-18 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("voting", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="voting",
+            name="curve",
+            field=models.CharField(
+                blank=True,
+                choices=[("", "ElGamal"), ("p256", "EC ElGamal P-256")],
+                default="",
+                max_length=16,
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("voting", "0002_voting_curve"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="voting",
+            name="tally_mode",
+            field=models.CharField(
+                choices=[("mixnet", "Mixnet"), ("homomorphic", "Homomorphic")],
+                default="mixnet",
+                max_length=11,
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.1 on 2026-10-18 12:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("voting", "0003_voting_tally_mode"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TallyJob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="queued",
+                        max_length=7,
+                    ),
+                ),
+                ("phase", models.CharField(blank=True, default="", max_length=16)),
+                ("phases", models.JSONField(blank=True, default=dict)),
+                ("processed", models.PositiveIntegerField(default=0)),
+                ("error", models.TextField(blank=True, default="")),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("started", models.DateTimeField(blank=True, null=True)),
+                ("finished", models.DateTimeField(blank=True, null=True)),
+                (
+                    "voting",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tally_jobs",
+                        to="voting.voting",
+                    ),
+                ),
+            ],
+        ),
+    ]
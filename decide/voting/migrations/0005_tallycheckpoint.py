@@ -0,0 +1,42 @@
+# Generated by Django 4.1 on 2026-10-18 12:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("voting", "0004_tallyjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TallyCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("step", models.CharField(max_length=16)),
+                ("start", models.PositiveIntegerField(default=0)),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("data", models.BinaryField()),
+                (
+                    "voting",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tally_checkpoints",
+                        to="voting.voting",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("voting", "step", "start")},
+            },
+        ),
+    ]
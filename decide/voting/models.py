@@ -1,11 +1,18 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.db.models import JSONField
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from base import mods
-from base.models import Auth, Key
+from base import amods, mods, wire
+from base.models import CURVES, Auth, Key
+from mixnet import batch, client
+from mixnet.batch import CiphertextBatch, record_width
+from mixnet.mixcrypt import dlog
+
+from . import cache
 
 
 class Type(models.TextChoices):
@@ -154,6 +161,11 @@ VOTING_TYPES = [
     ("H", "Hierarchy"),
 ]
 
+TALLY_MODES = [
+    ("mixnet", "Mixnet"),
+    ("homomorphic", "Homomorphic"),
+]
+
 
 class Voting(models.Model):
     name = models.CharField(max_length=200)
@@ -169,6 +181,14 @@ class Voting(models.Model):
     pub_key = models.OneToOneField(
         Key, related_name="voting", blank=True, null=True, on_delete=models.SET_NULL
     )
+    # EC votings can't be voted from the booth yet, it only encrypts with
+    # the multiplicative group ElGamal
+    curve = models.CharField(max_length=16, blank=True, default="", choices=CURVES)
+    # homomorphic votings get one ballot per option, g^1 for the chosen one
+    # and g^0 for the rest, and only the product of each option is decrypted.
+    # The ballots need the proofs of mixnet.proofs, that the booth doesn't
+    # make, so they're only voted through the store API
+    tally_mode = models.CharField(max_length=11, choices=TALLY_MODES, default="mixnet")
     auths = models.ManyToManyField(Auth, related_name="votings")
 
     tally = JSONField(blank=True, null=True)
@@ -183,70 +203,49 @@ class Voting(models.Model):
         data = {
             "voting": self.id,
             "auths": [{"name": a.name, "url": a.url} for a in self.auths.all()],
+            "curve": self.curve,
         }
-        key = mods.post("mixnet", baseurl=auth.url, json=data)
-        pk = Key(p=key["p"], g=key["g"], y=key["y"])
+        key = mods.post("mixnet", baseurl=auth.url, json=data, timeout=client.timeout())
+        pk = Key(p=key["p"], g=key["g"], y=key["y"], curve=key.get("curve", ""))
         pk.save()
         self.pub_key = pk
         self.save()
 
     def get_votes(self, token=""):
-        # gettings votes from store
+        """
+        Anonymous votes of the store as a CiphertextBatch
+        """
+
         votes = mods.get(
             "store", params={"voting_id": self.id}, HTTP_AUTHORIZATION="Token " + token
         )
-        # anon votes
-        votes_format = []
-        vote_list = []
-        for vote in votes:
-            for info in vote:
-                if info == "a":
-                    votes_format.append(vote[info])
-                if info == "b":
-                    votes_format.append(vote[info])
-            vote_list.append(votes_format)
-            votes_format = []
-        return vote_list
-
-    def tally_votes(self, token=""):
+        width = record_width(self.pub_key.p) if self.pub_key else None
+        return CiphertextBatch.from_msgs(
+            [(vote["a"], vote["b"]) for vote in votes], width
+        )
+
+    def tally_votes(self, token="", job=None):
         """
-        The tally is a shuffle and then a decrypt
+        The tally is a shuffle and then a decrypt. When it runs as a
+        TallyJob, the job records each phase.
         """
 
-        votes = self.get_votes(token)
-        auth = self.auths.first()
-        shuffle_url = "/shuffle/{}/".format(self.id)
-        decrypt_url = "/decrypt/{}/".format(self.id)
-        auths = [{"name": a.name, "url": a.url} for a in self.auths.all()]
-
-        # first, we do the shuffle
-        data = {"msgs": votes}
-        response = mods.post(
-            "mixnet",
-            entry_point=shuffle_url,
-            baseurl=auth.url,
-            json=data,
-            response=True,
-        )
-        if response.status_code != 200:
-            # TODO: manage error
-            pass
-
-        # then, we can decrypt that
-        data = {"msgs": response.json()}
-        response = mods.post(
-            "mixnet",
-            entry_point=decrypt_url,
-            baseurl=auth.url,
-            json=data,
-            response=True,
-        )
+        if self.tally_mode == "homomorphic":
+            with TallyPhase(job, "decrypt") as phase:
+                self.tally = self.tally_homomorphic(token)
+                phase.processed = len(self.tally)
+            self.save()
+            with TallyPhase(job, "postproc"):
+                self.do_postproc()
+            return
 
-        if response.status_code != 200:
-            # TODO: manage error
-            pass
+        if self.tally is not None and self.postproc is None:
+            # interrupted after saving the tally
+            with TallyPhase(job, "postproc"):
+                self.do_postproc()
+            return
 
-        self.tally = response.json()
+        self.tally = self.tally_mixnet(token, job)
 
         if self.voting_type == "M":
             t = self.tally.copy()
@@ -266,8 +265,176 @@ class Voting(models.Model):
                     aux.append([*str(j)])
             self.tally = aux
         self.save()
+        self.tally_checkpoints.all().delete()
+
+        with TallyPhase(job, "postproc"):
+            self.do_postproc()
+
+    def tally_mixnet(self, token="", job=None):
+        """
+        Shuffle in every auth and then decrypt in every auth, one auth at a
+        time. The output of each step, and of each page of the decrypts, is
+        saved as a TallyCheckpoint, so an interrupted tally goes on from the
+        last one saved without repeating it.
+        """
+
+        msgs = TallyCheckpoint.load(self, "votes")
+        if msgs is None:
+            with TallyPhase(job, "votes") as phase:
+                msgs = self.get_votes(token)
+                TallyCheckpoint.store(self, "votes", 0, msgs)
+                phase.processed = len(msgs)
+
+        if not len(msgs) and self.auths.exists():
+            # nothing to shuffle, the mixnets aren't asked
+            return []
+
+        urls = self.mixnet_urls()
+        for position, url in enumerate(urls):
+            msgs = self.tally_step("shuffle", position, url, msgs, job)
+
+        if settings.MIXNET_DECRYPT_MODE == "parallel":
+            extra = {"mode": "parallel"}
+            return self.tally_step("decrypt", 0, urls[0], msgs, job, **extra)
+
+        for position, url in enumerate(urls):
+            extra = {"force-last": position == len(urls) - 1}
+            msgs = self.tally_step("decrypt", position, url, msgs, job, **extra)
+        return msgs
+
+    def mixnet_urls(self):
+        """
+        Urls of the auths in the order of their positions in the mixnet,
+        as the mixnet of each auth reports them. The positions are given
+        by the mixnets when the key is created, not by the auths of the
+        voting.
+        """
+
+        auths = self.auths.count()
+        if not auths:
+            raise Exception("Voting without auths")
+
+        urls = sorted({auth.url for auth in self.auths.all()})
+        mixnets = amods.sync_gather(
+            *(
+                amods.get("mixnet", baseurl=url, params={"voting_id": self.id})
+                for url in urls
+            )
+        )
+        positions = {}
+        for url, mns in zip(urls, mixnets):
+            for mn in mns:
+                positions[mn["auth_position"]] = url
+        if sorted(positions) != list(range(auths)):
+            raise Exception("The mixnet positions don't match the auths")
+        return [positions[position] for position in range(auths)]
+
+    def tally_step(self, op, position, baseurl, msgs, job=None, **extra):
+        """
+        Shuffle or decrypt of msgs in the auth of position, resumed from its
+        checkpoints. The decrypts go in pages of settings.MIXNET_PAGE_SIZE.
+        """
+
+        step = "{}-{}".format(op, position)
+        done = TallyCheckpoint.load(self, step)
+        if done is not None and len(done) == len(msgs):
+            return done
+
+        with TallyPhase(job, step, total=len(msgs)) as phase:
+            if op == "shuffle":
+                done = self.mixnet_call(op, position, baseurl, msgs, **extra)
+                TallyCheckpoint.store(self, step, 0, done)
+            else:
+                parts = [done] if done else []
+                size = settings.MIXNET_PAGE_SIZE
+                for start in range(len(done or []), len(msgs), size):
+                    page = msgs[start : start + size]
+                    out = self.mixnet_call(op, position, baseurl, page, **extra)
+                    TallyCheckpoint.store(self, step, start, out)
+                    parts.append(out)
+                done = batch.join(parts)
+            phase.processed = len(done)
+        return done
+
+    def mixnet_call(self, op, position, baseurl, msgs, **extra):
+        """
+        Shuffle or decrypt in a single auth, without chaining the output to
+        the next one. Batches bigger than a page go through a session.
+        Returns a CiphertextBatch, or the list of ints of the last decrypt.
+        """
+
+        pk = (self.pub_key.p, self.pub_key.g, self.pub_key.y)
+        width = record_width(pk[0])
+        if len(msgs) > settings.MIXNET_PAGE_SIZE:
+            session, count = client.stream(
+                op,
+                self.id,
+                msgs,
+                baseurl=baseurl,
+                position=position,
+                pk=pk,
+                chain=False,
+                **extra,
+            )
+            out = client.output(session, count, baseurl=baseurl, width=width)
+            client.delete(session, baseurl=baseurl)
+            return out
+
+        data = {
+            "msgs": msgs,
+            "pk": {"p": pk[0], "g": pk[1], "y": pk[2]},
+            "position": position,
+            "chain": False,
+        }
+        data.update(extra)
+        response = mods.post(
+            "mixnet",
+            entry_point="/{}/{}/".format(op, self.id),
+            baseurl=baseurl,
+            json=data,
+            response=True,
+            wire=settings.MIXNET_WIRE_FORMAT,
+            timeout=client.timeout(),
+        )
+        return client.decode(response, width)
+
+    def tally_homomorphic(self, token=""):
+        """
+        Decrypts the product of the ballots of each option, g^count, and
+        recovers the count with a discrete log. The tally is the option
+        number repeated count times, like the decrypted mixnet votes
+        """
+
+        aggregates = mods.get(
+            "store",
+            entry_point="/aggregate/{}/".format(self.id),
+            HTTP_AUTHORIZATION="Token " + token,
+        )
+        if not aggregates:
+            return []
 
-        self.do_postproc()
+        data = {
+            "msgs": [[agg["a"], agg["b"]] for agg in aggregates],
+            "keep-order": True,
+        }
+        response = mods.post(
+            "mixnet",
+            entry_point="/decrypt/{}/".format(self.id),
+            baseurl=self.mixnet_urls()[0],
+            json=data,
+            response=True,
+            wire=settings.MIXNET_WIRE_FORMAT,
+            timeout=client.timeout(),
+        )
+
+        p, g = int(self.pub_key.p), int(self.pub_key.g)
+        tally = []
+        for agg, clear in zip(aggregates, mods.decode(response)):
+            count = dlog(g, clear, p, agg["count"])
+            if count is None:
+                raise Exception("Non valid tally count")
+            tally += [agg["option"]] * count
+        return tally
 
     def do_postproc(self):
         tally = self.tally
@@ -307,4 +474,156 @@ class Voting(models.Model):
             raise ValidationError(
                 "Las técnicas de postprocesado no se pueden aplicar a votaciones no Simples"
             )
+        if self.tally_mode == "homomorphic" and (self.voting_type != "S" or self.curve):
+            raise ValidationError(
+                "El recuento homomórfico solo se puede aplicar a votaciones Simples sin curva elíptica"
+            )
         super().save(*args, **kwargs)
+
+
+@receiver([post_save, post_delete], sender=Voting)
+def voting_changed(sender, instance, **kwargs):
+    cache.forget(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Question)
+@receiver([post_save, post_delete], sender=QuestionOption)
+@receiver([post_save, post_delete], sender=Key)
+@receiver([post_save, post_delete], sender=Auth)
+def voting_part_changed(sender, instance, **kwargs):
+    if sender is Question:
+        votings = Voting.objects.filter(questions=instance)
+    elif sender is QuestionOption:
+        votings = Voting.objects.filter(questions=instance.question_id)
+    elif sender is Key:
+        votings = Voting.objects.filter(pub_key=instance.id)
+    else:
+        votings = Voting.objects.filter(auths=instance)
+    cache.forget(*votings.values_list("id", flat=True))
+
+
+@receiver(m2m_changed, sender=Voting.questions.through)
+@receiver(m2m_changed, sender=Voting.auths.through)
+def voting_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_") and action != "pre_clear":
+        return
+    if not reverse:
+        cache.forget(instance.id)
+    elif action == "pre_clear":
+        cache.forget(*instance.votings.values_list("id", flat=True))
+    else:
+        cache.forget(*(pk_set or ()))
+
+
+class TallyPhase:
+    """
+    Phase of a TallyJob, set processed to the number of votes or
+    ciphertexts handled before it ends
+    """
+
+    def __init__(self, job, name, total=None):
+        self.job = job
+        self.name = name
+        self.total = total
+        self.processed = 0
+
+    def __enter__(self):
+        if self.job:
+            self.job.phase = self.name
+            self.job.phases[self.name] = {
+                "started": timezone.now().isoformat(),
+                "total": self.total,
+            }
+            self.job.save(update_fields=["phase", "phases"])
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.job and not exc_type:
+            self.job.phases[self.name].update(
+                finished=timezone.now().isoformat(), processed=self.processed
+            )
+            self.job.processed = self.processed
+            self.job.save(update_fields=["phases", "processed"])
+
+
+class TallyCheckpoint(models.Model):
+    """
+    Saved output of a step of a mixnet tally ("votes", "shuffle-<position>"
+    or "decrypt-<position>"), from the msg number start on
+    """
+
+    voting = models.ForeignKey(
+        Voting, related_name="tally_checkpoints", on_delete=models.CASCADE
+    )
+    step = models.CharField(max_length=16)
+    start = models.PositiveIntegerField(default=0)
+    count = models.PositiveIntegerField(default=0)
+    # msgs in the base.wire format
+    data = models.BinaryField()
+
+    class Meta:
+        unique_together = (("voting", "step", "start"),)
+
+    @classmethod
+    def load(cls, voting, step):
+        """
+        Msgs saved for the step, None if there's nothing saved. Ciphertexts
+        are loaded in a CiphertextBatch.
+        """
+
+        rows = list(cls.objects.filter(voting=voting, step=step).order_by("start"))
+        if not rows:
+            return None
+        return batch.join(batch.decode(bytes(row.data)) for row in rows)
+
+    @classmethod
+    def store(cls, voting, step, start, msgs):
+        """
+        Saves msgs from the msg number start on, in a row per page of
+        settings.MIXNET_PAGE_SIZE msgs
+        """
+
+        size = settings.MIXNET_PAGE_SIZE
+        with transaction.atomic():
+            for offset in range(0, max(len(msgs), 1), size):
+                page = msgs[offset : offset + size]
+                cls.objects.update_or_create(
+                    voting=voting,
+                    step=step,
+                    start=start + offset,
+                    defaults={"count": len(page), "data": wire.dumps(page)},
+                )
+
+
+class TallyJob(models.Model):
+    """
+    Tally of a voting run by the background workers of voting.jobs
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    voting = models.ForeignKey(
+        Voting, related_name="tally_jobs", on_delete=models.CASCADE
+    )
+    status = models.CharField(max_length=7, choices=STATUSES, default=QUEUED)
+    # current phase, and the start/end time and counts of each phase
+    phase = models.CharField(max_length=16, blank=True, default="")
+    phases = JSONField(default=dict, blank=True)
+    processed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return "{} ({})".format(self.voting, self.status)
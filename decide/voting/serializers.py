@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import Question, QuestionOption, Voting
+from .models import Question, QuestionOption, TallyJob, Voting
 from base.serializers import KeySerializer, AuthSerializer
 
 
@@ -34,6 +34,7 @@ class VotingSerializer(serializers.HyperlinkedModelSerializer):
             "start_date",
             "end_date",
             "pub_key",
+            "tally_mode",
             "auths",
             "tally",
             "postproc",
@@ -46,3 +47,20 @@ class SimpleVotingSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Voting
         fields = ("name", "desc", "voting_type", "question", "start_date", "end_date")
+
+
+class TallyJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TallyJob
+        fields = (
+            "id",
+            "voting",
+            "status",
+            "phase",
+            "phases",
+            "processed",
+            "error",
+            "created",
+            "started",
+            "finished",
+        )
@@ -1,38 +1,43 @@
 import random
+import time
+from unittest import mock
 import itertools
+from io import StringIO
 from django.utils import timezone
 from django.conf import settings
+from django.core.management import call_command
+from django.core.cache import cache as django_cache
 from django.contrib.auth.models import User
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITransactionTestCase
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 
 
 from base import mods
+from base.models import Key
 from base.tests import BaseTestCase
 from census.models import Census
+from mixnet import proofs
+from mixnet.batch import CiphertextBatch
+from mixnet.eccrypt import ECMixCrypt
 from mixnet.mixcrypt import ElGamal
 from mixnet.mixcrypt import MixCrypt
 from mixnet.models import Auth
-from voting.models import Voting, Question, QuestionOption
+from mixnet.tests import MixnetMixin
+from store.models import Vote
+from voting import cache, jobs
+from voting.models import TallyCheckpoint, TallyJob, Voting, Question, QuestionOption
 from django.core.exceptions import ValidationError
 
 
-class VotingTestCase(BaseTestCase):
-    def setUp(self):
-        super().setUp()
-
-    def tearDown(self):
-        super().tearDown()
-
-    def encrypt_msg(self, msg, v, bits=settings.KEYBITS):
-        pk = v.pub_key
-        p, g, y = (pk.p, pk.g, pk.y)
-        k = MixCrypt(bits=bits)
-        k.k = ElGamal.construct((p, g, y))
-        return k.encrypt(msg)
+class VotingMixin:
+    """
+    Voting with a question of 5 options and the auth of this server
+    """
 
     def create_voting(self):
         q = Question(desc="test question")
@@ -55,6 +60,25 @@ class VotingTestCase(BaseTestCase):
 
         return v
 
+
+class VotingTestCase(VotingMixin, BaseTestCase):
+    def setUp(self):
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+
+    def encrypt_msg(self, msg, v, bits=settings.KEYBITS):
+        pk = v.pub_key
+        p, g, y = (pk.p, pk.g, pk.y)
+        if pk.curve:
+            k = ECMixCrypt(curve=pk.curve)
+            k.setk(p, g, y, 0)
+            return k.encrypt(msg)
+        k = MixCrypt(bits=bits)
+        k.k = ElGamal.construct((p, g, y))
+        return k.encrypt(msg)
+
     def create_voters(self, v):
         for i in range(100):
             u, _ = User.objects.get_or_create(username="testvoter{}".format(i))
@@ -121,6 +145,149 @@ class VotingTestCase(BaseTestCase):
         for q in v.postproc:
             self.assertEqual(tally.get(q["number"], 0), q["votes"])
 
+    def test_ec_voting(self):
+        v = self.create_voting()
+        v.curve = "p256"
+        v.save()
+        self.create_voters(v)
+
+        v.create_pubkey()
+        self.assertEqual(v.pub_key.curve, "p256")
+        v.start_date = timezone.now()
+        v.save()
+
+        clear = self.store_votes(v)
+        self.login()  # set token
+        v.tally_votes(self.token)
+
+        for q in v.postproc:
+            self.assertEqual(clear[q["number"]], q["votes"])
+
+    def homomorphic_ballot(self, v, voter_id, bits):
+        pk = (int(v.pub_key.p), int(v.pub_key.g), int(v.pub_key.y))
+        context = "{}:{}".format(v.id, voter_id)
+        ciphers, bit_proofs, proof = proofs.encrypt_ballot(pk, bits, context)
+        options = [opt.number for opt in v.questions.first().options.all()]
+        votes = [
+            {"vote": {"a": a, "b": b}, "option": n, "proof": pr}
+            for n, (a, b), pr in zip(options, ciphers, bit_proofs)
+        ]
+        return {"voting": v.id, "voter": voter_id, "votes": votes, "proof": proof}
+
+    def test_homomorphic_voting(self):
+        v = self.create_voting()
+        v.tally_mode = "homomorphic"
+        v.save()
+        self.create_voters(v)
+
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+
+        options = [opt.number for opt in v.questions.first().options.all()]
+        clear = {n: 0 for n in options}
+        for voter in Census.objects.filter(voting_id=v.id)[:8]:
+            choice = random.choice(options)
+            clear[choice] += 1
+            bits = [int(n == choice) for n in options]
+            user = self.get_or_create_user(voter.voter_id)
+            self.login(user=user.username)
+            data = self.homomorphic_ballot(v, voter.voter_id, bits)
+            response = self.client.post("/store/", data, format="json")
+            self.assertEqual(response.status_code, 200)
+
+        self.login()  # set token
+        v.tally_votes(self.token)
+
+        for q in v.postproc:
+            self.assertEqual(clear[q["number"]], q["votes"])
+
+    def test_homomorphic_invalid_ballot(self):
+        v = self.create_voting()
+        v.tally_mode = "homomorphic"
+        v.save()
+        self.create_voters(v)
+
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+
+        p = int(v.pub_key.p)
+        options = [opt.number for opt in v.questions.first().options.all()]
+        bits = [int(n == options[0]) for n in options]
+        voters = list(Census.objects.filter(voting_id=v.id)[:2])
+        for voter in voters:
+            user = self.get_or_create_user(voter.voter_id)
+            self.login(user=user.username)
+            self.assertEqual(
+                self.client.post(
+                    "/store/",
+                    self.homomorphic_ballot(v, voter.voter_id, bits),
+                    format="json",
+                ).status_code,
+                200,
+            )
+
+        # a zero component would make the product of the option 0, and p
+        # is 0 mod p too
+        for invalid in [(0, 1), (1, p)]:
+            data = self.homomorphic_ballot(v, voters[1].voter_id, bits)
+            data["votes"][-1]["vote"] = dict(zip("ab", invalid))
+            response = self.client.post("/store/", data, format="json")
+            self.assertEqual(response.status_code, 400)
+
+        # two options for the same voter
+        data = self.homomorphic_ballot(v, voters[1].voter_id, [1] * len(options))
+        response = self.client.post("/store/", data, format="json")
+        self.assertEqual(response.status_code, 400)
+
+        self.login()  # set token
+        v.tally_votes(self.token)
+
+        for q in v.postproc:
+            self.assertEqual(q["votes"], 2 if q["number"] == options[0] else 0)
+
+    def test_mixnet_urls(self):
+        v = self.create_voting()
+        a = Auth.objects.create(name="a", url="http://a.example.com")
+        b = Auth.objects.create(name="b", url="http://b.example.com")
+        v.auths.set([a, b])
+
+        # the mixnets put b first, whatever the order of the auths
+        mixnets = {
+            a.url: [{"voting_id": v.id, "auth_position": 1}],
+            b.url: [{"voting_id": v.id, "auth_position": 0}],
+        }
+
+        async def get(modname, baseurl=None, params=None):
+            self.assertEqual(params, {"voting_id": v.id})
+            return mixnets[baseurl]
+
+        with mock.patch("base.amods.get", get):
+            self.assertEqual(v.mixnet_urls(), [b.url, a.url])
+            mixnets[a.url] = []
+            with self.assertRaises(Exception):
+                v.mixnet_urls()
+
+    def test_homomorphic_only_single_choice(self):
+        v = Voting(name="test voting", voting_type="M", tally_mode="homomorphic")
+        with self.assertRaises(ValidationError):
+            v.save()
+
+        self.login()
+        data = {
+            "voting_type": "M",
+            "name": "Example",
+            "desc": "Description example",
+            "questions": ["I want a "],
+            "seats": 8,
+            "questions_opt": [["cat", "dog", "horse"]],
+            "postproc_type": "NON",
+            "tally_mode": "homomorphic",
+        }
+        response = self.client.post("/voting/", data, format="json")
+        self.assertEqual(response.status_code, 400)
+
     def test_create_voting_from_api(self):
         data = {"name": "Example"}
         response = self.client.post("/voting/", data, format="json")
@@ -149,6 +316,7 @@ class VotingTestCase(BaseTestCase):
         response = self.client.post("/voting/", data, format="json")
         self.assertEqual(response.status_code, 201)
 
+    @override_settings(TALLY_WORKERS=0)
     def test_update_voting(self):
         voting = self.create_voting()
 
@@ -220,8 +388,12 @@ class VotingTestCase(BaseTestCase):
         data = {"action": "tally"}
         response = self.client.put("/voting/{}/".format(voting.pk), data, format="json")
 
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        response = self.client.get("/voting/tally/{}/".format(job["id"]))
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.json(), "Voting tallied")
+        self.assertEqual(response.json()["status"], "done")
+        self.assertEqual(response.json()["phase"], "postproc")
 
         # STATUS VOTING: tallied
         data = {"action": "start"}
@@ -266,6 +438,178 @@ class VotingTestCase(BaseTestCase):
         self.assertEqual(response.status_code, 201)
 
 
+@override_settings(MIXNET_POOL_SIZE=0)
+class TallyJobCase(MixnetMixin, VotingMixin, APITransactionTestCase):
+    """
+    Transaction test case, the tally runs in a worker thread that should
+    see the voting and the votes. The pool isn't filled in the background.
+    """
+
+    def setUp(self):
+        super().setUp()
+        admin = User.objects.create(username="admin", is_staff=True)
+        self.token = Token.objects.create(user=admin).key
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token)
+
+    def wait(self, job):
+        for i in range(600):
+            job.refresh_from_db()
+            if job.status in (TallyJob.DONE, TallyJob.FAILED):
+                return job
+            time.sleep(0.1)
+        self.fail("tally job not finished")
+
+    def store_votes(self, v, clear):
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.end_date = timezone.now()
+        v.save()
+
+        k = MixCrypt(bits=settings.KEYBITS)
+        k.k = ElGamal.construct((v.pub_key.p, v.pub_key.g, v.pub_key.y))
+        for voter, m in enumerate(clear):
+            a, b = k.encrypt(m)
+            Vote.objects.create(voting_id=v.id, voter_id=voter + 1, a=a, b=b)
+
+    @override_settings(TALLY_WORKERS=1)
+    def test_background_tally(self):
+        v = self.create_voting()
+        clear = [2, 3, 3, 4, 4, 4]
+        self.store_votes(v, clear)
+
+        job = self.wait(jobs.submit(v, self.token))
+        self.assertEqual(job.status, TallyJob.DONE, job.error)
+        self.assertEqual(
+            list(job.phases), ["votes", "shuffle-0", "decrypt-0", "postproc"]
+        )
+        self.assertEqual(job.phases["votes"]["processed"], len(clear))
+        self.assertTrue(job.started <= job.finished)
+
+        v.refresh_from_db()
+        self.assertEqual(sorted(v.tally), clear)
+
+    @override_settings(TALLY_IN_WORKER=True)
+    def test_tally_worker(self):
+        v = self.create_voting()
+        clear = [2, 3, 3, 4]
+        self.store_votes(v, clear)
+        # left running by a stopped worker
+        stale = TallyJob.objects.create(voting=v, status=TallyJob.RUNNING)
+
+        other = self.create_voting()
+        self.store_votes(other, [2, 4])
+        job = jobs.submit(other, self.token)
+        self.assertEqual(job.status, TallyJob.QUEUED)
+
+        out = StringIO()
+        call_command("tallyworker", username="admin", once=True, stdout=out)
+        stale.refresh_from_db()
+        self.assertEqual(stale.error, "Interrupted")
+        job.refresh_from_db()
+        self.assertEqual(job.status, TallyJob.DONE, job.error)
+        self.assertIsNone(jobs.claim())
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+        for voting, votes in [(v, clear), (other, [2, 4])]:
+            voting.refresh_from_db()
+            self.assertEqual(sorted(voting.tally), votes)
+
+    @override_settings(TALLY_WORKERS=0, MIXNET_PAGE_SIZE=2)
+    def test_resume_tally(self):
+        v = self.create_voting()
+        clear = [2, 2, 3, 3, 3, 4, 4]
+        self.store_votes(v, clear)
+
+        calls = []
+        mixnet_call = Voting.mixnet_call
+
+        def interrupted(voting, op, *args, **kwargs):
+            calls.append(op)
+            # the second page of the decrypt fails
+            if calls.count("decrypt") == 2:
+                raise Exception("Interrupted")
+            return mixnet_call(voting, op, *args, **kwargs)
+
+        with mock.patch.object(Voting, "mixnet_call", interrupted):
+            job = jobs.submit(v, self.token)
+        self.assertEqual(job.status, TallyJob.FAILED)
+        steps = TallyCheckpoint.objects.filter(voting=v)
+        # a row per page
+        self.assertEqual(
+            sorted(steps.values_list("step", "start")),
+            [("decrypt-0", 0)]
+            + [("shuffle-0", start) for start in (0, 2, 4, 6)]
+            + [("votes", start) for start in (0, 2, 4, 6)],
+        )
+        self.assertEqual(max(steps.values_list("count", flat=True)), 2)
+        shuffled = TallyCheckpoint.load(v, "shuffle-0")
+        self.assertIsInstance(shuffled, CiphertextBatch)
+
+        # the tally goes on from the second page of the decrypt
+        job.status = TallyJob.RUNNING
+        job.save()
+        jobs.resume(self.token)
+        job.refresh_from_db()
+        self.assertEqual(job.error, "Interrupted")
+
+        job = v.tally_jobs.latest("id")
+        self.assertEqual(job.status, TallyJob.DONE, job.error)
+        self.assertEqual(list(job.phases), ["decrypt-0", "postproc"])
+        self.assertEqual(job.phases["decrypt-0"]["processed"], len(shuffled))
+
+        v.refresh_from_db()
+        self.assertEqual(sorted(v.tally), clear)
+        self.assertFalse(TallyCheckpoint.objects.filter(voting=v).exists())
+
+    @override_settings(TALLY_WORKERS=0, MIXNET_PAGE_SIZE=2, MIXNET_WIRE_FORMAT="binary")
+    def test_tally_batches(self):
+        v = self.create_voting()
+        clear = [2, 3, 3, 4, 4]
+        self.store_votes(v, clear)
+
+        calls = []
+        mixnet_call = Voting.mixnet_call
+
+        def spy(voting, op, position, baseurl, msgs, **extra):
+            out = mixnet_call(voting, op, position, baseurl, msgs, **extra)
+            calls.append((op, type(msgs), type(out)))
+            return out
+
+        with mock.patch.object(Voting, "mixnet_call", spy):
+            job = jobs.submit(v, self.token)
+        self.assertEqual(job.status, TallyJob.DONE, job.error)
+        # the ciphertexts are never converted to lists between the steps
+        self.assertEqual(calls[0], ("shuffle", CiphertextBatch, CiphertextBatch))
+        self.assertTrue(all(msgs is CiphertextBatch for _, msgs, _ in calls))
+
+        v.refresh_from_db()
+        self.assertEqual(sorted(v.tally), clear)
+
+    @override_settings(TALLY_WORKERS=1)
+    def test_submit_active(self):
+        v = self.create_voting()
+        v.start_date = v.end_date = timezone.now()
+        v.save()
+        running = TallyJob.objects.create(voting=v, status=TallyJob.RUNNING)
+
+        self.assertEqual(jobs.submit(v, self.token), running)
+        data = {"action": "tally"}
+        response = self.client.put("/voting/{}/".format(v.pk), data, format="json")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["id"], running.id)
+        self.assertEqual(v.tally_jobs.count(), 1)
+
+    @override_settings(TALLY_WORKERS=0)
+    def test_failed_tally(self):
+        v = self.create_voting()
+        v.auths.clear()
+
+        job = jobs.submit(v, self.token)
+        self.assertEqual(job.status, TallyJob.FAILED)
+        self.assertTrue(job.error)
+        self.assertIsNone(jobs.active(v))
+
+
 class VotingModelTestCase(BaseTestCase):
     def setUp(self):
         q = Question(desc="Descripcion")
@@ -338,6 +682,92 @@ class VotingHierarchyModelTestCase(BaseTestCase):
             self.assertEquals(v.voting_type, "H")
 
 
+class VotingCacheTestCase(VotingMixin, BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        django_cache.clear()
+
+    def get(self, voting_id):
+        before = cache.stats()
+        voting = cache.get(voting_id)
+        after = cache.stats()
+        return voting, {k: after[k] - before[k] for k in after}
+
+    def test_read_through(self):
+        v = self.create_voting()
+
+        voting, stats = self.get(v.id)
+        self.assertEqual(stats, {"hits": 0, "local_hits": 0, "misses": 1})
+        self.assertEqual(voting["name"], "test voting")
+        self.assertEqual(len(voting["questions"][0]["options"]), 5)
+
+        with self.assertNumQueries(0):
+            cached, stats = self.get(v.id)
+        self.assertEqual(stats, {"hits": 1, "local_hits": 1, "misses": 0})
+        self.assertEqual(cached, voting)
+
+        cache.clear()
+        with self.assertNumQueries(0):
+            cached, stats = self.get(v.id)
+        self.assertEqual(stats, {"hits": 1, "local_hits": 0, "misses": 0})
+        self.assertEqual(cached, voting)
+
+        cached["name"] = "changed"
+        self.assertEqual(cache.get(v.id)["name"], "test voting")
+        self.assertIsNone(cache.get(v.id + 1))
+
+    def test_invalidation(self):
+        v = self.create_voting()
+        cache.get(v.id)
+
+        v.name = "renamed"
+        v.save()
+        self.assertEqual(cache.get(v.id)["name"], "renamed")
+
+        question = Question.objects.get(votings=v)
+        QuestionOption(question=question, option="option 6", number=7).save()
+        options = cache.get(v.id)["questions"][0]["options"]
+        self.assertEqual(options[-1]["option"], "option 6")
+
+        question.desc = "new question"
+        question.save()
+        self.assertEqual(cache.get(v.id)["questions"][0]["desc"], "new question")
+
+        other = Question(desc="other question")
+        other.save()
+        v.questions.add(other)
+        self.assertEqual(len(cache.get(v.id)["questions"]), 2)
+        other.votings.clear()
+        self.assertEqual(len(cache.get(v.id)["questions"]), 1)
+
+        self.assertIsNone(cache.get(v.id)["pub_key"])
+        v.pub_key = Key.objects.create(p=167, g=156, y=4)
+        v.save()
+        v.pub_key.y = 5
+        v.pub_key.save()
+        self.assertEqual(cache.get(v.id)["pub_key"]["y"], 5)
+
+        v.auths.clear()
+        self.assertEqual(cache.get(v.id)["auths"], [])
+
+        voting_id = v.id
+        v.delete()
+        self.assertIsNone(cache.get(voting_id))
+
+    def test_voting_view(self):
+        v = self.create_voting()
+        response = self.client.get("/voting/?id={}".format(v.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [cache.get(v.id)])
+
+        uncached = self.client.get("/voting/?id={}&version=v1".format(v.id))
+        self.assertEqual(response.json(), uncached.json())
+
+        response = self.client.get("/voting/?id={}".format(v.id + 1))
+        self.assertEqual(response.json(), [])
+
+
 class LogInSuccessTests(StaticLiveServerTestCase):
     def setUp(self):
         # Load base test functionality for decide
@@ -5,4 +5,5 @@ from . import views
 urlpatterns = [
     path("", views.VotingView.as_view(), name="voting"),
     path("<int:voting_id>/", views.VotingUpdate.as_view(), name="voting"),
+    path("tally/<int:job_id>/", views.TallyJobView.as_view(), name="tally_job"),
 ]
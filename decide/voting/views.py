@@ -4,10 +4,15 @@ from django.utils import timezone
 from django.shortcuts import get_object_or_404, render, redirect
 from rest_framework import generics, status
 from rest_framework.response import Response
-from .models import Question, QuestionOption, Voting
-from .serializers import SimpleVotingSerializer, VotingSerializer
+from . import cache, jobs
+from .models import TALLY_MODES, Question, QuestionOption, TallyJob, Voting
+from .serializers import (
+    SimpleVotingSerializer,
+    TallyJobSerializer,
+    VotingSerializer,
+)
 from base.perms import UserIsStaff
-from base.models import Auth
+from base.models import CURVES, Auth
 from django.contrib.auth.decorators import user_passes_test
 from voting.forms import QuestionForm
 
@@ -30,6 +35,12 @@ class VotingView(generics.ListCreateAPIView):
             version = settings.DEFAULT_VERSION
         if version == "v2":
             self.serializer_class = SimpleVotingSerializer
+        elif list(request.query_params) == ["id"]:
+            # the query of the other modules, mods.get("voting", params={"id": vid})
+            vid = request.query_params["id"]
+            if vid.isdigit():
+                voting = cache.get(vid)
+                return Response([voting] if voting else [])
 
         return super().get(request, *args, **kwargs)
 
@@ -50,6 +61,14 @@ class VotingView(generics.ListCreateAPIView):
                 return Response({}, status=status.HTTP_400_BAD_REQUEST)
             if not data in request.data:
                 return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        if request.data.get("curve", "") not in dict(CURVES):
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        tally_mode = request.data.get("tally_mode", "mixnet")
+        if tally_mode not in dict(TALLY_MODES) or (
+            tally_mode == "homomorphic"
+            and (request.data.get("voting_type") != "S" or request.data.get("curve"))
+        ):
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
 
         questions = [Question(desc=d) for d in request.data.get("questions")]
         for q in questions:
@@ -66,6 +85,8 @@ class VotingView(generics.ListCreateAPIView):
             name=request.data.get("name"),
             desc=request.data.get("desc"),
             voting_type=request.data.get("voting_type"),
+            curve=request.data.get("curve", ""),
+            tally_mode=tally_mode,
         )
         voting.save()
         for q in questions:
@@ -136,18 +157,27 @@ class VotingUpdate(generics.RetrieveUpdateDestroyAPIView):
             elif not voting.end_date:
                 msg = "Voting is not stopped"
                 st = status.HTTP_400_BAD_REQUEST
-            elif voting.tally:
+            elif voting.tally is not None:
                 msg = "Voting already tallied"
                 st = status.HTTP_400_BAD_REQUEST
             else:
-                voting.tally_votes(request.auth.key)
-                msg = "Voting tallied"
+                # the job already queued or running if there's one
+                job = jobs.submit(voting, request.auth.key)
+                data = TallyJobSerializer(job).data
+                return Response(data, status=status.HTTP_202_ACCEPTED)
         else:
             msg = "Action not found, try with start, stop or tally"
             st = status.HTTP_400_BAD_REQUEST
         return Response(msg, status=st)
 
 
+class TallyJobView(generics.RetrieveAPIView):
+    queryset = TallyJob.objects.all()
+    serializer_class = TallyJobSerializer
+    permission_classes = (UserIsStaff,)
+    lookup_url_kwarg = "job_id"
+
+
 @staff_required(login_url="/base")
 def create_question_YesNo(request):
     if request.method == "GET":
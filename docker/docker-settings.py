@@ -30,6 +30,9 @@ MODULES = [
     'voting',
 ]
 
+# the tallies run in the worker container
+TALLY_IN_WORKER = True
+
 BASEURL = 'http://10.5.0.1:8000'
 
 APIS = {